@@ -10,7 +10,9 @@ from datetime import datetime
 import yaml
 
 from pymetrics.anaconda import collect_anaconda_downloads
+from pymetrics.cache import LocalCache
 from pymetrics.gh_downloads import collect_github_downloads
+from pymetrics.ledger import CostLedger
 from pymetrics.main import collect_pypi_downloads
 from pymetrics.summarize import summarize_downloads
 
@@ -46,11 +48,32 @@ def _load_config(config_path):
     return config
 
 
+def _gigabytes_to_bytes(gigabytes):
+    return None if gigabytes is None else int(gigabytes * 1024**3)
+
+
 def _collect_pypi(args):
     config = _load_config(args.config_file)
     projects = args.projects or config['projects']
     output_folder = args.output_folder
     max_days = args.max_days
+    cache = None
+    if args.cache_folder:
+        cache = LocalCache(
+            args.cache_folder,
+            max_bytes=int(args.cache_max_gb * 1024**3),
+            ttl=args.cache_ttl_days * 24 * 60 * 60,
+        )
+
+    ledger = None
+    if args.ledger_path:
+        ledger = CostLedger(
+            args.ledger_path,
+            run_budget=_gigabytes_to_bytes(args.run_budget_gb),
+            monthly_budget=_gigabytes_to_bytes(args.monthly_budget_gb),
+        )
+    elif args.run_budget_gb is not None or args.monthly_budget_gb is not None:
+        raise ValueError('The byte budgets require a --ledger-path')
 
     collect_pypi_downloads(
         projects=projects,
@@ -61,6 +84,19 @@ def _collect_pypi(args):
         dry_run=args.dry_run,
         force=args.force,
         add_metrics=args.add_metrics,
+        storage=args.storage,
+        aggregate=args.aggregate,
+        incremental=args.incremental,
+        stream=args.stream,
+        cache=cache,
+        shard_days=args.shard_days,
+        parallel_queries=args.parallel_queries,
+        ledger=ledger,
+        profile=args.profile or config.get('query_profile'),
+        profiles=config.get('query_profiles'),
+        fill_gaps=args.fill_gaps,
+        jobs=args.jobs,
+        incremental_metrics=args.incremental_metrics,
     )
 
 
@@ -68,12 +104,18 @@ def _collect_anaconda(args):
     config = _load_config(args.config_file)
     projects = config['projects']
     output_folder = args.output_folder
+    cache = None
+    if args.cache_folder:
+        cache = LocalCache(args.cache_folder, max_bytes=int(args.cache_max_gb * 1024**3))
+
     collect_anaconda_downloads(
         projects=projects,
         output_folder=output_folder,
         max_days=args.max_days,
         dry_run=args.dry_run,
         verbose=args.verbose,
+        jobs=args.jobs,
+        cache=cache,
     )
 
 
@@ -102,6 +144,8 @@ def _summarize(args):
         output_folder=output_folder,
         dry_run=args.dry_run,
         verbose=args.verbose,
+        storage=args.storage,
+        incremental=args.incremental,
     )
 
 
@@ -203,6 +247,138 @@ def _get_parser():
         action='store_true',
         help='Compute the aggregation metrics and create the corresponding spreadsheets.',
     )
+    collect_pypi.add_argument(
+        '--incremental-metrics',
+        action='store_true',
+        help=(
+            'Store the aggregated metrics of the closed months and only aggregate the new '
+            'downloads of the open month. Requires the parquet storage.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes used to compute the metrics of the projects. Defaults to 1.',
+    )
+    collect_pypi.add_argument(
+        '-S',
+        '--storage',
+        choices=['csv', 'parquet'],
+        default='csv',
+        help=(
+            'Format of the downloads history: a single pypi.csv file, or Parquet files'
+            ' partitioned by project and month. Defaults to csv.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '-A',
+        '--aggregate',
+        action='store_true',
+        help=(
+            'Aggregate the downloads by day in BigQuery and store a downloads count column'
+            ' instead of one row per download.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '-i',
+        '--incremental',
+        action='store_true',
+        help=(
+            'Append only the newly queried window to the Parquet history as a new segment.'
+            ' Requires --storage parquet.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '--stream',
+        action='store_true',
+        help=(
+            'Stream the BigQuery results in batches and append each one to the Parquet'
+            ' history as it arrives, with bounded memory. Requires --storage parquet.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '-g',
+        '--fill-gaps',
+        action='store_true',
+        help=(
+            'Detect the days missing in the middle of the Parquet history, for example'
+            ' because of a failed run, and collect them. Requires --storage parquet.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '--cache-folder',
+        type=str,
+        required=False,
+        help=(
+            'Local folder in which to cache the BigQuery results of windows that are fully'
+            ' in the past, so that repeated backfills do not query them again.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '--cache-max-gb',
+        type=float,
+        default=5,
+        help='Maximum size of the query cache, in GB. Defaults to 5.',
+    )
+    collect_pypi.add_argument(
+        '--cache-ttl-days',
+        type=float,
+        default=30,
+        help='Number of days after which cached query results expire. Defaults to 30.',
+    )
+    collect_pypi.add_argument(
+        '--shard-days',
+        type=int,
+        required=False,
+        help=(
+            'Split the queried window in shards of this many days (e.g. 1 or 7) that are'
+            ' queried concurrently. With --storage parquet, every shard is checkpointed so'
+            ' that interrupted backfills resume from the last stored shard.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '--parallel-queries',
+        type=int,
+        default=4,
+        help='Maximum number of shard queries to run at the same time. Defaults to 4.',
+    )
+    collect_pypi.add_argument(
+        '-P',
+        '--profile',
+        type=str,
+        required=False,
+        help=(
+            'Query profile that decides which columns are collected: summary, metrics, full'
+            ' or one defined under query_profiles in the config file. Overrides the'
+            ' query_profile of the config file.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '--ledger-path',
+        type=str,
+        required=False,
+        help=(
+            'Path to a local SQLite file in which to record the bytes, latency and rows'
+            ' of every BigQuery query.'
+        ),
+    )
+    collect_pypi.add_argument(
+        '--run-budget-gb',
+        type=float,
+        required=False,
+        help='Maximum GBs that can be billed by BigQuery in this run. Requires --ledger-path.',
+    )
+    collect_pypi.add_argument(
+        '--monthly-budget-gb',
+        type=float,
+        required=False,
+        help=(
+            'Maximum GBs that can be billed by BigQuery in a calendar month, according to'
+            ' the ledger. Requires --ledger-path.'
+        ),
+    )
 
     # summarize
     summarize = action.add_parser(
@@ -226,6 +402,21 @@ def _get_parser():
             ' Google Drive folder path in the format gdrive://<folder-id>'
         ),
     )
+    summarize.add_argument(
+        '-S',
+        '--storage',
+        choices=['csv', 'parquet'],
+        default='csv',
+        help='Format of the downloads history, either csv or parquet. Defaults to csv.',
+    )
+    summarize.add_argument(
+        '--incremental',
+        action='store_true',
+        help=(
+            'Reuse the counts of the closed years stored by previous runs in the output folder.'
+            ' Requires --storage parquet.'
+        ),
+    )
 
     # collect Anaconda
     collect_anaconda = action.add_parser(
@@ -257,6 +448,28 @@ def _get_parser():
         default=90,
         help='Max days of data to pull. Default to last 90 days.',
     )
+    collect_anaconda.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=8,
+        help='Number of daily files to download at the same time. Defaults to 8.',
+    )
+    collect_anaconda.add_argument(
+        '--cache-folder',
+        type=str,
+        required=False,
+        help=(
+            'Local folder in which to cache the daily files, so that only the files that'
+            ' have changed upstream are downloaded again.'
+        ),
+    )
+    collect_anaconda.add_argument(
+        '--cache-max-gb',
+        type=float,
+        default=5,
+        help='Maximum size of the Anaconda cache, in GB. Defaults to 5.',
+    )
 
     # collect GitHub downloads
     collect_github = action.add_parser(
@@ -2,12 +2,18 @@
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
+import fsspec
 import pandas as pd
+import pyarrow.parquet as pq
 import requests
+import s3fs
 from tqdm import tqdm
 
+from pymetrics.cache import get_cache_key
+from pymetrics.fingerprints import FingerprintManifest
 from pymetrics.output import append_row, create_csv, get_path, load_csv
 from pymetrics.time_utils import drop_duplicates_by_date, get_current_utc
 
@@ -21,30 +27,67 @@ PREVIOUS_ANACONDA_ORG_OVERALL_FILENAME = 'anaconda_org_overall.csv'
 PREVIOUS_ANACONDA_ORG_VERSION_FILENAME = 'anaconda_org_per_version.csv'
 TIME_COLUMN = 'time'
 PKG_COLUMN = 'pkg_name'
+COUNTS_COLUMN = 'counts'
 ANACONDA_BUCKET_PATH = 's3://anaconda-package-data/conda'
+MAX_WORKERS = 8
 
 
-def _read_anaconda_parquet(URL, pkg_names=None):
-    """Read parquet file in anaconda bucket."""
-    storage_options = None
-    if 's3://' in URL:
-        storage_options = {'anon': True}
+def _get_validator(filesystem, path):
+    """Get the ETag of a file, or its modification time, which changes with its contents."""
+    info = filesystem.info(path)
+    return str(info.get('ETag') or info.get('LastModified') or info.get('mtime'))
+
+
+def _read_anaconda_parquet(URL, pkg_names=None, filesystem=None, columns=None, cache=None):
+    """Read parquet file in anaconda bucket.
+
+    The package filter and the columns are pushed down to pyarrow, so the row groups
+    that do not contain any of the packages, and the columns that are not needed, are
+    neither downloaded nor decoded, and the requested columns that are not in the file
+    are skipped. If a ``cache`` is given, the filtered contents are stored in it,
+    validated with the ETag of the file, so they are only downloaded again once the
+    file changes upstream.
+    """
+    if filesystem is None:
+        storage_options = {'anon': True} if 's3://' in URL else {}
+        filesystem, path = fsspec.core.url_to_fs(URL, **storage_options)
+    else:
+        path = fsspec.core.split_protocol(URL)[1]
+
+    filters = None
+    if pkg_names:
+        filters = [(PKG_COLUMN, 'in', list(pkg_names))]
+
     try:
-        df = pd.read_parquet(
-            URL,
-            storage_options=storage_options,
-            engine='pyarrow',
-            dtype_backend='pyarrow',
-        )
-        df[TIME_COLUMN] = pd.to_datetime(df[TIME_COLUMN])
-        if pkg_names:
-            df = df[df[PKG_COLUMN].isin(set(pkg_names))]
+        table = None
+        if cache is not None:
+            validator = _get_validator(filesystem, path)
+            cache_key = get_cache_key(URL, sorted(pkg_names or []), columns)
+            table = cache.get(cache_key, validator)
+
+        if table is None:
+            if columns is not None:
+                # Skip the columns that the file does not have, like the ones added or
+                # removed upstream since the downloads were stored.
+                names = pq.read_schema(path, filesystem=filesystem).names
+                columns = [column for column in columns if column in names]
+
+            table = pq.read_table(path, filesystem=filesystem, columns=columns, filters=filters)
+            if cache is not None:
+                cache.put(cache_key, table, validator)
     except FileNotFoundError:
         return pd.DataFrame()
+
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    if TIME_COLUMN in df:
+        df[TIME_COLUMN] = pd.to_datetime(df[TIME_COLUMN])
+
     return df
 
 
-def _anaconda_package_data_by_day(year, month, day, pkg_names=None):
+def _anaconda_package_data_by_day(
+    year, month, day, pkg_names=None, filesystem=None, columns=None, cache=None
+):
     """Anaconda download data on a per day basis.
 
     More information: https://github.com/anaconda/anaconda-package-data
@@ -56,11 +99,62 @@ def _anaconda_package_data_by_day(year, month, day, pkg_names=None):
 
     filename = f'{padded_year}-{padded_month}-{padded_day}.parquet'
     URL = f'{ANACONDA_BUCKET_PATH}/hourly/{padded_year}/{padded_month}/{filename}'
-    return _read_anaconda_parquet(URL, pkg_names=pkg_names)
+    return _read_anaconda_parquet(
+        URL, pkg_names=pkg_names, filesystem=filesystem, columns=columns, cache=cache
+    )
+
 
+def _anaconda_package_data_by_days(
+    dates, pkg_names=None, jobs=MAX_WORKERS, filesystem=None, columns=None, cache=None
+):
+    """Anaconda download data of several days, fetched concurrently.
+
+    The files are read by a pool of ``jobs`` threads that share a single anonymous S3
+    filesystem, so the reads of different days overlap instead of waiting for each other.
+
+    Args:
+        dates (pandas.DatetimeIndex):
+            Days to get the downloads of.
+        pkg_names (list[str] or None):
+            Packages to get the downloads of. If `None`, get all of them.
+        jobs (int):
+            Maximum number of files read at the same time. Defaults to 8.
+        filesystem (fsspec.AbstractFileSystem or None):
+            Filesystem to read the files from. Defaults to an anonymous S3 filesystem.
+        columns (list[str] or None):
+            Columns to read. If `None`, read all of them.
+        cache (pymetrics.cache.LocalCache or None):
+            If given, the files that have not changed since they were cached are read
+            from this cache instead of the bucket.
+
+    Returns:
+        list[tuple[pandas.Timestamp, pandas.DataFrame]]:
+            The downloads of every day, in the order of the given dates.
+    """
+    if filesystem is None:
+        filesystem = s3fs.S3FileSystem(anon=True)
+
+    def fetch(date):
+        return _anaconda_package_data_by_day(
+            year=date.year,
+            month=date.month,
+            day=date.day,
+            pkg_names=pkg_names,
+            filesystem=filesystem,
+            columns=columns,
+            cache=cache,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        downloads = list(tqdm(executor.map(fetch, dates), total=len(dates)))
 
-def anaconda_package_data_by_year_month(year, month, pkg_names=None):
-    """Anaconda download data on a per month basis. Unused.
+    return list(zip(dates, downloads))
+
+
+def anaconda_package_data_by_year_month(
+    year, month, pkg_names=None, filesystem=None, columns=None, cache=None
+):
+    """Anaconda download data on a per month basis.
 
     More information: https://github.com/anaconda/anaconda-package-data
 
@@ -69,7 +163,121 @@ def anaconda_package_data_by_year_month(year, month, pkg_names=None):
     padded_month = '{:02d}'.format(month)
     filename = f'{padded_year}-{padded_month}.parquet'
     URL = f'{ANACONDA_BUCKET_PATH}/monthly/{padded_year}/{filename}'
-    return _read_anaconda_parquet(URL, pkg_names=pkg_names)
+    return _read_anaconda_parquet(
+        URL, pkg_names=pkg_names, filesystem=filesystem, columns=columns, cache=cache
+    )
+
+
+def _get_complete_months(previous, monthly_downloads, pkg_names=None):
+    """Get the months whose stored daily downloads add up to the counts of their monthly file.
+
+    Args:
+        previous (pandas.DataFrame):
+            Daily downloads already stored.
+        monthly_downloads (list[tuple[pandas.Timestamp, pandas.DataFrame]]):
+            First day and contents of the monthly file of every month to check.
+        pkg_names (list[str] or None):
+            Packages to compare. If `None`, compare all of them.
+
+    Returns:
+        set[pandas.Timestamp]:
+            First day of the months whose stored downloads are complete.
+    """
+    if pkg_names:
+        previous = previous[previous[PKG_COLUMN].isin(set(pkg_names))]
+
+    times = previous[TIME_COLUMN]
+    keys = [times.dt.year, times.dt.month, previous[PKG_COLUMN]]
+    stored = {}
+    for (year, month, pkg_name), count in previous[COUNTS_COLUMN].groupby(keys).sum().items():
+        if count:
+            stored.setdefault((year, month), {})[str(pkg_name)] = int(count)
+
+    complete = set()
+    for month_start, monthly in monthly_downloads:
+        if monthly.empty:
+            continue
+
+        expected = monthly.groupby(PKG_COLUMN)[COUNTS_COLUMN].sum()
+        expected = {str(pkg_name): int(count) for pkg_name, count in expected.items() if count}
+        if stored.get((month_start.year, month_start.month), {}) == expected:
+            complete.add(month_start)
+
+    return complete
+
+
+def _plan_anaconda_dates(
+    previous, dates, pkg_names=None, jobs=MAX_WORKERS, filesystem=None, cache=None
+):
+    """Get the days whose daily files must be downloaded.
+
+    The days of the open month, which is the month of the last date, are always
+    downloaded. The days of every closed month are only downloaded if the daily
+    downloads already stored for the month do not reconcile with its monthly file,
+    so a closed month takes a single read once it is complete.
+
+    Args:
+        previous (pandas.DataFrame):
+            Daily downloads already stored.
+        dates (pandas.DatetimeIndex):
+            Days to collect.
+        pkg_names (list[str] or None):
+            Packages to collect. If `None`, collect all of them.
+        jobs (int):
+            Maximum number of monthly files read at the same time. Defaults to 8.
+        filesystem (fsspec.AbstractFileSystem or None):
+            Filesystem to read the files from. Defaults to an anonymous S3 filesystem.
+        cache (pymetrics.cache.LocalCache or None):
+            If given, the monthly files are cached in it.
+
+    Returns:
+        pandas.DatetimeIndex:
+            The days to download.
+    """
+    if filesystem is None:
+        filesystem = s3fs.S3FileSystem(anon=True)
+
+    month_starts = dates.to_period('M').to_timestamp()
+    closed_months = month_starts[month_starts < month_starts[-1]].unique()
+
+    def fetch(month_start):
+        return anaconda_package_data_by_year_month(
+            year=month_start.year,
+            month=month_start.month,
+            pkg_names=pkg_names,
+            filesystem=filesystem,
+            columns=[PKG_COLUMN, COUNTS_COLUMN],
+            cache=cache,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        monthly_downloads = list(zip(closed_months, executor.map(fetch, closed_months)))
+
+    complete = _get_complete_months(previous, monthly_downloads, pkg_names)
+    LOGGER.info('Skipping the daily files of %s complete months', len(complete))
+    return dates[~month_starts.isin(list(complete))]
+
+
+def _get_download_keys(downloads):
+    """Get the (date, package) key of every row of the downloads."""
+    dates = downloads[TIME_COLUMN].dt.normalize()
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+
+    return pd.MultiIndex.from_arrays([dates, downloads[PKG_COLUMN].astype(str)])
+
+
+def _upsert_downloads(previous, new_downloads):
+    """Replace the stored downloads of every (date, package) pair that has new downloads.
+
+    The new downloads of all the days are merged with a single anti-join, so the stored
+    downloads are only scanned and copied once.
+    """
+    if new_downloads.empty:
+        return previous
+
+    replaced = _get_download_keys(previous).isin(_get_download_keys(new_downloads))
+    return pd.concat([previous[~replaced], new_downloads], ignore_index=True)
 
 
 def _get_previous_anaconda_downloads(output_folder, filename):
@@ -140,6 +348,8 @@ def collect_anaconda_downloads(
     max_days=90,
     dry_run=False,
     verbose=False,
+    jobs=MAX_WORKERS,
+    cache=None,
 ):
     """Pull data about the downloads of a list of projects from Anaconda.
 
@@ -159,6 +369,11 @@ def collect_anaconda_downloads(
             If `True`, do not upload the results. Defaults to `False`.
         verbose (bool):
             If `True`, will output dataframes tails of anaconda data. Defaults to `False`.
+        jobs (int):
+            Maximum number of daily files downloaded at the same time. Defaults to 8.
+        cache (pymetrics.cache.LocalCache or None):
+            If given, the daily files are cached in it, and only the files that have
+            changed upstream since they were cached are downloaded again.
     """
     overall_df, version_downloads = _collect_ananconda_downloads_from_website(
         projects, output_folder=output_folder
@@ -172,20 +387,26 @@ def collect_anaconda_downloads(
     LOGGER.info(f'Getting daily anaconda data for start_date>={start_date} to end_date<{end_date}')
     date_ranges = pd.date_range(start=start_date, end=end_date, freq='D')
     all_downloads_count = len(previous)
-    for iteration_datetime in tqdm(date_ranges):
-        new_downloads = _anaconda_package_data_by_day(
-            year=iteration_datetime.year,
-            month=iteration_datetime.month,
-            day=iteration_datetime.day,
-            pkg_names=projects,
-        )
-        if len(new_downloads) > 0:
-            # Keep only the newest data (on a per day basis) for all packages
-            previous = previous[previous[TIME_COLUMN].dt.date != iteration_datetime.date()]
-            previous = pd.concat([previous, new_downloads], ignore_index=True)
+    filesystem = s3fs.S3FileSystem(anon=True)
+    date_ranges = _plan_anaconda_dates(
+        previous, date_ranges, pkg_names=projects, jobs=jobs, filesystem=filesystem, cache=cache
+    )
+    # Only read the columns already stored, so that anaconda.csv keeps the same columns.
+    daily_downloads = _anaconda_package_data_by_days(
+        date_ranges,
+        pkg_names=projects,
+        jobs=jobs,
+        filesystem=filesystem,
+        columns=list(previous.columns),
+        cache=cache,
+    )
+    new_downloads = [downloads for _, downloads in daily_downloads if len(downloads) > 0]
+    if new_downloads:
+        # Keep only the newest data (on a per day basis) for every package
+        previous = _upsert_downloads(previous, pd.concat(new_downloads, ignore_index=True))
 
     previous = previous.sort_values(TIME_COLUMN)
-    LOGGER.info('Obtained %s new downloads', all_downloads_count - len(previous))
+    LOGGER.info('Obtained %s new downloads', len(previous) - all_downloads_count)
 
     if verbose:
         LOGGER.info(f'{PREVIOUS_ANACONDA_FILENAME} tail')
@@ -196,13 +417,15 @@ def collect_anaconda_downloads(
         LOGGER.info(version_downloads.tail(5).to_string())
 
     if not dry_run:
+        fingerprints = FingerprintManifest(output_folder)
         gfolder_path = f'{output_folder}/{PREVIOUS_ANACONDA_FILENAME}'
-        create_csv(output_path=gfolder_path, data=previous)
+        create_csv(output_path=gfolder_path, data=previous, fingerprints=fingerprints)
 
         gfolder_path = f'{output_folder}/{PREVIOUS_ANACONDA_ORG_OVERALL_FILENAME}'
-        create_csv(output_path=gfolder_path, data=overall_df)
+        create_csv(output_path=gfolder_path, data=overall_df, fingerprints=fingerprints)
 
         gfolder_path = f'{output_folder}/{PREVIOUS_ANACONDA_ORG_VERSION_FILENAME}'
-        create_csv(output_path=gfolder_path, data=version_downloads)
+        create_csv(output_path=gfolder_path, data=version_downloads, fingerprints=fingerprints)
+        fingerprints.save()
 
     return None
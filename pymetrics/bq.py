@@ -2,18 +2,33 @@
 
 # pylint: disable=E1101
 
+import contextlib
 import json
 import logging
 import os
 import pathlib
+import time
 
-from google.cloud import bigquery
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud import bigquery, bigquery_storage
 from google.oauth2 import service_account
 
+from pymetrics.cache import get_cache_key
+from pymetrics.ledger import get_query_shape
+
 LOGGER = logging.getLogger(__name__)
 
+# https://cloud.google.com/bigquery/pricing#on_demand_pricing
+# assuming have hit 1 terabyte processed in month
+COST_PER_TERABYTE = 6.15
+# BigQuery bills at least 10 MB per query, whatever the bytes processed.
+MIN_BYTES_BILLED = 10 * 1024**2
+# Reused estimates can fall a bit short of the bytes that the query ends up billing.
+ESTIMATE_MARGIN = 0.1
 
-def _get_bq_client(credentials_file):
+
+def _get_bq_credentials(credentials_file):
     if credentials_file:
         LOGGER.info('Loading BigQuery credentials from %s', credentials_file)
         credentials_contents = pathlib.Path(credentials_file).read_text()
@@ -38,41 +53,213 @@ def _get_bq_client(credentials_file):
             scopes=['https://www.googleapis.com/auth/cloud-platform'],
         )
 
+    return credentials
+
+
+def _get_bq_client(credentials_file):
+    credentials = _get_bq_credentials(credentials_file)
     return bigquery.Client(
         credentials=credentials,
         project=credentials.project_id,
     )
 
 
-def run_query(query, dry_run=False, credentials_file=None):
-    """Run a BigQuery query and return the query_job object."""
-    client = _get_bq_client(credentials_file)
+def _log_estimate(bytes):
+    LOGGER.info('Estimated data processed in query (GBs): %.2f', bytes_to_gigabytes(bytes))
+    cost = COST_PER_TERABYTE * bytes_to_terabytes(bytes)
+    LOGGER.info('Estimated cost for query: $%.2f', cost)
 
-    LOGGER.debug('Running query %s', query)
 
-    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
-    dry_run_job = client.query(query, job_config=job_config)
-    data_processed_gbs = dry_run_job.total_bytes_processed / 1024**3
-    LOGGER.info('Estimated data processed in query (GBs): %.2f', data_processed_gbs)
-    # https://cloud.google.com/bigquery/pricing#on_demand_pricing
-    # assuming have hit 1 terabyte processed in month
-    cost_per_terabyte = 6.15
-    bytes = dry_run_job.total_bytes_processed
-    cost = cost_per_terabyte * bytes_to_terabytes(bytes)
-    LOGGER.info('Estimated cost for query: $%.2f', cost)
+def _estimate_query(client, query, ledger=None):
+    """Estimate the bytes processed by a query, reusing recent estimates from the ledger."""
+    shape = get_query_shape(query) if ledger is not None else None
+    bytes = ledger.get_estimate(shape) if ledger is not None else None
+    if bytes is not None:
+        LOGGER.info('Reusing the estimate of a recent query with the same shape')
+    else:
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        dry_run_job = client.query(query, job_config=job_config)
+        bytes = dry_run_job.total_bytes_processed
+        if ledger is not None:
+            ledger.record(shape, bytes)
 
-    if dry_run:
+    _log_estimate(bytes)
+    return bytes
+
+
+def _reserve_budget(estimated_bytes, ledger=None):
+    """Reserve the bytes of a query job from the remaining budget of the ledger."""
+    if ledger is None:
         return None
 
-    query_job = client.query(query)
-    data = query_job.to_dataframe()
+    max_bytes = max(int(estimated_bytes * (1 + ESTIMATE_MARGIN)), MIN_BYTES_BILLED)
+    return ledger.reserve(estimated_bytes, max_bytes)
+
+
+def _get_job_config(reservation=None):
+    """Get the config of a query job, limiting its billed bytes to its reservation."""
+    job_config = bigquery.QueryJobConfig()
+    if reservation is not None:
+        job_config.maximum_bytes_billed = reservation
+
+    return job_config
+
+
+def _log_query_cost(query_job, query, latency, rows, ledger=None, reservation=None):
     LOGGER.info('Total processed GBs: %.2f', query_job.total_bytes_processed / 1024**3)
     LOGGER.info('Total billed GBs: %.2f', query_job.total_bytes_billed / 1024**3)
-    cost = cost_per_terabyte * bytes_to_terabytes(query_job.total_bytes_billed)
+    cost = COST_PER_TERABYTE * bytes_to_terabytes(query_job.total_bytes_billed)
     LOGGER.info('Total cost for query: $%.2f', cost)
+    if ledger is not None:
+        ledger.record(
+            get_query_shape(query),
+            query_job.total_bytes_processed,
+            query_job.total_bytes_billed,
+            latency=latency,
+            rows=rows,
+            reservation=reservation,
+        )
+
+
+def run_query(query, dry_run=False, credentials_file=None, cache=None, ledger=None):
+    """Run a BigQuery query and return the results as a DataFrame.
+
+    Args:
+        query (str):
+            Query to run.
+        dry_run (bool):
+            If `True`, only estimate the cost of the query and return `None`.
+        credentials_file (str):
+            Path to the GCP Credentials file for BigQuery.
+        cache (pymetrics.cache.LocalCache or None):
+            If given, the results are read from this cache when the same query has already
+            been run, and stored in it otherwise. Only queries over data that will not
+            change anymore should be cached.
+        ledger (pymetrics.ledger.CostLedger or None):
+            If given, the query is recorded in this ledger, its billed bytes are reserved
+            from the remaining budget and limited to that reservation, and the dry run
+            estimate is skipped if the ledger has a recent one for a query of the same shape.
+
+    Returns:
+        pandas.DataFrame or None:
+            The query results, or `None` if ``dry_run`` is `True`.
+    """
+    cache_key = get_cache_key(query) if cache is not None else None
+    if cache is not None:
+        table = cache.get(cache_key)
+        if table is not None:
+            LOGGER.info('Query results found in the local cache, skipping BigQuery')
+            return None if dry_run else table.to_pandas()
+
+    client = _get_bq_client(credentials_file)
+
+    LOGGER.debug('Running query %s', query)
+    estimated_bytes = _estimate_query(client, query, ledger)
+    if dry_run:
+        return None
+
+    reservation = _reserve_budget(estimated_bytes, ledger)
+    try:
+        start_time = time.monotonic()
+        query_job = client.query(query, job_config=_get_job_config(reservation))
+        data = query_job.to_dataframe()
+        latency = time.monotonic() - start_time
+        _log_query_cost(query_job, query, latency, len(data), ledger, reservation)
+    except BaseException:
+        if ledger is not None:
+            ledger.release(reservation)
+
+        raise
+
+    if cache is not None:
+        cache.put(cache_key, pa.Table.from_pandas(data, preserve_index=False))
+
     return data
 
 
+def _iter_cached_batches(path):
+    num_rows = 0
+    for batch in pq.ParquetFile(path).iter_batches():
+        num_rows += batch.num_rows
+        yield batch
+
+    LOGGER.info('Read %s cached rows', num_rows)
+
+
+def run_query_batches(query, dry_run=False, credentials_file=None, cache=None, ledger=None):
+    """Run a BigQuery query and yield its results as Arrow record batches.
+
+    The results are downloaded using the BigQuery Storage Read API, which streams
+    them in batches, so the whole result never needs to be held in memory at once.
+
+    Args:
+        query (str):
+            Query to run.
+        dry_run (bool):
+            If `True`, only estimate the cost of the query and yield nothing.
+        credentials_file (str):
+            Path to the GCP Credentials file for BigQuery.
+        cache (pymetrics.cache.LocalCache or None):
+            If given, the batches are read from this cache when the same query has already
+            been run, and written to it as they arrive otherwise.
+        ledger (pymetrics.ledger.CostLedger or None):
+            If given, the query is recorded in this ledger and its billed bytes are
+            reserved from the remaining budget and limited to that reservation.
+
+    Yields:
+        pyarrow.RecordBatch:
+            Batches of rows of the query results.
+    """
+    cache_key = get_cache_key(query) if cache is not None else None
+    if cache is not None:
+        path = cache.get_path(cache_key)
+        if path is not None:
+            LOGGER.info('Query results found in the local cache, skipping BigQuery')
+            if not dry_run:
+                yield from _iter_cached_batches(path)
+
+            return
+
+    credentials = _get_bq_credentials(credentials_file)
+    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+
+    LOGGER.debug('Running query %s', query)
+    estimated_bytes = _estimate_query(client, query, ledger)
+    if dry_run:
+        return
+
+    reservation = _reserve_budget(estimated_bytes, ledger)
+    try:
+        start_time = time.monotonic()
+        query_job = client.query(query, job_config=_get_job_config(reservation))
+        rows = query_job.result()
+        bqstorage_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+        batches = rows.to_arrow_iterable(bqstorage_client=bqstorage_client)
+        with contextlib.ExitStack() as stack:
+            writer = None
+            num_rows = 0
+            for batch in batches:
+                if cache is not None:
+                    if writer is None:
+                        writer = stack.enter_context(cache.writer(cache_key, batch.schema))
+
+                    writer.write_batch(batch)
+
+                num_rows += batch.num_rows
+                LOGGER.debug('Received batch of %s rows', batch.num_rows)
+                yield batch
+
+        LOGGER.info('Received %s rows', num_rows)
+        latency = time.monotonic() - start_time
+        _log_query_cost(query_job, query, latency, num_rows, ledger, reservation)
+    except BaseException:
+        # Also when the batches are not consumed to the end and the generator is closed
+        if ledger is not None:
+            ledger.release(reservation)
+
+        raise
+
+
 def bytes_to_megabytes(bytes):
     """Convert bytes to megabytes."""
     return bytes / 1024 / 1024
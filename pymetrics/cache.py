@@ -0,0 +1,189 @@
+"""Local on-disk cache of Arrow tables."""
+
+import contextlib
+import hashlib
+import json
+import logging
+import pathlib
+import threading
+import time
+import uuid
+
+import pyarrow.parquet as pq
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.json'
+DEFAULT_MAX_BYTES = 5 * 1024**3
+
+
+def get_cache_key(*parts):
+    """Get a cache key by hashing the given parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+class LocalCache:
+    """Cache of Arrow tables stored as Parquet files in a local folder.
+
+    Entries are evicted in least recently used order whenever the total size of the
+    cache exceeds ``max_bytes``, and are considered stale once they are older than
+    ``ttl`` seconds. Optionally, every entry can store a ``validator`` value, such as
+    an ETag, which must match on lookup for the entry to be used.
+
+    Args:
+        folder (str):
+            Local folder where the cache is stored.
+        max_bytes (int):
+            Maximum total size of the cached files. Defaults to 5 GB.
+        ttl (float or None):
+            Maximum age of the entries, in seconds. If `None`, entries never expire.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.folder = pathlib.Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+
+    def _load_index(self):
+        index_path = self.folder / INDEX_FILENAME
+        if not index_path.exists():
+            return {}
+
+        index = json.loads(index_path.read_text())
+        return {key: entry for key, entry in index.items() if (self.folder / key).exists()}
+
+    def _save_index(self):
+        index_path = self.folder / INDEX_FILENAME
+        temp_path = index_path.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+        temp_path.write_text(json.dumps(self._index))
+        temp_path.replace(index_path)
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        (self.folder / key).unlink(missing_ok=True)
+
+    def _evict(self):
+        total_bytes = sum(entry['size'] for entry in self._index.values())
+        by_access = sorted(self._index, key=lambda key: self._index[key]['accessed'])
+        for key in by_access:
+            if total_bytes <= self.max_bytes:
+                break
+
+            LOGGER.debug('Evicting cache entry %s', key)
+            total_bytes -= self._index[key]['size']
+            self._remove(key)
+
+    def get_path(self, key, validator=None):
+        """Get the path to the file of a valid cache entry.
+
+        Args:
+            key (str):
+                Key of the entry.
+            validator (str or None):
+                If given, the entry is only valid if it was stored with the same validator.
+
+        Returns:
+            pathlib.Path or None:
+                Path to the cached Parquet file, or `None` if there is no valid entry.
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+
+            now = time.time()
+            expired = self.ttl is not None and now - entry['created'] > self.ttl
+            if expired or (validator is not None and entry.get('validator') != validator):
+                LOGGER.debug('Discarding stale cache entry %s', key)
+                self._remove(key)
+                self._save_index()
+                return None
+
+            entry['accessed'] = now
+            self._save_index()
+            return self.folder / key
+
+    def get(self, key, validator=None):
+        """Get the table stored in a cache entry.
+
+        Args:
+            key (str):
+                Key of the entry.
+            validator (str or None):
+                If given, the entry is only valid if it was stored with the same validator.
+
+        Returns:
+            pyarrow.Table or None:
+                The cached table, or `None` if there is no valid entry.
+        """
+        path = self.get_path(key, validator)
+        if path is None:
+            return None
+
+        LOGGER.info('Loading cached table %s', key)
+        return pq.read_table(path)
+
+    def _register(self, key, temp_path, validator):
+        with self._lock:
+            temp_path.replace(self.folder / key)
+            now = time.time()
+            self._index[key] = {
+                'created': now,
+                'accessed': now,
+                'size': (self.folder / key).stat().st_size,
+                'validator': validator,
+            }
+            self._evict()
+            self._save_index()
+
+    def put(self, key, table, validator=None):
+        """Store a table in the cache.
+
+        Args:
+            key (str):
+                Key of the entry.
+            table (pyarrow.Table):
+                Table to store.
+            validator (str or None):
+                Value that must be given on lookup for the entry to be valid.
+        """
+        temp_path = self.folder / f'{key}.{uuid.uuid4().hex}.tmp'
+        pq.write_table(table, temp_path, compression='zstd')
+        self._register(key, temp_path, validator)
+
+    @contextlib.contextmanager
+    def writer(self, key, schema, validator=None):
+        """Store a table in the cache one batch at a time.
+
+        The entry is only registered if the block exits without errors.
+
+        Args:
+            key (str):
+                Key of the entry.
+            schema (pyarrow.Schema):
+                Schema of the table.
+            validator (str or None):
+                Value that must be given on lookup for the entry to be valid.
+
+        Yields:
+            pyarrow.parquet.ParquetWriter:
+                Writer to which the batches must be written.
+        """
+        temp_path = self.folder / f'{key}.{uuid.uuid4().hex}.tmp'
+        writer = pq.ParquetWriter(temp_path, schema, compression='zstd')
+        try:
+            yield writer
+            writer.close()
+            self._register(key, temp_path, validator)
+        except BaseException:
+            writer.close()
+            temp_path.unlink(missing_ok=True)
+            raise
@@ -71,6 +71,22 @@ def _find_file(drive, filename, folder):
     raise FileNotFoundError(f"File '{filename}' not found in Google Drive folder {folder}")
 
 
+def list_files(folder):
+    """List the names of the files stored in a google drive folder.
+
+    Args:
+        folder (str):
+            Id of the Google Drive Folder to list.
+
+    Returns:
+        list[str]:
+            Titles of the files found in the folder.
+    """
+    drive = _get_drive_client()
+    query = {'q': f"'{folder}' in parents and trashed=false"}
+    return [found_file['title'] for found_file in drive.ListFile(query).GetList()]
+
+
 def upload(content, filename, folder, convert=False):
     """Upload a file to google drive.
 
@@ -100,6 +116,25 @@ def upload(content, filename, folder, convert=False):
     LOGGER.info(f'Uploaded filename {filename}')
 
 
+def delete(folder, filename):
+    """Delete a file from google drive.
+
+    Args:
+        folder (str):
+            Id of the Google Drive Folder where the file is stored.
+        filename (str):
+            Name of the file to delete.
+
+    Raises:
+        FileNotFoundError:
+            If the file does not exist in the indicated folder.
+    """
+    drive = _get_drive_client()
+    drive_file = _find_file(drive, filename, folder)
+    drive_file.Delete()
+    LOGGER.info(f'Deleted filename {filename}')
+
+
 def download(folder, filename, xlsx=False):
     """Download a file from google drive.
 
@@ -0,0 +1,66 @@
+"""Fingerprints of the output files, used to skip rewriting files that have not changed.
+
+The fingerprint of every file written to an output folder is a hash of its serialized
+contents, recorded in the ``fingerprints.csv`` file of the same folder. Files whose
+new contents have the same fingerprint as the last written version are not uploaded
+again. Files modified or deleted outside of pymetrics are not detected, so the
+fingerprints file must be deleted to force them to be written again.
+"""
+
+import hashlib
+import logging
+
+import pandas as pd
+
+from pymetrics.output import create_csv, get_path, load_csv
+
+LOGGER = logging.getLogger(__name__)
+
+FINGERPRINTS_FILENAME = 'fingerprints.csv'
+FINGERPRINT_COLUMNS = ['filename', 'fingerprint']
+
+
+def get_fingerprint(contents):
+    """Get the fingerprint of the serialized contents of a file."""
+    return hashlib.blake2b(contents, digest_size=16).hexdigest()
+
+
+class FingerprintManifest:
+    """Fingerprints of the last contents written to each file of an output folder.
+
+    The fingerprints are loaded when the manifest is created, and the new ones are
+    only stored when ``save`` is called, so that a run uploads the manifest once.
+
+    Args:
+        output_folder (str):
+            Folder in which the output files and the manifest are stored.
+    """
+
+    def __init__(self, output_folder):
+        self.path = get_path(output_folder, FINGERPRINTS_FILENAME)
+        fingerprints = load_csv(self.path, {'dtype': str})
+        self.fingerprints = {}
+        if fingerprints is not None:
+            self.fingerprints = dict(
+                zip(fingerprints['filename'], fingerprints['fingerprint'], strict=True)
+            )
+
+        self._modified = False
+
+    def is_unchanged(self, filename, contents):
+        """Tell whether the contents of a file are the same as the last ones written."""
+        return self.fingerprints.get(filename) == get_fingerprint(contents)
+
+    def record(self, filename, contents):
+        """Record the contents just written to a file."""
+        self.fingerprints[filename] = get_fingerprint(contents)
+        self._modified = True
+
+    def save(self):
+        """Store the manifest, if any fingerprint has been recorded since it was loaded."""
+        if not self._modified:
+            return
+
+        fingerprints = pd.DataFrame(list(self.fingerprints.items()), columns=FINGERPRINT_COLUMNS)
+        create_csv(self.path, fingerprints)
+        self._modified = False
@@ -0,0 +1,90 @@
+"""Functions to detect the days missing from a downloads history."""
+
+import numpy as np
+import pandas as pd
+
+
+def get_day_coverage(downloads, projects, windows=None):
+    """Build a bitmap of the days covered by the history of each project.
+
+    A day is covered if there are downloads on it or if it is within any of the
+    ``windows`` that have already been collected, even if they had no downloads.
+
+    Args:
+        downloads (pandas.DataFrame):
+            Table with at least the ``project`` and ``timestamp`` columns.
+        projects (list[str]):
+            Projects to include in the bitmap.
+        windows (pandas.DataFrame or None):
+            Collected windows, with the ``project``, ``start_date`` and ``end_date``
+            columns, where ``end_date`` is exclusive.
+
+    Returns:
+        pandas.DataFrame:
+            Boolean table with one row per project and one column per day, from the
+            first to the last covered day of any project. Empty if nothing is covered.
+    """
+    projects = pd.Index(projects)
+    downloads = downloads[downloads['project'].isin(projects)]
+    days = pd.to_datetime(downloads['timestamp']).to_numpy().astype('datetime64[D]')
+    starts = np.array([], dtype='datetime64[D]')
+    ends = np.array([], dtype='datetime64[D]')
+    if windows is not None:
+        windows = windows[windows['project'].isin(projects)]
+        starts = pd.to_datetime(windows['start_date']).to_numpy().astype('datetime64[D]')
+        ends = pd.to_datetime(windows['end_date']).to_numpy().astype('datetime64[D]')
+
+    bounds = np.concatenate([days, starts, ends - 1])
+    if not len(bounds):
+        return pd.DataFrame(index=projects, dtype=bool)
+
+    first_day = bounds.min()
+    num_days = (bounds.max() - first_day).astype(int) + 1
+    bitmap = np.zeros((len(projects), num_days), dtype=bool)
+    rows = projects.get_indexer(downloads['project'])
+    bitmap[rows, (days - first_day).astype(int)] = True
+
+    if windows is not None and len(windows):
+        # Mark the collected windows with a cumulative sum of +1/-1 boundaries per row.
+        rows = projects.get_indexer(windows['project'])
+        deltas = np.zeros((len(projects), num_days + 1), dtype=int)
+        np.add.at(deltas, (rows, (starts - first_day).astype(int)), 1)
+        np.add.at(deltas, (rows, (ends - first_day).astype(int)), -1)
+        bitmap |= deltas.cumsum(axis=1)[:, :-1] > 0
+
+    columns = pd.date_range(pd.Timestamp(first_day), periods=num_days, freq='D')
+    return pd.DataFrame(bitmap, index=projects, columns=columns)
+
+
+def get_missing_ranges(coverage):
+    """Get the ranges of consecutive days missing between the covered days of each project.
+
+    Days before the first covered day or after the last covered day of a project
+    are not considered missing.
+
+    Args:
+        coverage (pandas.DataFrame):
+            Bitmap of covered days, as returned by ``get_day_coverage``.
+
+    Returns:
+        dict[str, list[tuple[pandas.Timestamp, pandas.Timestamp]]]:
+            The ``[start, end)`` ranges missing for each project that has any.
+    """
+    days = coverage.columns
+    bitmap = coverage.to_numpy()
+    missing = {}
+    for project, covered in zip(coverage.index, bitmap):
+        covered_days = np.flatnonzero(covered)
+        if not len(covered_days):
+            continue
+
+        inner = ~covered[covered_days[0] : covered_days[-1] + 1]
+        edges = np.diff(np.concatenate([[0], inner.astype(int), [0]]))
+        starts = np.flatnonzero(edges == 1) + covered_days[0]
+        ends = np.flatnonzero(edges == -1) + covered_days[0]
+        if len(starts):
+            missing[project] = [
+                (days[start], days[end]) for start, end in zip(starts, ends, strict=True)
+            ]
+
+    return missing
@@ -7,6 +7,7 @@ from collections import defaultdict
 import pandas as pd
 from tqdm import tqdm
 
+from pymetrics.fingerprints import FingerprintManifest
 from pymetrics.github import GithubClient
 from pymetrics.output import append_row, create_csv, get_path, load_csv
 from pymetrics.time_utils import drop_duplicates_by_date, get_current_utc
@@ -134,5 +135,7 @@ def collect_github_downloads(
     overall_df.to_csv('github_download_counts.csv', index=False)
 
     if not dry_run:
+        fingerprints = FingerprintManifest(output_folder)
         gfolder_path = f'{output_folder}/{GITHUB_DOWNLOAD_COUNT_FILENAME}'
-        create_csv(output_path=gfolder_path, data=overall_df)
+        create_csv(output_path=gfolder_path, data=overall_df, fingerprints=fingerprints)
+        fingerprints.save()
@@ -0,0 +1,578 @@
+"""Functions to store PyPI downloads in a partitioned Parquet history.
+
+The history is stored as Parquet files partitioned by project and month, named
+``pypi_{project}_{year-month}_{segment}.parquet``, inside the output folder. This allows
+the daily collection to only write the partitions affected by the newly queried
+window, and the readers to only load the projects and months they need.
+
+Every write creates a new segment, identified by its UTC creation time, and records
+the date range that it covers for each project in the ``pypi_manifest.csv`` file.
+When the covered ranges of several segments overlap, the rows of the newest segment
+replace the ones of the older segments.
+"""
+
+import logging
+import os
+import re
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from pymetrics.output import (
+    create_csv,
+    create_parquet,
+    delete_file,
+    get_path,
+    list_folder,
+    load_csv,
+    load_parquet,
+    upload_file,
+)
+from pymetrics.time_utils import get_current_utc
+
+LOGGER = logging.getLogger(__name__)
+
+PARTITION_TEMPLATE = 'pypi_{project}_{year_month}{suffix}.parquet'
+PARTITION_PATTERN = re.compile(
+    r'^pypi_(?P<project>.+)_(?P<year_month>\d{4}-\d{2})(?:_(?P<segment>\d{8}T\d{12}))?\.parquet$'
+)
+PARTITION_COLUMNS = ['project', 'year_month', 'segment', 'filename']
+SEGMENT_FORMAT = '%Y%m%dT%H%M%S%f'
+MANIFEST_FILENAME = 'pypi_manifest.csv'
+MANIFEST_COLUMNS = ['project', 'segment', 'start_date', 'end_date', 'rows']
+DOWNLOADS_COLUMN = 'downloads'
+CATEGORICAL_COLUMNS = [
+    'country_code',
+    'project',
+    'version',
+    'type',
+    'installer_name',
+    'implementation_name',
+    'implementation_version',
+    'distro_name',
+    'distro_version',
+    'system_name',
+    'system_release',
+    'cpu',
+]
+
+
+def fill_download_counts(downloads):
+    """Fill the ``downloads`` count column of a table that mixes aggregated and raw rows.
+
+    Raw rows represent exactly one download each, so their count is set to 1.
+    Tables without a ``downloads`` column are returned unmodified.
+    """
+    if DOWNLOADS_COLUMN in downloads and downloads[DOWNLOADS_COLUMN].isna().any():
+        downloads[DOWNLOADS_COLUMN] = downloads[DOWNLOADS_COLUMN].fillna(1).astype('int64')
+
+    return downloads
+
+
+def get_partition_filename(project, year_month, segment=None):
+    """Get the name of the file that stores a segment of the downloads of a project in a month."""
+    suffix = f'_{segment}' if segment else ''
+    return PARTITION_TEMPLATE.format(project=project, year_month=year_month, suffix=suffix)
+
+
+def list_pypi_partitions(output_folder):
+    """List the partition files stored in the history folder.
+
+    Args:
+        output_folder (str):
+            Folder in which the history is stored.
+
+    Returns:
+        pandas.DataFrame:
+            Table with the ``project``, ``year_month``, ``segment`` and ``filename`` of each
+            file, sorted by project, month and segment. Files written before segments were
+            introduced have an empty segment, which sorts before any other.
+    """
+    rows = []
+    for filename in list_folder(output_folder):
+        match = PARTITION_PATTERN.match(filename)
+        if match:
+            rows.append((match['project'], match['year_month'], match['segment'] or '', filename))
+
+    partitions = pd.DataFrame(rows, columns=PARTITION_COLUMNS)
+    return partitions.sort_values(['project', 'year_month', 'segment'], ignore_index=True)
+
+
+def load_pypi_manifest(output_folder):
+    """Load the manifest of the date ranges covered by each segment of the history.
+
+    Args:
+        output_folder (str):
+            Folder in which the history is stored.
+
+    Returns:
+        pandas.DataFrame:
+            Table with the ``project``, ``segment``, ``start_date``, ``end_date`` and
+            ``rows`` of every write. Empty if there is no manifest.
+    """
+    read_csv_kwargs = {
+        'parse_dates': ['start_date', 'end_date'],
+        'dtype': {'project': str, 'segment': str},
+    }
+    manifest = load_csv(get_path(output_folder, MANIFEST_FILENAME), read_csv_kwargs)
+    if manifest is None:
+        manifest = pd.DataFrame(columns=MANIFEST_COLUMNS)
+        manifest['start_date'] = pd.to_datetime(manifest['start_date'])
+        manifest['end_date'] = pd.to_datetime(manifest['end_date'])
+
+    return manifest
+
+
+def _normalize_windows(windows, projects=None, start_date=None, end_date=None):
+    """Get the queried window of every project as a dict of ``(start, end)`` timestamps.
+
+    Projects that are not in ``windows`` take ``[start_date, end_date)``, if both are given.
+    """
+    normalized = {}
+    if start_date is not None and end_date is not None:
+        normalized = dict.fromkeys(projects or [], (start_date, end_date))
+
+    normalized.update(windows or {})
+    return {
+        project: (pd.Timestamp(start), pd.Timestamp(end))
+        for project, (start, end) in normalized.items()
+    }
+
+
+def _update_manifest(output_folder, manifest, segment, rows, windows):
+    projects = list(windows.keys())
+    new_entries = pd.DataFrame({
+        'project': projects,
+        'segment': segment,
+        'start_date': [windows[project][0] for project in projects],
+        'end_date': [windows[project][1] for project in projects],
+        'rows': [rows.get(project, 0) for project in projects],
+    })
+    manifest = pd.concat([manifest, new_entries], ignore_index=True)
+    create_csv(get_path(output_folder, MANIFEST_FILENAME), manifest)
+    return manifest
+
+
+def _to_year_month(date):
+    return pd.Timestamp(date).strftime('%Y-%m')
+
+
+def _select_partitions(partitions, projects=None, start_date=None, end_date=None):
+    if projects is not None:
+        if isinstance(projects, str):
+            projects = (projects,)
+
+        partitions = partitions[partitions['project'].isin(projects)]
+    if start_date is not None:
+        partitions = partitions[partitions['year_month'] >= _to_year_month(start_date)]
+    if end_date is not None:
+        partitions = partitions[partitions['year_month'] <= _to_year_month(end_date)]
+
+    return partitions
+
+
+def _get_time_filters(start_date=None, end_date=None):
+    filters = []
+    if start_date is not None:
+        filters.append(('timestamp', '>=', pd.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append(('timestamp', '<', pd.Timestamp(end_date)))
+
+    return filters or None
+
+
+def _to_storage_dtypes(downloads):
+    downloads = downloads.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if column in downloads:
+            downloads[column] = downloads[column].astype('category').cat.remove_unused_categories()
+
+    if 'ci' in downloads:
+        downloads['ci'] = downloads['ci'].astype('boolean')
+
+    return downloads
+
+
+def _get_newer_windows(manifest, project, year_month, segment):
+    """Get the date ranges of a month that newer segments of the project have rewritten."""
+    month_start = pd.Timestamp(year_month)
+    month_end = month_start + pd.offsets.MonthBegin(1)
+    newer = manifest[
+        (manifest['project'] == project)
+        & (manifest['segment'] > segment)
+        & (manifest['start_date'] < month_end)
+        & (manifest['end_date'] > month_start)
+    ]
+    return list(zip(newer['start_date'], newer['end_date']))
+
+
+def _drop_windows(table, windows):
+    timestamps = table['timestamp']
+    overridden = None
+    for start_date, end_date in windows:
+        start_date = pa.scalar(start_date, type=timestamps.type)
+        end_date = pa.scalar(end_date, type=timestamps.type)
+        inside = pc.and_(pc.greater_equal(timestamps, start_date), pc.less(timestamps, end_date))
+        overridden = inside if overridden is None else pc.or_(overridden, inside)
+
+    return table.filter(pc.invert(overridden))
+
+
+def _read_partitions(output_folder, partitions, columns=None, filters=None, manifest=None):
+    tables = []
+    for partition in partitions.itertuples():
+        windows = []
+        if manifest is not None:
+            windows = _get_newer_windows(
+                manifest, partition.project, partition.year_month, partition.segment
+            )
+
+        read_columns = columns
+        if windows and columns is not None and 'timestamp' not in columns:
+            read_columns = list(columns) + ['timestamp']
+
+        path = get_path(output_folder, partition.filename)
+        table = load_parquet(path, columns=read_columns, filters=filters)
+        if table is None:
+            continue
+
+        if windows:
+            table = _drop_windows(table, windows)
+            if read_columns is not columns:
+                table = table.select([name for name in columns if name in table.column_names])
+
+        tables.append(table)
+
+    return tables
+
+
+def load_pypi_history(output_folder, projects=None, start_date=None, end_date=None, columns=None):
+    """Load the PyPI downloads stored in the partitioned history.
+
+    Only the partitions that belong to the given projects and that overlap with
+    the given date range are read.
+
+    Args:
+        output_folder (str):
+            Folder in which the history is stored.
+        projects (list[str] or None):
+            Projects to load. If `None`, load all of them.
+        start_date (datetime or None):
+            Load only downloads that happened on or after this date.
+        end_date (datetime or None):
+            Load only downloads that happened before this date.
+        columns (list[str] or None):
+            Columns to load. If `None`, load all of them.
+
+    Returns:
+        pandas.DataFrame or None:
+            Table with the downloads, sorted by timestamp, or `None` if the history
+            does not have any partition.
+    """
+    partitions = list_pypi_partitions(output_folder)
+    if partitions.empty:
+        LOGGER.info('No PyPI history partitions found in %s', output_folder)
+        return None
+
+    partitions = _select_partitions(partitions, projects, start_date, end_date)
+    LOGGER.info('Loading %s PyPI history partitions', len(partitions))
+    filters = _get_time_filters(start_date, end_date)
+    manifest = load_pypi_manifest(output_folder)
+    tables = _read_partitions(output_folder, partitions, columns, filters, manifest)
+    if not tables:
+        downloads = pd.DataFrame(columns=columns or CATEGORICAL_COLUMNS + ['timestamp', 'ci'])
+        if 'timestamp' in downloads:
+            # Naive, like the timestamps stored in the partitions.
+            downloads['timestamp'] = downloads['timestamp'].astype('datetime64[ns]')
+
+        return downloads
+
+    table = pa.concat_tables(tables, promote_options='permissive')
+    downloads = fill_download_counts(table.to_pandas())
+    if 'timestamp' in downloads:
+        downloads = downloads.sort_values('timestamp', ignore_index=True)
+
+    return downloads
+
+
+def get_pypi_history_range(output_folder, projects):
+    """Get the first and last download timestamps stored for the given projects.
+
+    Only the partitions of the first and the last month are read.
+
+    Args:
+        output_folder (str):
+            Folder in which the history is stored.
+        projects (list[str]):
+            Projects to look for.
+
+    Returns:
+        tuple[pandas.Timestamp, pandas.Timestamp]:
+            The minimum and maximum timestamps, or ``(None, None)`` if there is no history.
+    """
+    partitions = _select_partitions(list_pypi_partitions(output_folder), projects)
+    if partitions.empty:
+        return None, None
+
+    manifest = load_pypi_manifest(output_folder)
+    first = partitions[partitions['year_month'] == partitions['year_month'].min()]
+    last = partitions[partitions['year_month'] == partitions['year_month'].max()]
+    first_tables = _read_partitions(output_folder, first, ['timestamp'], manifest=manifest)
+    last_tables = _read_partitions(output_folder, last, ['timestamp'], manifest=manifest)
+    if not first_tables or not last_tables:
+        return None, None
+
+    first_timestamps = pa.concat_tables(first_tables)['timestamp']
+    last_timestamps = pa.concat_tables(last_tables)['timestamp']
+    if not len(first_timestamps) or not len(last_timestamps):
+        return None, None
+
+    min_date = pd.Timestamp(pc.min(first_timestamps).as_py())
+    max_date = pd.Timestamp(pc.max(last_timestamps).as_py())
+    return min_date, max_date
+
+
+def _merge_partition(output_folder, partitions, manifest, new_downloads, window):
+    tables = _read_partitions(output_folder, partitions, manifest=manifest)
+    if not tables:
+        return new_downloads
+
+    previous = pa.concat_tables(tables, promote_options='permissive').to_pandas()
+    window_start, window_end = window
+    if window_start is None:
+        window_start = new_downloads['timestamp'].min()
+        window_end = new_downloads['timestamp'].max() + pd.Timedelta(1, 'us')
+
+    outside = (previous['timestamp'] < window_start) | (previous['timestamp'] >= window_end)
+    new_downloads = pd.concat([previous[outside], new_downloads], ignore_index=True)
+    return _to_storage_dtypes(fill_download_counts(new_downloads))
+
+
+def _get_storage_schema(table):
+    fields = []
+    for field in table.schema:
+        if field.name in CATEGORICAL_COLUMNS:
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif field.name == 'timestamp':
+            field = field.with_type(pa.timestamp('us'))
+        elif field.name == 'ci':
+            field = field.with_type(pa.bool_())
+        elif field.name == DOWNLOADS_COLUMN:
+            field = field.with_type(pa.int64())
+
+        fields.append(field)
+
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+class SegmentWriter:
+    """Write downloads to the history as a single new segment, one batch at a time.
+
+    Every partition is written to a local temporary Parquet file as the batches
+    arrive, so memory usage depends on the size of the batches and not on the total
+    amount of downloads. The files are published to the history folder, and the
+    covered window is recorded in the manifest, when the writer is closed.
+
+    Args:
+        output_folder (str):
+            Folder in which the history is stored.
+        start_date (datetime or None):
+            Start of the queried window.
+        end_date (datetime or None):
+            End (exclusive) of the queried window.
+        projects (list[str] or None):
+            Projects that were queried. Defaults to the projects found in the batches.
+        windows (dict[str, tuple] or None):
+            Queried window of each project, as ``(start, end)`` tuples, for queries that
+            use a different window per project. Overrides ``start_date`` and ``end_date``.
+    """
+
+    def __init__(self, output_folder, start_date=None, end_date=None, projects=None, windows=None):
+        self.output_folder = output_folder
+        self.start_date = start_date
+        self.end_date = end_date
+        self.windows = windows or {}
+        self.segment = get_current_utc().strftime(SEGMENT_FORMAT)
+        self.rows = dict.fromkeys([*(projects or []), *self.windows], 0)
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._writers = {}
+        self._schema = None
+
+    def write(self, downloads):
+        """Write a batch of downloads to the segment.
+
+        Args:
+            downloads (pandas.DataFrame):
+                Downloads to write.
+        """
+        if downloads.empty:
+            return
+
+        downloads = _to_storage_dtypes(downloads)
+        year_month = downloads['timestamp'].dt.to_period('M').astype(str)
+        grouped = downloads.groupby([downloads['project'], year_month], observed=True)
+        for (project, year_month), partition in grouped:
+            table = pa.Table.from_pandas(partition, preserve_index=False)
+            if self._schema is None:
+                self._schema = _get_storage_schema(table)
+
+            table = table.select(self._schema.names).cast(self._schema, safe=False)
+            filename = get_partition_filename(project, year_month, self.segment)
+            writer = self._writers.get(filename)
+            if writer is None:
+                path = os.path.join(self._tempdir.name, filename)
+                writer = pq.ParquetWriter(path, self._schema, compression='zstd')
+                self._writers[filename] = writer
+
+            writer.write_table(table)
+            self.rows[project] = self.rows.get(project, 0) + len(partition)
+
+    def close(self):
+        """Publish the written partitions and record the covered window in the manifest."""
+        for filename, writer in self._writers.items():
+            writer.close()
+            upload_file(
+                os.path.join(self._tempdir.name, filename),
+                get_path(self.output_folder, filename),
+            )
+
+        windows = _normalize_windows(self.windows, self.rows, self.start_date, self.end_date)
+        if windows:
+            manifest = load_pypi_manifest(self.output_folder)
+            _update_manifest(self.output_folder, manifest, self.segment, self.rows, windows)
+
+        self._tempdir.cleanup()
+
+    def abort(self):
+        """Discard the written partitions without publishing them."""
+        for writer in self._writers.values():
+            writer.close()
+
+        self._tempdir.cleanup()
+
+    def __enter__(self):
+        """Return the writer itself."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the writer, or abort it if an exception was raised."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_pypi_history(
+    output_folder,
+    downloads,
+    start_date=None,
+    end_date=None,
+    projects=None,
+    incremental=False,
+    windows=None,
+):
+    """Write new downloads to the partitioned history as a new segment.
+
+    Only the partitions of the projects and months found in ``downloads`` are
+    written. By default, every written partition is rewritten as a single file that
+    contains the previously stored downloads, except the ones that fall within the
+    window ``[start_date, end_date)``, which are replaced by the new ones.
+
+    If ``incremental`` is `True`, only the new downloads are written, and the previously
+    stored files are left untouched. The window is recorded in the manifest, so readers
+    replace the older downloads that fall within it.
+
+    Args:
+        output_folder (str):
+            Folder in which the history is stored.
+        downloads (pandas.DataFrame):
+            New downloads to store.
+        start_date (datetime or None):
+            Start of the queried window. Defaults to the first new timestamp.
+        end_date (datetime or None):
+            End (exclusive) of the queried window. If `None`, it defaults to
+            right after the last new timestamp.
+        projects (list[str] or None):
+            Projects that were queried. They are recorded in the manifest as covered
+            by the window even if they have no new downloads. Defaults to the projects
+            found in ``downloads``.
+        incremental (bool):
+            Whether to write only the new downloads, without rewriting the previously
+            stored partitions. Defaults to `False`.
+        windows (dict[str, tuple] or None):
+            Queried window of each project, as ``(start, end)`` tuples, for queries that
+            use a different window per project. Overrides ``start_date`` and ``end_date``.
+    """
+    windows = windows or {}
+    if downloads.empty and not windows and (start_date is None or end_date is None):
+        return
+
+    if incremental:
+        with SegmentWriter(output_folder, start_date, end_date, projects, windows) as writer:
+            writer.write(downloads)
+
+        return
+
+    segment = get_current_utc().strftime(SEGMENT_FORMAT)
+    partitions = list_pypi_partitions(output_folder)
+    manifest = load_pypi_manifest(output_folder)
+    rows = dict.fromkeys([*(projects or []), *windows], 0)
+    if not downloads.empty:
+        downloads = _to_storage_dtypes(downloads)
+        year_month = downloads['timestamp'].dt.to_period('M').astype(str)
+        grouped = downloads.groupby([downloads['project'], year_month], observed=True)
+        for (project, year_month), new_downloads in grouped:
+            rows[project] = rows.get(project, 0) + len(new_downloads)
+            previous = partitions[
+                (partitions['project'] == project) & (partitions['year_month'] == year_month)
+            ]
+            window = _normalize_windows(windows, [project], start_date, end_date).get(project)
+            new_downloads = _merge_partition(
+                output_folder, previous, manifest, new_downloads, window or (None, None)
+            )
+            filename = get_partition_filename(project, year_month, segment)
+            new_downloads = new_downloads.sort_values('timestamp', ignore_index=True)
+            create_parquet(get_path(output_folder, filename), new_downloads)
+            for previous_filename in previous['filename']:
+                delete_file(get_path(output_folder, previous_filename))
+
+    windows = _normalize_windows(windows, rows, start_date, end_date)
+    if windows:
+        _update_manifest(output_folder, manifest, segment, rows, windows)
+
+
+def compact_pypi_history(output_folder, before=None):
+    """Merge the segments of each partition of the history into a single file.
+
+    The compacted file keeps the name of the newest segment of the partition, so
+    the date ranges of the manifest keep being applied correctly.
+
+    Args:
+        output_folder (str):
+            Folder in which the history is stored.
+        before (datetime or None):
+            If given, only compact the partitions of the months before the month
+            of this date.
+    """
+    partitions = list_pypi_partitions(output_folder)
+    if before is not None:
+        partitions = partitions[partitions['year_month'] < _to_year_month(before)]
+
+    manifest = load_pypi_manifest(output_folder)
+    for (project, year_month), files in partitions.groupby(['project', 'year_month']):
+        if len(files) < 2:
+            continue
+
+        LOGGER.info('Compacting %s segments of %s %s', len(files), project, year_month)
+        tables = _read_partitions(output_folder, files, manifest=manifest)
+        downloads = pa.concat_tables(tables, promote_options='permissive').to_pandas()
+        downloads = _to_storage_dtypes(fill_download_counts(downloads))
+        downloads = downloads.sort_values('timestamp', ignore_index=True)
+        filename = get_partition_filename(project, year_month, files['segment'].max())
+        create_parquet(get_path(output_folder, filename), downloads)
+        for previous_filename in files['filename']:
+            if previous_filename != filename:
+                delete_file(get_path(output_folder, previous_filename))
@@ -0,0 +1,209 @@
+"""Local ledger of the BigQuery queries run and their cost."""
+
+import contextlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+DATE_LITERAL_PATTERN = re.compile(r"'(\d{4}-\d{2}-\d{2})[^']*'")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    timestamp REAL NOT NULL,
+    shape TEXT NOT NULL,
+    dry_run INTEGER NOT NULL,
+    bytes_processed INTEGER,
+    bytes_billed INTEGER,
+    latency REAL,
+    rows INTEGER
+)
+"""
+# Estimates of the same query shape done during the last week are reused.
+ESTIMATE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def get_query_shape(query):
+    """Get the shape of a query, which ignores its absolute dates.
+
+    Every date literal is replaced by its offset in days from the first one, so that
+    the same query over a window of the same length has the same shape on any day.
+    """
+    dates = [pd.Timestamp(date) for date in DATE_LITERAL_PATTERN.findall(query)]
+    if not dates:
+        return query
+
+    first_date = min(dates)
+
+    def replace(match):
+        offset = (pd.Timestamp(match.group(1)) - first_date).days
+        return f'<day {offset}>'
+
+    return DATE_LITERAL_PATTERN.sub(replace, query)
+
+
+class CostLedger:
+    """Ledger of BigQuery queries stored in a local SQLite file.
+
+    The ledger records the bytes processed and billed, the latency and the number of rows
+    of every query, and enforces an optional byte budget per run and per calendar month.
+    Queries that run at the same time reserve their bytes from the budget before they are
+    submitted, so together they cannot bill more than it.
+
+    Args:
+        path (str):
+            Path to the SQLite file.
+        run_budget (int or None):
+            Maximum number of bytes that can be billed during this run.
+        monthly_budget (int or None):
+            Maximum number of bytes that can be billed during a calendar month, including
+            the queries of previous runs recorded in the ledger.
+    """
+
+    def __init__(self, path, run_budget=None, monthly_budget=None):
+        self.path = path
+        self.run_budget = run_budget
+        self.monthly_budget = monthly_budget
+        self.run_bytes_billed = 0
+        self.reserved_bytes = 0
+        self._lock = threading.RLock()
+        with self._connect() as connection:
+            connection.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def record(
+        self, shape, bytes_processed, bytes_billed=None, latency=None, rows=None, reservation=None
+    ):
+        """Record a query in the ledger, settling its reservation.
+
+        Args:
+            shape (str):
+                Shape of the query, as returned by ``get_query_shape``.
+            bytes_processed (int):
+                Number of bytes processed, or estimated to be processed.
+            bytes_billed (int or None):
+                Number of bytes billed. `None` for dry run estimates.
+            latency (float or None):
+                Time taken by the query, in seconds.
+            rows (int or None):
+                Number of rows returned by the query.
+            reservation (int or None):
+                Bytes reserved for the query with ``reserve``, which are released now that
+                its billed bytes are known.
+        """
+        dry_run = bytes_billed is None
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                'INSERT INTO queries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), shape, dry_run, bytes_processed, bytes_billed, latency, rows),
+            )
+            if not dry_run:
+                self.run_bytes_billed += bytes_billed
+
+            if reservation is not None:
+                self.reserved_bytes -= reservation
+
+    def get_estimate(self, shape, max_age=ESTIMATE_MAX_AGE):
+        """Get the most recent number of bytes processed by a query shape.
+
+        Returns:
+            int or None:
+                The bytes processed by the most recent query or estimate of the same shape
+                done less than ``max_age`` seconds ago, or `None` if there is none.
+        """
+        with self._lock, self._connect() as connection:
+            row = connection.execute(
+                'SELECT bytes_processed FROM queries WHERE shape = ? AND timestamp >= ?'
+                ' ORDER BY timestamp DESC LIMIT 1',
+                (shape, time.time() - max_age),
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def get_monthly_bytes_billed(self):
+        """Get the number of bytes billed during the current calendar month."""
+        month_start = pd.Timestamp.now(tz='UTC').normalize().replace(day=1).timestamp()
+        with self._lock, self._connect() as connection:
+            row = connection.execute(
+                'SELECT SUM(bytes_billed) FROM queries WHERE dry_run = 0 AND timestamp >= ?',
+                (month_start,),
+            ).fetchone()
+
+        return row[0] or 0
+
+    def get_remaining_budget(self):
+        """Get the number of bytes that can still be billed within the budgets.
+
+        The bytes reserved by the queries that are still running are not available.
+
+        Returns:
+            int or None:
+                The remaining bytes, or `None` if no budget has been set.
+        """
+        with self._lock:
+            remaining = []
+            if self.run_budget is not None:
+                remaining.append(self.run_budget - self.run_bytes_billed)
+
+            if self.monthly_budget is not None:
+                remaining.append(self.monthly_budget - self.get_monthly_bytes_billed())
+
+            if not remaining:
+                return None
+
+            return max(min(remaining) - self.reserved_bytes, 0)
+
+    def reserve(self, estimated_bytes, max_bytes=None):
+        """Reserve bytes of the remaining budget for a query that is about to run.
+
+        The reservation must be settled with ``record`` once the query has run, or given
+        back with ``release`` if it fails.
+
+        Args:
+            estimated_bytes (int):
+                Number of bytes that the query is estimated to bill.
+            max_bytes (int or None):
+                Number of bytes to reserve if the remaining budget allows it. Defaults to
+                ``estimated_bytes``.
+
+        Returns:
+            int or None:
+                The reserved bytes, or `None` if no budget has been set.
+
+        Raises:
+            ValueError:
+                If the estimated bytes exceed the remaining budget.
+        """
+        with self._lock:
+            remaining = self.get_remaining_budget()
+            if remaining is None:
+                return None
+
+            # A maximum_bytes_billed of 0 means no limit, so an exhausted budget always fails
+            if estimated_bytes > remaining or remaining == 0:
+                raise ValueError(
+                    f'The query would process {estimated_bytes / 1024**3:.2f} GBs, '
+                    f'which exceeds the remaining budget of {remaining / 1024**3:.2f} GBs'
+                )
+
+            reservation = min(max(estimated_bytes, max_bytes or 0), remaining)
+            self.reserved_bytes += reservation
+            return reservation
+
+    def release(self, reservation):
+        """Give back the bytes reserved for a query that has not been recorded."""
+        if reservation is not None:
+            with self._lock:
+                self.reserved_bytes -= reservation
@@ -1,15 +1,211 @@
 """Main script."""
 
 import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 
-from pymetrics.metrics import compute_metrics
-from pymetrics.output import create_csv, get_path
-from pymetrics.pypi import get_pypi_downloads
-from pymetrics.summarize import get_previous_pypi_downloads
+import pandas as pd
+
+from pymetrics.fingerprints import FingerprintManifest
+from pymetrics.history import (
+    compact_pypi_history,
+    list_pypi_partitions,
+    load_pypi_history,
+    load_pypi_manifest,
+    write_pypi_history,
+)
+from pymetrics.metrics import (
+    get_metrics_columns,
+    get_state_columns,
+    render_metrics,
+    update_metrics_state,
+)
+from pymetrics.metrics_state import load_metrics_index, load_metrics_state, save_metrics_state
+from pymetrics.output import create_csv, get_path, load_csv, write_spreadsheet
+from pymetrics.pypi import get_pypi_downloads, get_query_columns
+from pymetrics.summarize import PYPI_DTYPES, get_previous_pypi_downloads
+from pymetrics.time_utils import get_current_utc
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _seed_pypi_history(output_folder, dry_run=False):
+    """Populate an empty partitioned history from the legacy ``pypi.csv`` file."""
+    if not list_pypi_partitions(output_folder).empty:
+        return
+
+    csv_path = get_path(output_folder, 'pypi.csv')
+    read_csv_kwargs = {'parse_dates': ['timestamp'], 'dtype': PYPI_DTYPES}
+    previous = load_csv(csv_path, read_csv_kwargs=read_csv_kwargs)
+    if previous is None or previous.empty:
+        return
+
+    LOGGER.info('Seeding the PyPI history with %s rows from %s', len(previous), csv_path)
+    if not dry_run:
+        write_pypi_history(output_folder, previous)
+
+
+def _create_metrics(project_downloads, output_folder, dry_run=False, jobs=1, fingerprints=None):
+    """Compute the metrics spreadsheet of every project and store it.
+
+    With more than one job, the spreadsheets are computed in a pool of processes, and
+    this process stores each one of them as soon as it is ready. At most ``jobs``
+    projects are submitted to the pool at the same time.
+
+    Args:
+        project_downloads (iterable[tuple[str, pandas.DataFrame, pandas.DataFrame]]):
+            Project names with their downloads and the metrics state of their previous
+            months, which is `None` if the downloads cover all the months.
+        output_folder (str):
+            Folder in which the spreadsheets are stored.
+        dry_run (bool):
+            If `True`, the spreadsheets are computed but not stored.
+        jobs (int):
+            Number of processes used to compute the spreadsheets.
+        fingerprints (FingerprintManifest or None):
+            If given, the spreadsheets that have not changed are not written again.
+    """
+
+    def store(project, contents):
+        if not dry_run:
+            write_spreadsheet(get_path(output_folder, project), contents, fingerprints)
+
+    if jobs <= 1:
+        for project, downloads, state in project_downloads:
+            LOGGER.info('Computing metrics for project %s', project)
+            store(project, render_metrics(downloads, state))
+
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+        for project, downloads, state in project_downloads:
+            if len(pending) >= jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(pending.pop(future), future.result())
+
+            LOGGER.info('Computing metrics for project %s', project)
+            pending[executor.submit(render_metrics, downloads, state)] = project
+
+        for future in as_completed(pending):
+            store(pending[future], future.result())
+
+
+def _iter_history_downloads(output_folder, projects):
+    for project in projects:
+        project_downloads = load_pypi_history(output_folder, projects=[project])
+        if project_downloads is not None and not project_downloads.empty:
+            yield project, project_downloads, None
+
+
+def _iter_incremental_downloads(output_folder, projects, dry_run=False):
+    """Yield the downloads of the open month of every project along with its metrics state.
+
+    Only the downloads after the stored state of each project are loaded from the
+    history. The months that have been closed since the state was stored are folded
+    into it before storing it again.
+    """
+    open_month = pd.Timestamp(get_current_utc()).tz_localize(None).normalize().replace(day=1)
+    manifest = load_pypi_manifest(output_folder)
+    index = load_metrics_index(output_folder)
+    for project in projects:
+        state, closed_until = load_metrics_state(output_folder, project, index, manifest)
+        downloads = load_pypi_history(output_folder, projects=[project], start_date=closed_until)
+        if downloads is None:
+            continue
+
+        if state is not None and not state.empty and not downloads.empty:
+            state_columns = get_state_columns(state)
+            if state_columns != get_metrics_columns(downloads.columns):
+                LOGGER.info('Discarding the metrics state of %s: the columns differ', project)
+                state = None
+                downloads = load_pypi_history(output_folder, projects=[project])
+
+        if downloads.empty and state is None:
+            continue
+
+        if not downloads.empty:
+            state, downloads = update_metrics_state(downloads, state, before=open_month)
+            if not dry_run:
+                index = save_metrics_state(
+                    output_folder, project, state, open_month, index, manifest
+                )
+
+        yield project, downloads, state
+
+
+def _collect_pypi_history(
+    projects,
+    output_folder,
+    start_date,
+    max_days,
+    credentials_file,
+    dry_run,
+    force,
+    add_metrics,
+    aggregate,
+    incremental,
+    stream,
+    cache,
+    shard_days,
+    parallel_queries,
+    ledger,
+    columns,
+    fill_gaps,
+    jobs,
+    incremental_metrics,
+):
+    _seed_pypi_history(output_folder, dry_run=dry_run)
+    get_pypi_downloads(
+        projects=projects,
+        start_date=start_date,
+        max_days=max_days,
+        credentials_file=credentials_file,
+        dry_run=dry_run,
+        force=force,
+        history_folder=output_folder,
+        aggregate=aggregate,
+        incremental=incremental,
+        stream=stream,
+        cache=cache,
+        shard_days=shard_days,
+        parallel_queries=parallel_queries,
+        ledger=ledger,
+        columns=columns,
+        fill_gaps=fill_gaps,
+    )
+    if (incremental or stream or shard_days) and not dry_run:
+        compact_pypi_history(output_folder, before=get_current_utc())
+
+    if add_metrics:
+        if incremental_metrics:
+            project_downloads = _iter_incremental_downloads(output_folder, projects, dry_run)
+        else:
+            project_downloads = _iter_history_downloads(output_folder, projects)
+
+        fingerprints = FingerprintManifest(output_folder)
+        _create_metrics(project_downloads, output_folder, dry_run, jobs, fingerprints)
+        fingerprints.save()
+
+
+def _load_previous_csv(output_folder, projects, start_date=None, max_days=1, dry_run=False):
+    """Load the downloads stored in ``pypi.csv`` before collecting new ones.
+
+    The whole file is loaded, since it is written again with the new downloads. Dry runs
+    do not write it, so they only load the projects and days of the queried window.
+    """
+    if not dry_run:
+        return get_previous_pypi_downloads(output_folder=output_folder)
+
+    if start_date is None:
+        today = pd.Timestamp(get_current_utc().date())
+        start_date = today - pd.Timedelta(days=max_days)
+
+    return get_previous_pypi_downloads(
+        output_folder=output_folder, projects=projects, start_date=pd.Timestamp(start_date)
+    )
+
+
 def collect_pypi_downloads(
     projects,
     output_folder,
@@ -19,6 +215,19 @@ def collect_pypi_downloads(
     dry_run=False,
     force=False,
     add_metrics=True,
+    storage='csv',
+    aggregate=False,
+    incremental=False,
+    stream=False,
+    cache=None,
+    shard_days=None,
+    parallel_queries=4,
+    ledger=None,
+    profile=None,
+    profiles=None,
+    fill_gaps=False,
+    jobs=1,
+    incremental_metrics=False,
 ):
     """Pull data about the downloads of a list of projects.
 
@@ -44,14 +253,90 @@ def collect_pypi_downloads(
             combination creates a gap. Defaults to False.
         add_metrics (bool):
             Whether to compute and create the aggregation metrics spreadsheets.
+        storage (str):
+            Format in which the downloads history is stored. Either ``csv``, for the
+            single ``pypi.csv`` file, or ``parquet``, for the history partitioned by
+            project and month. Defaults to ``csv``.
+        aggregate (bool):
+            Whether to aggregate the downloads by day in BigQuery, storing a ``downloads``
+            count column instead of one row per download. Defaults to False.
+        incremental (bool):
+            Whether to append only the newly queried window to the history as a new
+            segment, instead of rewriting the affected partitions. Only supported with
+            the ``parquet`` storage. Defaults to False.
+        stream (bool):
+            Whether to stream the BigQuery results in batches, appending each one to the
+            history as it arrives. Implies ``incremental``. Defaults to False.
+        cache (pymetrics.cache.LocalCache or None):
+            Local cache of BigQuery results, used for queries over windows that are
+            fully in the past. Defaults to None.
+        shard_days (int or None):
+            If given, split the queried window in shards of this many days that are
+            queried concurrently. With the ``parquet`` storage, every shard is stored as
+            soon as it is done, so interrupted backfills resume from the last stored shard.
+            Defaults to None.
+        parallel_queries (int):
+            Maximum number of shard queries to run at the same time. Defaults to 4.
+        ledger (pymetrics.ledger.CostLedger or None):
+            Ledger in which the BigQuery queries are recorded and which enforces the
+            byte budgets. Defaults to None.
+        profile (str or None):
+            Name of the query profile that decides which columns are selected in BigQuery
+            and stored: ``summary``, ``metrics`` or ``full``. If None, ``metrics`` is used
+            for aggregated queries and ``full`` otherwise.
+        profiles (dict or None):
+            Additional query profiles, or overrides of the default ones, as a mapping of
+            profile names to column lists. Defaults to None.
+        fill_gaps (bool):
+            Whether to detect the days missing in the middle of the history and collect
+            them. Only supported with the ``parquet`` storage. Defaults to False.
+        jobs (int):
+            Number of processes used to compute the metrics spreadsheets of the
+            projects in parallel. Defaults to 1.
+        incremental_metrics (bool):
+            Whether to store the aggregated metrics of the closed months and only
+            aggregate the downloads of the open month on every run. Only supported
+            with the ``parquet`` storage. Defaults to False.
     """
     if not projects:
         raise ValueError('No projects have been passed')
 
     LOGGER.info(f'Collecting new downloads for projects={projects}')
+    columns = get_query_columns(profile, aggregate=aggregate, profiles=profiles)
 
+    if storage == 'parquet':
+        _collect_pypi_history(
+            projects=projects,
+            output_folder=output_folder,
+            start_date=start_date,
+            max_days=max_days,
+            credentials_file=credentials_file,
+            dry_run=dry_run,
+            force=force,
+            add_metrics=add_metrics,
+            aggregate=aggregate,
+            incremental=incremental,
+            stream=stream,
+            cache=cache,
+            shard_days=shard_days,
+            parallel_queries=parallel_queries,
+            ledger=ledger,
+            columns=columns,
+            fill_gaps=fill_gaps,
+            jobs=jobs,
+            incremental_metrics=incremental_metrics,
+        )
+        return
+
+    if incremental or stream or fill_gaps or incremental_metrics:
+        raise ValueError(
+            'Incremental and streaming collection, filling gaps and incremental metrics '
+            'require the parquet storage'
+        )
+
+    fingerprints = FingerprintManifest(output_folder)
     csv_path = get_path(output_folder, 'pypi.csv')
-    previous = get_previous_pypi_downloads(output_folder=output_folder, dry_run=dry_run)
+    previous = _load_previous_csv(output_folder, projects, start_date, max_days, dry_run)
 
     pypi_downloads = get_pypi_downloads(
         projects=projects,
@@ -61,6 +346,12 @@ def collect_pypi_downloads(
         credentials_file=credentials_file,
         dry_run=dry_run,
         force=force,
+        aggregate=aggregate,
+        cache=cache,
+        shard_days=shard_days,
+        parallel_queries=parallel_queries,
+        ledger=ledger,
+        columns=columns,
     )
 
     if dry_run and pypi_downloads.empty:
@@ -74,15 +365,17 @@ def collect_pypi_downloads(
         LOGGER.info(msg)
 
     else:
-        create_csv(csv_path, pypi_downloads)
+        create_csv(csv_path, pypi_downloads, fingerprints=fingerprints)
 
     if add_metrics:
-        for project in projects:
-            project_downloads = pypi_downloads[pypi_downloads.project == project]
-            if not project_downloads.empty:
-                LOGGER.info('Computing metrics for project %s', project)
-                output_path = get_path(output_folder, project)
-                if dry_run:
-                    output_path = None
-
-                compute_metrics(project_downloads, output_path)
+        grouped = pypi_downloads.groupby('project', sort=False, observed=True)
+        downloads_by_project = dict(iter(grouped))
+        project_downloads = (
+            (project, downloads_by_project[project], None)
+            for project in projects
+            if project in downloads_by_project
+        )
+        _create_metrics(project_downloads, output_folder, dry_run, jobs, fingerprints)
+
+    if not dry_run:
+        fingerprints.save()
@@ -4,48 +4,205 @@ import logging
 
 import numpy as np
 import pandas as pd
-from packaging.version import InvalidVersion, Version
 
-from pymetrics.output import create_spreadsheet
+from pymetrics.output import create_spreadsheet, render_spreadsheet
+from pymetrics.versions import encode_versions, parse_version
 
 LOGGER = logging.getLogger(__name__)
 
 
-def _groupby(downloads, groupby, index_name=None, percent=True):
-    grouped = downloads.groupby(groupby, dropna=False).size().reset_index()
-    grouped.columns = [index_name or groupby, 'downloads']
+DOWNLOADS_COLUMN = 'downloads'
+NA_REP = '<NaN>'
+STATE_COLUMNS = ['year_month', 'column', 'downloads', 'rows']
+
+
+def _bincount(codes, weights, size):
+    counts = np.bincount(codes, weights=weights, minlength=size)
+    return counts if weights is None else counts.round().astype(np.int64)
+
+
+def _get_month_codes(timestamps):
+    """Get the number of months since the epoch of every timestamp, or -1 if missing."""
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_localize(None)
+
+    months = timestamps.to_numpy().astype('datetime64[M]')
+    return np.where(np.isnat(months), -1, months.astype(np.int64))
+
+
+def _get_month_index(month_codes):
+    """Map month codes to positions in a range of months, with missing months last.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]:
+            The position of every month code and the labels of the range of months,
+            with a last missing month.
+    """
+    valid = month_codes >= 0
+    first_month = month_codes[valid].min() if valid.any() else 0
+    num_months = month_codes[valid].max() - first_month + 1 if valid.any() else 0
+    month_index = np.where(valid, month_codes - first_month, num_months)
+    months = np.arange(first_month, first_month + num_months).astype('datetime64[M]')
+    labels = np.append(np.datetime_as_string(months, unit='M').astype(object), np.nan)
+    return month_index, labels
+
+
+def _build_cube(downloads, columns):
+    """Count the downloads by month and by the value of each column.
+
+    Every row is mapped to an integer month code and to the category code of its value
+    in each column, and the downloads of every ``(month, value)`` pair are counted with
+    a single ``bincount`` over the combined codes. All the sheets are projections of
+    the resulting cube. Rows are weighted by their ``downloads`` count, if any.
+
+    Returns:
+        dict:
+            The ``months`` labels, with a last missing month for rows without timestamp,
+            the ``totals`` and number of ``rows`` of each month, and the ``columns``, which
+            map every column to its ``values``, with a last missing value, and to the
+            ``counts`` and ``rows`` matrices of shape ``(months, values)``.
+    """
+    weights = None
+    if DOWNLOADS_COLUMN in downloads:
+        weights = downloads[DOWNLOADS_COLUMN].to_numpy(dtype=np.float64)
+
+    month_index, months = _get_month_index(_get_month_codes(downloads['timestamp']))
+    num_months = len(months)
+    cube = {
+        'months': months,
+        'totals': _bincount(month_index, weights, num_months),
+        'rows': _bincount(month_index, None, num_months),
+        'columns': {},
+    }
+    for column in columns:
+        values = _as_categorical(downloads[column])
+        num_values = len(values.cat.categories) + 1
+        codes = values.cat.codes.to_numpy().astype(np.int64)
+        codes = np.where(codes < 0, num_values - 1, codes)
+        cell_index = month_index * num_values + codes
+        size = num_months * num_values
+        counts = _bincount(cell_index, weights, size).reshape(num_months, num_values)
+        rows = counts
+        if weights is not None:
+            rows = _bincount(cell_index, None, size).reshape(num_months, num_values)
+
+        cube['columns'][column] = {
+            'values': np.append(values.cat.categories.to_numpy(dtype=object), np.nan),
+            'counts': counts,
+            'rows': rows,
+        }
+
+    return cube
+
+
+def _get_cube_state(cube):
+    """Flatten a cube into a table of counts that can be stored and merged with others.
+
+    The table has one row per month, with an empty ``column``, for the totals, and one
+    row per month and value of every column, with the value stored in the table column
+    of the same name. Only the cells with downloads are kept.
+    """
+    months = cube['months']
+    observed = cube['rows'] > 0
+    frames = [
+        pd.DataFrame({
+            'year_month': months[observed],
+            'column': None,
+            'downloads': cube['totals'][observed],
+            'rows': cube['rows'][observed],
+        })
+    ]
+    for column, column_cube in cube['columns'].items():
+        month_index, value_index = np.nonzero(column_cube['rows'])
+        frames.append(
+            pd.DataFrame({
+                'year_month': months[month_index],
+                'column': column,
+                'downloads': column_cube['counts'][month_index, value_index],
+                'rows': column_cube['rows'][month_index, value_index],
+                column: column_cube['values'][value_index],
+            })
+        )
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def _cube_from_state(state, columns):
+    """Build a cube back from one or more concatenated tables of counts.
+
+    The counts of the cells that appear more than once are added up.
+    """
+    year_months = state['year_month'].to_numpy(dtype=object)
+    month_codes = np.full(len(state), -1, dtype=np.int64)
+    valid = pd.notna(year_months)
+    month_codes[valid] = year_months[valid].astype('datetime64[M]').astype(np.int64)
+    month_index, months = _get_month_index(month_codes)
+    num_months = len(months)
+    downloads = state['downloads'].to_numpy(dtype=np.float64)
+    rows = state['rows'].to_numpy(dtype=np.float64)
+
+    is_total = state['column'].isna().to_numpy()
+    cube = {
+        'months': months,
+        'totals': _bincount(month_index[is_total], downloads[is_total], num_months),
+        'rows': _bincount(month_index[is_total], rows[is_total], num_months),
+        'columns': {},
+    }
+    for column in columns:
+        is_column = (state['column'] == column).to_numpy()
+        codes, categories = pd.factorize(state.loc[is_column, column].astype(object), sort=True)
+        num_values = len(categories) + 1
+        codes = np.where(codes < 0, num_values - 1, codes)
+        cell_index = month_index[is_column] * num_values + codes
+        size = num_months * num_values
+        cube['columns'][column] = {
+            'values': np.append(categories.to_numpy(dtype=object), np.nan),
+            'counts': _bincount(cell_index, downloads[is_column], size).reshape(
+                num_months, num_values
+            ),
+            'rows': _bincount(cell_index, rows[is_column], size).reshape(num_months, num_values),
+        }
+
+    return cube
+
+
+def _groupby(cube, column, percent=True):
+    """Get the downloads of each value of a column, with the missing values last."""
+    column_cube = cube['columns'][column]
+    observed = column_cube['rows'].sum(axis=0) > 0
+    grouped = pd.DataFrame({
+        column: column_cube['values'][observed],
+        'downloads': column_cube['counts'].sum(axis=0)[observed],
+    })
     if percent:
         grouped['percent'] = (grouped.downloads * 100 / grouped.downloads.sum()).round(3)
 
     return grouped
 
 
-def _by_month(downloads):
-    year_month = downloads.timestamp.dt.strftime('%Y-%m')
-    by_month = _groupby(downloads, year_month, 'year-month', percent=False)
+def _by_month(cube):
+    observed = cube['rows'] > 0
+    by_month = pd.DataFrame({
+        'year-month': cube['months'][observed],
+        'downloads': cube['totals'][observed],
+    })
     by_month['increase'] = by_month.downloads.diff()
     return by_month.iloc[::-1]
 
 
-def _historical_groupby(downloads, groupbys=None):
-    year_month = downloads.timestamp.dt.strftime('%Y-%m')
-    base = downloads.groupby(year_month).size().to_frame()
-    base.index.name = 'year-month'
-    base.columns = ['total']
-
-    if groupbys is None:
-        groupbys = downloads.set_index('timestamp').columns
+def _historical_groupby(cube, column):
+    """Get the downloads of each month and value of a column, plus a row of totals.
 
-    new_columns = []
-    for groupby in groupbys:
-        grouped = downloads.groupby([year_month, groupby])
-        grouped_sizes = grouped.size().unstack(-1)  # noqa: PD010
-        if len(groupbys) > 1:
-            grouped_sizes.columns = f"{groupby}='" + grouped_sizes.columns + "'"
-        new_columns.append(grouped_sizes.fillna(0))
-
-    if new_columns:
-        base = pd.concat([base] + new_columns, axis=1)
+    Rows without timestamp and missing values are left out of the breakdown.
+    """
+    column_cube = cube['columns'][column]
+    months = cube['rows'][:-1] > 0
+    values = column_cube['rows'][:-1, :-1].sum(axis=0) > 0
+    base = pd.DataFrame(
+        column_cube['counts'][:-1, :-1][months][:, values],
+        columns=column_cube['values'][:-1][values],
+    )
+    base.insert(0, 'total', cube['totals'][:-1][months])
 
     totals = base.sum()
     totals.name = 'total'
@@ -109,78 +266,203 @@ HISTORICAL_COLUMNS = [
 ]
 
 
-def _safe_version_parse(version_str):
-    if pd.isna(version_str):
-        return np.nan
-    try:
-        version = Version(str(version_str))
-    except InvalidVersion:
-        version = np.nan
-    return version
-
-
 def _extract_version_attribute(version_str, attribute):
-    version_obj = _safe_version_parse(version_str)
-    if isinstance(version_obj, Version):
+    version_obj = parse_version(version_str)
+    if version_obj is not None:
         return getattr(version_obj, attribute)
     return np.nan
 
 
+def _as_categorical(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column
+
+    return column.astype('category')
+
+
+def _from_distinct(codes, values, index):
+    """Build a categorical column from row codes into a list of per distinct values.
+
+    Missing codes (``-1``) and missing values are both mapped to missing values.
+    """
+    value_codes, categories = pd.factorize(pd.Series(values, dtype=object), sort=True)
+    value_codes = np.append(value_codes, -1)
+    categorical = pd.Categorical.from_codes(value_codes[codes], categories)
+    return pd.Series(categorical, index=index)
+
+
+def _map_distinct(column, function, *args):
+    """Apply a function once per distinct value of a column and map the results back."""
+    column = _as_categorical(column)
+    values = [function(value, *args) for value in column.cat.categories]
+    return _from_distinct(column.cat.codes.to_numpy(), values, column.index)
+
+
+def _join_distinct(columns, separator):
+    """Join the values of several columns, once per distinct combination of values.
+
+    The combinations are identified with a mixed radix number built from the category
+    codes of the columns. Combinations with any missing value result in a missing value.
+    """
+    columns = [_as_categorical(column) for column in columns]
+    combined = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        combined = combined * (len(column.cat.categories) + 1) + column.cat.codes.to_numpy() + 1
+
+    combination_codes, combinations = pd.factorize(combined)
+    labels = []
+    for combination in combinations:
+        parts = []
+        for column in reversed(columns):
+            radix = len(column.cat.categories) + 1
+            combination, code = divmod(combination, radix)
+            parts.append(column.cat.categories[code - 1] if code else None)
+
+        labels.append(None if None in parts else separator.join(map(str, reversed(parts))))
+
+    return _from_distinct(combination_codes, labels, columns[0].index)
+
+
+def _get_python_minor_version(python_version):
+    return str(python_version).rsplit('.', maxsplit=1)[0]
+
+
 def _mangle_columns(downloads):
+    """Rename the columns and add the derived ones that can be computed from them.
+
+    Downloads collected with a reduced query profile lack some of the columns, so only
+    the columns whose sources are present are converted and derived. The derived
+    columns are computed once per distinct value, or combination of values, and mapped
+    back to the rows through their category codes.
+    """
     downloads = downloads.rename(columns=RENAME_COLUMNS)
-    for col in [
-        'python_version',
-        'project',
-        'version',
-        'distro_name',
-        'distro_version',
-        'distro_kernel',
-    ]:
-        downloads[col] = downloads[col].astype('string')
-
-    downloads['full_python_version'] = downloads['python_version']
-    downloads['python_version'] = downloads['python_version'].str.rsplit('.', n=1).str[0]
-    downloads['project_version'] = downloads['project'] + '-' + downloads['version']
-    downloads['distro_version'] = downloads['distro_name'] + ' ' + downloads['distro_version']
-    downloads['distro_kernel'] = downloads['distro_version'] + ' - ' + downloads['distro_kernel']
-
-    downloads['is_prerelease'] = downloads['version'].apply(
-        _extract_version_attribute, args=('is_prerelease',)
-    )
-    downloads['is_postrelease'] = downloads['version'].apply(
-        _extract_version_attribute, args=('is_postrelease',)
-    )
-    downloads['is_devrelease'] = downloads['version'].apply(
-        _extract_version_attribute, args=('is_devrelease',)
-    )
+    if 'python_version' in downloads:
+        downloads['full_python_version'] = _as_categorical(downloads['python_version'])
+        downloads['python_version'] = _map_distinct(
+            downloads['full_python_version'], _get_python_minor_version
+        )
+
+    if 'version' in downloads:
+        downloads['version'] = _as_categorical(downloads['version'])
+        downloads['project_version'] = _join_distinct(
+            [downloads['project'], downloads['version']], '-'
+        )
+
+    if {'distro_name', 'distro_version'}.issubset(downloads.columns):
+        downloads['distro_version'] = _join_distinct(
+            [downloads['distro_name'], downloads['distro_version']], ' '
+        )
+        if 'distro_kernel' in downloads:
+            downloads['distro_kernel'] = _join_distinct(
+                [downloads['distro_version'], downloads['distro_kernel']], ' - '
+            )
+
+    if 'version' in downloads:
+        for attribute in ['is_prerelease', 'is_postrelease', 'is_devrelease']:
+            downloads[attribute] = _map_distinct(
+                downloads['version'], _extract_version_attribute, attribute
+            )
 
     return downloads
 
 
 def _version_order_key(version_column):
-    return version_column.apply(_safe_version_parse)
+    """Get the rank of every version, or NaN if it is missing or invalid, to sort them last."""
+    ranks, _ = encode_versions(version_column)
+    return pd.Series(ranks, index=version_column.index).where(ranks >= 0)
 
 
 def _sort_by_version(data, column, ascending=False):
-    data = data.sort_values(by=column, key=_version_order_key, ascending=ascending)
+    data = data.sort_values(by=column, key=_version_order_key, ascending=ascending, kind='stable')
     return data
 
 
-def compute_metrics(downloads, output_path=None):
-    """Compute aggregation metrics over the given downloads.
+def get_metrics_columns(columns):
+    """Get the columns that the metrics are computed over, given the columns of the downloads."""
+    columns = {RENAME_COLUMNS.get(column, column) for column in columns}
+    if 'python_version' in columns:
+        columns.add('full_python_version')
 
-    The computed metrics are stored in a spreadsheet file
-    in the path ``{output_folder}/{project}.xlsx``.
+    if 'version' in columns:
+        columns.update(['is_prerelease', 'is_postrelease', 'is_devrelease'])
+
+    return [
+        column
+        for column in dict.fromkeys(GROUPBY_COLUMNS + HISTORICAL_COLUMNS)
+        if column in columns
+    ]
+
+
+def get_state_columns(state):
+    """Get the columns that a metrics state has been computed over."""
+    return get_metrics_columns(state['column'].dropna().unique())
+
+
+def update_metrics_state(downloads, state=None, before=None):
+    """Fold the downloads of the closed months into the aggregated state of the metrics.
+
+    The state is a table with the counts of every month and value of the metrics columns,
+    as built by ``_get_cube_state``, which can be stored and passed to ``compute_metrics``
+    instead of the raw downloads of those months.
+
+    Args:
+        downloads (pandas.DataFrame):
+            Downloads that are not in the state yet.
+        state (pandas.DataFrame or None):
+            Current state of the closed months, if any.
+        before (datetime or None):
+            First month that is still open. Only the downloads of the previous months
+            are folded into the state. If `None`, all of them are folded.
+
+    Returns:
+        tuple[pandas.DataFrame, pandas.DataFrame]:
+            The updated state and the downloads of the months that are still open.
     """
-    downloads = _mangle_columns(downloads)
+    month_codes = _get_month_codes(downloads['timestamp'])
+    closed = month_codes >= 0
+    if before is not None:
+        before = pd.Timestamp(before).tz_localize(None).to_datetime64().astype('datetime64[M]')
+        closed &= month_codes < before.astype(np.int64)
+
+    states = [] if state is None else [state]
+    if closed.any():
+        closed_downloads = _mangle_columns(downloads[closed])
+        columns = get_metrics_columns(closed_downloads.columns)
+        states.append(_get_cube_state(_build_cube(closed_downloads, columns)))
+
+    state = pd.concat(states, ignore_index=True) if states else pd.DataFrame(columns=STATE_COLUMNS)
+    return state, downloads[~closed]
 
-    LOGGER.debug('Aggregating by month')
-    sheets = {'By Month': _by_month(downloads)}
 
+def compute_metrics(downloads, output_path=None, state=None):
+    """Compute aggregation metrics over the given downloads.
+
+    The computed metrics are stored in a spreadsheet file
+    in the path ``{output_folder}/{project}.xlsx``. Only the sheets of the columns
+    present in the downloads, which depend on the query profile, are created.
+
+    If the aggregated ``state`` of the previous months is given, as returned by
+    ``update_metrics_state``, only the ``downloads`` of the months after them are
+    aggregated, and the sheets are built from the combination of both.
+    """
+    if state is not None and downloads.empty:
+        cube = _cube_from_state(state, get_state_columns(state))
+    else:
+        downloads = _mangle_columns(downloads)
+        columns = get_metrics_columns(downloads.columns)
+        LOGGER.debug('Building the aggregation cube')
+        cube = _build_cube(downloads, columns)
+        if state is not None:
+            cube = _cube_from_state(pd.concat([state, _get_cube_state(cube)]), columns)
+
+    sheets = {'By Month': _by_month(cube)}
     for column in GROUPBY_COLUMNS:
+        if column not in cube['columns']:
+            continue
+
         name = _get_sheet_name(column)
         LOGGER.debug('Aggregating by %s', column)
-        sheet = _groupby(downloads, column)
+        sheet = _groupby(cube, column)
         if column in SORT_BY_DOWNLOADS:
             sheet = sheet.sort_values('downloads', ascending=False)
         elif column in SORT_BY_VERSION:
@@ -188,12 +470,28 @@ def compute_metrics(downloads, output_path=None):
         sheets[name] = sheet
 
     for column in HISTORICAL_COLUMNS:
+        if column not in cube['columns']:
+            continue
+
         LOGGER.debug('Aggregating by month and %s', column)
         name = 'Month and ' + _get_sheet_name(column)
-        sheets[name] = _historical_groupby(downloads, [column])
+        sheets[name] = _historical_groupby(cube, column)
 
     if output_path:
-        create_spreadsheet(output_path, sheets, na_rep='<NaN>')
+        create_spreadsheet(output_path, sheets, na_rep=NA_REP, constant_memory=True)
         return None
 
     return sheets
+
+
+def render_metrics(downloads, state=None):
+    """Compute the aggregation metrics and render them as the contents of a spreadsheet.
+
+    This does not do any I/O, so it can run in a separate process.
+
+    Returns:
+        bytes:
+            The contents of the ``xlsx`` file.
+    """
+    sheets = compute_metrics(downloads, state=state)
+    return render_spreadsheet(sheets, na_rep=NA_REP, constant_memory=True)
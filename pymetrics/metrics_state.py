@@ -0,0 +1,130 @@
+"""Functions to store the aggregated metrics of the closed months of each project.
+
+The state of every project is stored as a ``metrics_state_{project}.parquet`` file
+inside the history folder, and the ``metrics_state.csv`` index records, for each
+project, the first month that is not in the state yet and the newest segment of the
+history that had been written when the state was stored. A state is discarded when
+a newer segment of the history rewrites any of the months that it covers.
+"""
+
+import logging
+
+import pandas as pd
+
+from pymetrics.history import load_pypi_manifest
+from pymetrics.output import create_csv, create_parquet, get_path, load_csv, load_parquet
+
+LOGGER = logging.getLogger(__name__)
+
+STATE_TEMPLATE = 'metrics_state_{project}.parquet'
+INDEX_FILENAME = 'metrics_state.csv'
+INDEX_COLUMNS = ['project', 'closed_until', 'segment']
+
+
+def load_metrics_index(output_folder):
+    """Load the index of the metrics states stored in the history folder.
+
+    Returns:
+        pandas.DataFrame:
+            Table with the ``project``, ``closed_until`` and ``segment`` of every state.
+            Empty if there is no index.
+    """
+    read_csv_kwargs = {
+        'parse_dates': ['closed_until'],
+        'dtype': {'project': str, 'segment': str},
+        'keep_default_na': False,
+    }
+    index = load_csv(get_path(output_folder, INDEX_FILENAME), read_csv_kwargs)
+    if index is None:
+        index = pd.DataFrame(columns=INDEX_COLUMNS)
+        index['closed_until'] = pd.to_datetime(index['closed_until'])
+
+    return index
+
+
+def _to_utc(date):
+    date = pd.Timestamp(date)
+    return date.tz_localize('UTC') if date.tz is None else date.tz_convert('UTC')
+
+
+def is_stale(manifest, project, closed_until, segment):
+    """Tell whether a newer segment of the history has rewritten any of the closed months."""
+    start_dates = pd.to_datetime(manifest['start_date'], utc=True)
+    rewrites = manifest[
+        (manifest['project'] == project)
+        & (manifest['segment'].fillna('') > segment)
+        & (start_dates < _to_utc(closed_until))
+    ]
+    return not rewrites.empty
+
+
+def load_metrics_state(output_folder, project, index=None, manifest=None):
+    """Load the metrics state of a project, if it is still valid.
+
+    Args:
+        output_folder (str):
+            Folder in which the history and the states are stored.
+        project (str):
+            Project to load the state of.
+        index (pandas.DataFrame or None):
+            Index of the states, as returned by ``load_metrics_index``. Loaded if not given.
+        manifest (pandas.DataFrame or None):
+            Manifest of the history. Loaded if not given.
+
+    Returns:
+        tuple[pandas.DataFrame, pandas.Timestamp] or tuple[None, None]:
+            The state and the first month that is not in it, or `None` and `None` if
+            there is no valid state for the project.
+    """
+    if index is None:
+        index = load_metrics_index(output_folder)
+
+    entries = index[index['project'] == project]
+    if entries.empty:
+        return None, None
+
+    entry = entries.iloc[-1]
+    manifest = load_pypi_manifest(output_folder) if manifest is None else manifest
+    if is_stale(manifest, project, entry['closed_until'], entry['segment']):
+        LOGGER.info('Discarding the metrics state of %s: the history has changed', project)
+        return None, None
+
+    path = get_path(output_folder, STATE_TEMPLATE.format(project=project))
+    state = load_parquet(path)
+    if state is None:
+        return None, None
+
+    return state.to_pandas(), entry['closed_until']
+
+
+def save_metrics_state(output_folder, project, state, closed_until, index, manifest):
+    """Store the metrics state of a project and record it in the index.
+
+    Args:
+        output_folder (str):
+            Folder in which the history and the states are stored.
+        project (str):
+            Project of the state.
+        state (pandas.DataFrame):
+            State to store, as returned by ``update_metrics_state``.
+        closed_until (datetime):
+            First month that is not in the state.
+        index (pandas.DataFrame):
+            Index of the states, as returned by ``load_metrics_index``.
+        manifest (pandas.DataFrame):
+            Manifest of the history that the state has been computed from.
+
+    Returns:
+        pandas.DataFrame:
+            The updated index.
+    """
+    segments = manifest.loc[manifest['project'] == project, 'segment'].dropna()
+    entry = pd.DataFrame({
+        'project': [project],
+        'closed_until': [_to_utc(closed_until).tz_localize(None)],
+        'segment': [segments.max() if len(segments) else ''],
+    })
+    create_parquet(get_path(output_folder, STATE_TEMPLATE.format(project=project)), state)
+    index = pd.concat([index[index['project'] != project], entry], ignore_index=True)
+    create_csv(get_path(output_folder, INDEX_FILENAME), index)
+    return index
@@ -1,10 +1,16 @@
 """Functions to create the output spreadsheet."""
 
+import datetime
 import io
 import logging
+import operator
 import pathlib
+import shutil
 
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+import xlsxwriter
 
 from pymetrics import drive
 
@@ -18,6 +24,26 @@ DATE_COLUMNS = [
     'user_created_at',
     'user_updated_at',
 ]
+# Column widths are computed over the first rows only, and capped.
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 100
+# Header format of the pandas 2 Excel writer and its default date format.
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+# CSV files read with row filters are read and filtered in chunks of this many rows.
+CSV_CHUNK_ROWS = 1_000_000
+FILTER_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda values, value: values.isin(value),
+    'not in': lambda values, value: ~values.isin(value),
+}
+# A fixed creation date makes the same sheets always render to the same bytes.
+WORKBOOK_PROPERTIES = {'created': datetime.datetime(2000, 1, 1)}
 
 
 def get_path(folder, filename):
@@ -34,24 +60,150 @@ def get_path(folder, filename):
     return str(pathlib.Path(folder) / filename)
 
 
+def _get_column_width(column, name, na_rep=''):
+    """Get the width of a column from the length of its name and of its values.
+
+    Categorical columns are measured on their categories and the rest on a sample of
+    their first rows, and the width is capped to ``MAX_COLUMN_WIDTH``.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        values = column.cat.categories.to_series()
+    else:
+        values = column.iloc[:WIDTH_SAMPLE_ROWS]
+
+    width = len(str(name))
+    if len(values):
+        width = max(width, values.astype(str).str.len().max())
+    if column.hasnans:
+        width = max(width, len(na_rep))
+
+    return min(width, MAX_COLUMN_WIDTH) + 2
+
+
 def _add_sheet(writer, data, sheet_name, na_rep=''):
     data.to_excel(writer, sheet_name=sheet_name, index=False, engine='xlsxwriter', na_rep=na_rep)
 
-    for column in data:
-        column_length = None
-        if isinstance(column, (int, float)):
-            column_length = len(str(column))
-        else:
-            column_length = len(column)
-
-        column_width = max(data[column].astype(str).map(len).max(), column_length)
-        col_idx = data.columns.get_loc(column)
+    for col_idx, column in enumerate(data):
+        column_width = _get_column_width(data[column], column, na_rep)
         writer.sheets[sheet_name].set_column(
-            first_col=col_idx, last_col=col_idx, width=column_width + 2
+            first_col=col_idx, last_col=col_idx, width=column_width
         )
 
 
-def create_spreadsheet(output_path, sheets, na_rep=''):
+def _to_cell(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _get_cells(column, na_rep=''):
+    """Get the values of a column as a list of cells, with the missing values replaced."""
+    if pd.api.types.is_datetime64_any_dtype(column):
+        values = list(column.dt.to_pydatetime())
+    else:
+        values = column.tolist()
+        if column.dtype == object:
+            values = [_to_cell(value) for value in values]
+
+    if column.hasnans:
+        missing = column.isna().to_numpy()
+        values = [na_rep if is_missing else value for value, is_missing in zip(values, missing)]
+
+    return values
+
+
+def _write_sheet(workbook, data, sheet_name, na_rep=''):
+    """Write a sheet directly with xlsxwriter, one row at a time.
+
+    The values are read once per column, without converting the table to objects,
+    and written in row order, so the workbook can use the ``constant_memory`` mode.
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    for col_idx, column in enumerate(data):
+        worksheet.set_column(col_idx, col_idx, _get_column_width(data[column], column, na_rep))
+
+    header_format = workbook.add_format(HEADER_FORMAT)
+    worksheet.write_row(0, 0, [_to_cell(column) for column in data.columns], header_format)
+    columns = [_get_cells(data[column], na_rep) for column in data]
+    for row_idx, row in enumerate(zip(*columns), start=1):
+        worksheet.write_row(row_idx, 0, row)
+
+
+def render_spreadsheet(sheets, na_rep='', constant_memory=False):
+    """Render the given sheets as the contents of a spreadsheet file.
+
+    Args:
+        sheets (dict[str, pandas.DataFrame]):
+            Sheets to render, passed as a dict that contains sheet titles as
+            keys and sheet contents as values, passed as pandas.DataFrames.
+        na_rep (str):
+            Representation of the missing values.
+        constant_memory (bool):
+            Whether to write the rows directly with the xlsxwriter ``constant_memory``
+            mode instead of going through ``pandas.DataFrame.to_excel``, which is faster
+            and uses less memory for large sheets.
+
+    Returns:
+        bytes:
+            The contents of the ``xlsx`` file.
+    """
+    output = io.BytesIO()
+
+    if constant_memory:
+        options = {'constant_memory': True, 'default_date_format': DATE_FORMAT}
+        with xlsxwriter.Workbook(output, options) as workbook:
+            workbook.set_properties(WORKBOOK_PROPERTIES)
+            for title, data in sheets.items():
+                _write_sheet(workbook, data, title, na_rep=na_rep)
+    else:
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:  # pylint: disable=E0110
+            writer.book.set_properties(WORKBOOK_PROPERTIES)
+            for title, data in sheets.items():
+                _add_sheet(writer, data, title, na_rep=na_rep)
+
+    return output.getvalue()
+
+
+def _get_filename(path):
+    if drive.is_drive_path(path):
+        return drive.split_drive_path(path)[1]
+
+    return pathlib.Path(path).name
+
+
+def _is_unchanged(output_path, contents, fingerprints):
+    if fingerprints is None or not fingerprints.is_unchanged(_get_filename(output_path), contents):
+        return False
+
+    LOGGER.info('Skipping unchanged file %s', output_path)
+    return True
+
+
+def write_spreadsheet(output_path, contents, fingerprints=None):
+    """Write the contents of a rendered spreadsheet to a local or Google Drive path.
+
+    If ``fingerprints`` are given, as a ``FingerprintManifest``, the spreadsheet is not
+    written if its contents have not changed since the last time it was written.
+    """
+    if not drive.is_drive_path(output_path) and not output_path.endswith('.xlsx'):
+        output_path += '.xlsx'
+
+    if _is_unchanged(output_path, contents, fingerprints):
+        return
+
+    if drive.is_drive_path(output_path):
+        folder, filename = drive.split_drive_path(output_path)
+        LOGGER.info(f'Creating filename {filename}')
+        drive.upload(io.BytesIO(contents), filename, folder, convert=True)
+    else:
+        LOGGER.info('Creating file %s', output_path)
+        local_path = pathlib.Path(output_path)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        local_path.write_bytes(contents)
+
+    if fingerprints is not None:
+        fingerprints.record(_get_filename(output_path), contents)
+
+
+def create_spreadsheet(output_path, sheets, na_rep='', constant_memory=False, fingerprints=None):
     """Create a spreadsheet with the indicated name and data.
 
     If the ``output_path`` variable starts with ``gdrive://`` it is interpreted
@@ -69,28 +221,19 @@ def create_spreadsheet(output_path, sheets, na_rep=''):
         sheets (dict[str, pandas.DataFrame]):
             Sheets to created, passed as a dict that contains sheet titles as
             keys and sheet contents as values, passed as pandas.DataFrames.
+        na_rep (str):
+            Representation of the missing values.
+        constant_memory (bool):
+            Whether to use the faster ``constant_memory`` writer.
+        fingerprints (FingerprintManifest or None):
+            If given, the file is not written if its contents have not changed since
+            the last time it was written.
     """
-    output = io.BytesIO()
+    contents = render_spreadsheet(sheets, na_rep=na_rep, constant_memory=constant_memory)
+    write_spreadsheet(output_path, contents, fingerprints=fingerprints)
 
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:  # pylint: disable=E0110
-        for title, data in sheets.items():
-            _add_sheet(writer, data, title, na_rep=na_rep)
 
-    if drive.is_drive_path(output_path):
-        folder, filename = drive.split_drive_path(output_path)
-        LOGGER.info(f'Creating filename {filename}')
-        drive.upload(output, filename, folder, convert=True)
-    else:
-        if not output_path.endswith('.xlsx'):
-            output_path += '.xlsx'
-
-        LOGGER.info('Creating file %s', output_path)
-        output_path = pathlib.Path(output_path)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        output_path.write_bytes(output.getbuffer())
-
-
-def create_csv(output_path, data):
+def create_csv(output_path, data, fingerprints=None):
     """Create a CSV with the indicated name and data.
 
     Args:
@@ -99,6 +242,9 @@ def create_csv(output_path, data):
         data (dict[str, pandas.DataFrame]):
             Sheets to created, passed as a dict that contains sheet titles as
             keys and sheet contents as values, passed as pandas.DataFrames.
+        fingerprints (FingerprintManifest or None):
+            If given, the file is not written if its contents have not changed since
+            the last time it was written.
     """
     output = io.BytesIO()
     data.to_csv(output, index=False)
@@ -106,6 +252,42 @@ def create_csv(output_path, data):
     if not output_path.endswith('.csv'):
         output_path += '.csv'
 
+    if _is_unchanged(output_path, output.getvalue(), fingerprints):
+        return
+
+    LOGGER.info('Creating file %s', output_path)
+
+    if drive.is_drive_path(output_path):
+        folder, filename = drive.split_drive_path(output_path)
+        drive.upload(output, filename, folder)
+    else:
+        local_path = pathlib.Path(output_path)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        local_path.write_bytes(output.getbuffer())
+
+    if fingerprints is not None:
+        fingerprints.record(_get_filename(output_path), output.getvalue())
+
+
+def create_parquet(output_path, data):
+    """Create a Parquet file with the indicated name and data.
+
+    Categorical columns are stored as dictionary encoded columns, which keeps
+    the files small and allows them to be loaded back as categoricals.
+
+    Args:
+        output_path (str):
+            Path to where the file must be created, which can be local or to
+            a Google Drive folder.
+        data (pandas.DataFrame):
+            Table to store.
+    """
+    output = io.BytesIO()
+    data.to_parquet(output, index=False, engine='pyarrow', compression='zstd')
+
+    if not output_path.endswith('.parquet'):
+        output_path += '.parquet'
+
     LOGGER.info('Creating file %s', output_path)
 
     if drive.is_drive_path(output_path):
@@ -117,6 +299,65 @@ def create_csv(output_path, data):
         output_path.write_bytes(output.getbuffer())
 
 
+def upload_file(local_path, output_path):
+    """Copy a local file to the indicated path, which can be local or to a Google Drive folder.
+
+    Args:
+        local_path (str or pathlib.Path):
+            Path to the local file to copy.
+        output_path (str):
+            Path to where the file must be created.
+    """
+    LOGGER.info('Creating file %s', output_path)
+    if drive.is_drive_path(output_path):
+        folder, filename = drive.split_drive_path(output_path)
+        drive.upload(io.BytesIO(pathlib.Path(local_path).read_bytes()), filename, folder)
+    else:
+        output_path = pathlib.Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(local_path, output_path)
+
+
+def list_folder(folder):
+    """List the names of the files found in a folder.
+
+    Aware of both local and Google Drive path formats.
+
+    Args:
+        folder (str):
+            Local path or Google Drive path in the format `gdrive://{folder_id}`.
+
+    Returns:
+        list[str]:
+            Names of the files in the folder. Empty if the folder does not exist.
+    """
+    folder = folder.rstrip('/')
+    if drive.is_drive_path(folder):
+        return drive.list_files(folder[len('gdrive://') :])
+
+    folder = pathlib.Path(folder)
+    if not folder.is_dir():
+        return []
+
+    return sorted(path.name for path in folder.iterdir() if path.is_file())
+
+
+def delete_file(path):
+    """Delete a file, aware of both local and Google Drive path formats.
+
+    Missing files are ignored.
+    """
+    LOGGER.info('Deleting file %s', path)
+    try:
+        if drive.is_drive_path(path):
+            folder, filename = drive.split_drive_path(path)
+            drive.delete(folder, filename)
+        else:
+            pathlib.Path(path).unlink()
+    except FileNotFoundError:
+        LOGGER.info('Failed to delete file %s: not found', path)
+
+
 def load_spreadsheet(spreadsheet):
     """Load a spreadsheet previously created by pymetrics.
 
@@ -153,12 +394,35 @@ def load_spreadsheet(spreadsheet):
     return sheets
 
 
-def load_csv(csv_path, read_csv_kwargs=None):
+def _filter_rows(data, filters):
+    """Keep the rows that match all the filters, given in the ``pyarrow.parquet`` format."""
+    mask = pd.Series(True, index=data.index)
+    for column, op, value in filters:
+        values = data[column]
+        if isinstance(values.dtype, pd.DatetimeTZDtype) and op not in ('in', 'not in'):
+            value = pd.Timestamp(value)
+            if value.tz is None:
+                value = value.tz_localize(values.dt.tz)
+
+        mask &= FILTER_OPERATORS[op](values, value)
+
+    return data[mask]
+
+
+def load_csv(csv_path, read_csv_kwargs=None, columns=None, filters=None):
     """Load a CSV previously created by pymetrics.
 
     Args:
         csv_path (str):
             Path to where the file is stored.
+        read_csv_kwargs (dict or None):
+            Additional arguments for ``pandas.read_csv``.
+        columns (list[str] or None):
+            Columns to read. Columns that are not in the file are skipped. If `None`,
+            read all of them.
+        filters (list[tuple] or None):
+            Row filters in the ``pyarrow.parquet`` format, like ``('project', 'in', names)``.
+            The file is read in chunks and only the matching rows of each chunk are kept.
 
     Return:
         pd.DataFrame:
@@ -168,8 +432,17 @@ def load_csv(csv_path, read_csv_kwargs=None):
         csv_path += '.csv'
 
     LOGGER.info('Trying to load CSV file %s', csv_path)
-    if not read_csv_kwargs:
-        read_csv_kwargs = {}
+    read_csv_kwargs = dict(read_csv_kwargs or {})
+    if columns is not None:
+        # The filtered columns are read too, and dropped once the rows are filtered.
+        usecols = set(columns) | {column for column, _, _ in filters or []}
+        read_csv_kwargs['usecols'] = lambda column: column in usecols
+        if 'parse_dates' in read_csv_kwargs:
+            parse_dates = read_csv_kwargs['parse_dates']
+            read_csv_kwargs['parse_dates'] = [column for column in parse_dates if column in usecols]
+    if filters:
+        read_csv_kwargs['chunksize'] = CSV_CHUNK_ROWS
+
     try:
         if drive.is_drive_path(csv_path):
             folder, filename = drive.split_drive_path(csv_path)
@@ -177,6 +450,19 @@ def load_csv(csv_path, read_csv_kwargs=None):
             data = pd.read_csv(stream, **read_csv_kwargs)
         else:
             data = pd.read_csv(csv_path, **read_csv_kwargs)
+
+        if filters:
+            with data as reader:
+                data = pd.concat([_filter_rows(chunk, filters) for chunk in reader])
+
+            # Chunks with different categories are concatenated as objects.
+            for column, dtype in read_csv_kwargs.get('dtype', {}).items():
+                if isinstance(dtype, pd.CategoricalDtype) and column in data:
+                    data[column] = data[column].astype(dtype)
+
+            data = data.reset_index(drop=True)
+            if columns is not None:
+                data = data[[column for column in data.columns if column in columns]]
     except FileNotFoundError:
         LOGGER.info('Failed to load CSV file %s: not found', csv_path)
         return None
@@ -186,6 +472,50 @@ def load_csv(csv_path, read_csv_kwargs=None):
     return data
 
 
+def load_parquet(parquet_path, columns=None, filters=None):
+    """Load a Parquet file previously created by pymetrics.
+
+    Args:
+        parquet_path (str):
+            Path to where the file is stored.
+        columns (list[str] or None):
+            Columns to read. Columns that are not in the file are skipped. If `None`,
+            read all of them.
+        filters (list[tuple] or None):
+            Row filters in the ``pyarrow.parquet`` format, which are pushed
+            down to the reader.
+
+    Return:
+        pyarrow.Table:
+            Parquet contents, or `None` if the file does not exist.
+    """
+    if not parquet_path.endswith('.parquet'):
+        parquet_path += '.parquet'
+
+    LOGGER.info('Trying to load Parquet file %s', parquet_path)
+    try:
+        if drive.is_drive_path(parquet_path):
+            folder, filename = drive.split_drive_path(parquet_path)
+            source = drive.download(folder, filename)
+        else:
+            source = parquet_path
+
+        if columns is not None:
+            names = pq.read_schema(source).names
+            columns = [column for column in columns if column in names]
+            if hasattr(source, 'seek'):
+                source.seek(0)
+
+        table = pq.read_table(source, columns=columns, filters=filters)
+    except FileNotFoundError:
+        LOGGER.info('Failed to load Parquet file %s: not found', parquet_path)
+        return None
+
+    LOGGER.info('Loaded Parquet %s', parquet_path)
+
+    return table
+
+
 def append_row(df, row):
     """Append a dictionary as a row to a DataFrame."""
     return pd.concat([df, pd.DataFrame(data=row)], ignore_index=True)
@@ -1,11 +1,23 @@
 """Functions to get PyPI downloads from Google Big Query."""
 
+import collections
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 import pandas as pd
 
-from pymetrics.bq import run_query
+from pymetrics.bq import run_query, run_query_batches
+from pymetrics.gaps import get_day_coverage, get_missing_ranges
+from pymetrics.history import (
+    SegmentWriter,
+    fill_download_counts,
+    get_pypi_history_range,
+    load_pypi_history,
+    load_pypi_manifest,
+    write_pypi_history,
+)
+from pymetrics.output import create_csv, get_path, load_csv
 from pymetrics.time_utils import get_current_utc
 
 LOGGER = logging.getLogger(__name__)
@@ -13,44 +25,125 @@ LOGGER = logging.getLogger(__name__)
 
 QUERY_TEMPLATE = """
 SELECT
-    timestamp,
-    country_code,
-    file.project                    as project,
-    file.version                    as version,
-    file.type                       as type,
-    details.installer.name          as installer_name,
-    details.implementation.name     as implementation_name,
-    details.implementation.version  as implementation_version,
-    details.distro.name             as distro_name,
-    details.distro.version          as distro_version,
-    details.system.name             as system_name,
-    details.system.release          as system_release,
-    details.cpu                     as cpu,
-    details.ci                      as ci,
+{select}
 FROM `bigquery-public-data.pypi.file_downloads`
-WHERE file.project in {projects}
-    AND timestamp > '{start_date}'
-    AND timestamp < '{end_date}'
+WHERE {conditions}
 """
-OUTPUT_COLUMNS = [
-    'timestamp',
-    'country_code',
-    'project',
-    'version',
-    'type',
-    'installer_name',
-    'implementation_name',
-    'implementation_version',
-    'distro_name',
-    'distro_version',
-    'system_name',
-    'system_release',
-    'cpu',
-    'ci',
-]
-
-
-def _get_query(projects, start_date, end_date):
+AGGREGATE_QUERY_TEMPLATE = """
+SELECT
+{select}
+    COUNT(*)                        as downloads,
+FROM `bigquery-public-data.pypi.file_downloads`
+WHERE {conditions}
+GROUP BY {group_by}
+"""
+QUERY_COLUMNS = {
+    'timestamp': 'timestamp',
+    'country_code': 'country_code',
+    'project': 'file.project',
+    'version': 'file.version',
+    'type': 'file.type',
+    'installer_name': 'details.installer.name',
+    'implementation_name': 'details.implementation.name',
+    'implementation_version': 'details.implementation.version',
+    'distro_name': 'details.distro.name',
+    'distro_version': 'details.distro.version',
+    'system_name': 'details.system.name',
+    'system_release': 'details.system.release',
+    'cpu': 'details.cpu',
+    'ci': 'details.ci',
+}
+OUTPUT_COLUMNS = list(QUERY_COLUMNS)
+
+# Columns selected by each query profile. BigQuery bills by the columns scanned,
+# so the smaller profiles are much cheaper to collect.
+QUERY_PROFILES = {
+    'summary': ['timestamp', 'project', 'version'],
+    'metrics': [
+        'timestamp',
+        'country_code',
+        'project',
+        'version',
+        'installer_name',
+        'implementation_version',
+        'distro_name',
+        'distro_version',
+        'system_name',
+        'system_release',
+        'cpu',
+        'ci',
+    ],
+    'full': OUTPUT_COLUMNS,
+}
+REQUIRED_COLUMNS = ['timestamp', 'project']
+
+
+def get_query_columns(profile=None, aggregate=False, profiles=None):
+    """Get the columns selected by a query profile.
+
+    Args:
+        profile (str or None):
+            Name of the profile. If `None`, ``metrics`` is used for aggregated queries
+            and ``full`` otherwise.
+        aggregate (bool):
+            Whether the query aggregates the downloads by day.
+        profiles (dict[str, list[str]] or None):
+            Profiles that extend or override the default ``QUERY_PROFILES``.
+
+    Returns:
+        list[str]:
+            The names of the columns to select.
+    """
+    profiles = {**QUERY_PROFILES, **(profiles or {})}
+    if profile is None:
+        profile = 'metrics' if aggregate else 'full'
+
+    if profile not in profiles:
+        raise ValueError(f'Unknown query profile {profile}. Use one of {sorted(profiles)}')
+
+    columns = profiles[profile]
+    unknown = set(columns) - set(QUERY_COLUMNS)
+    if unknown:
+        raise ValueError(f'Unknown columns in query profile {profile}: {sorted(unknown)}')
+
+    selected = set(columns) | set(REQUIRED_COLUMNS)
+    return [column for column in OUTPUT_COLUMNS if column in selected]
+
+
+def _render_query(conditions, aggregate=False, columns=None):
+    if columns is None:
+        columns = get_query_columns(aggregate=aggregate)
+
+    select = []
+    for column in columns:
+        expression = QUERY_COLUMNS[column]
+        if aggregate and column == 'timestamp':
+            expression = 'TIMESTAMP_TRUNC(timestamp, DAY)'
+
+        select.append(f'    {expression:<31} as {column},')
+
+    if aggregate:
+        group_by = ', '.join(str(position) for position in range(1, len(columns) + 1))
+        return AGGREGATE_QUERY_TEMPLATE.format(
+            select='\n'.join(select), conditions=conditions, group_by=group_by
+        )
+
+    return QUERY_TEMPLATE.format(select='\n'.join(select), conditions=conditions)
+
+
+# Missing ranges further apart than this are filled with separate queries.
+MAX_GAP_DISTANCE = pd.Timedelta(days=7)
+
+WATERMARKS_FILENAME = 'pypi_watermarks.csv'
+WATERMARK_COLUMNS = ['project', 'start_date', 'end_date']
+
+# Downloads keep arriving to the BigQuery dataset for a while after they happen,
+# so only the query results for days older than this are cached, and the more
+# recent days are queried again on the next run.
+CACHE_MIN_AGE = pd.Timedelta(days=1)
+
+
+def _format_projects(projects):
     if isinstance(projects, list):
         projects = tuple(projects)
 
@@ -60,15 +153,266 @@ def _get_query(projects, start_date, end_date):
     if isinstance(projects, str):
         projects = f"('{projects}')"
 
+    return projects
+
+
+def _get_query(projects, start_date, end_date, aggregate=False, columns=None):
+    projects = _format_projects(projects)
     LOGGER.info('Querying for projects `%s` between `%s` and `%s`', projects, start_date, end_date)
 
-    return QUERY_TEMPLATE.format(
-        projects=projects,
-        start_date=start_date.isoformat(),
-        end_date=end_date.isoformat(),
+    conditions = (
+        f'file.project in {projects}\n'
+        f"    AND timestamp > '{start_date.isoformat()}'\n"
+        f"    AND timestamp < '{end_date.isoformat()}'"
+    )
+    return _render_query(conditions, aggregate=aggregate, columns=columns)
+
+
+def _format_date(date):
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+
+def _get_windows_query(windows, aggregate=False, columns=None):
+    """Build a single query that covers a different date range for each project.
+
+    Projects that share the same range are grouped in a single predicate, and the
+    overall range is added as well so that BigQuery only scans the needed partitions.
+    ``windows`` can also be a list of windows dicts, to query several ranges for
+    the same project in a single query.
+    """
+    if isinstance(windows, dict):
+        windows = [windows]
+
+    projects_by_window = {}
+    for round_windows in windows:
+        for project, window in round_windows.items():
+            projects_by_window.setdefault(window, []).append(project)
+
+    predicates = []
+    for (start_date, end_date), projects in sorted(projects_by_window.items()):
+        projects = _format_projects(projects)
+        LOGGER.info(
+            'Querying for projects `%s` between `%s` and `%s`', projects, start_date, end_date
+        )
+        predicates.append(
+            f'(file.project in {projects}'
+            f" AND timestamp >= '{_format_date(start_date)}'"
+            f" AND timestamp < '{_format_date(end_date)}')"
+        )
+
+    min_date = min(start_date for start_date, _ in projects_by_window)
+    max_date = max(end_date for _, end_date in projects_by_window)
+    conditions = (
+        f"timestamp >= '{_format_date(min_date)}'\n"
+        f"    AND timestamp < '{_format_date(max_date)}'\n"
+        '    AND (\n        ' + '\n        OR '.join(predicates) + '\n    )'
+    )
+    return _render_query(conditions, aggregate=aggregate, columns=columns)
+
+
+def load_watermarks(output_folder):
+    """Load the date range that has already been collected for each project.
+
+    Args:
+        output_folder (str):
+            Folder in which the watermarks table is stored.
+
+    Returns:
+        dict[str, tuple[pandas.Timestamp, pandas.Timestamp]]:
+            The ``[start_date, end_date)`` range collected for each project.
+    """
+    read_csv_kwargs = {'parse_dates': ['start_date', 'end_date'], 'dtype': {'project': str}}
+    watermarks = load_csv(get_path(output_folder, WATERMARKS_FILENAME), read_csv_kwargs)
+    if watermarks is None:
+        return {}
+
+    return {
+        row.project: (row.start_date, row.end_date) for row in watermarks.itertuples(index=False)
+    }
+
+
+def save_watermarks(output_folder, watermarks):
+    """Store the date range that has been collected for each project."""
+    watermarks = pd.DataFrame(
+        [(project, start, end) for project, (start, end) in sorted(watermarks.items())],
+        columns=WATERMARK_COLUMNS,
+    )
+    create_csv(get_path(output_folder, WATERMARKS_FILENAME), watermarks)
+
+
+def _get_complete_end(end_date):
+    """Get the end of a collected range, excluding the recent days that may be incomplete."""
+    today = pd.Timestamp(get_current_utc().date())
+    return min(pd.Timestamp(end_date), today - CACHE_MIN_AGE)
+
+
+def _derive_watermarks(history_folder, projects):
+    """Derive the collected range of the projects from the history manifest or its data."""
+    manifest = load_pypi_manifest(history_folder)
+    watermarks = {}
+    for project in projects:
+        entries = manifest[manifest['project'] == project]
+        if not entries.empty:
+            end_date = _get_complete_end(entries['end_date'].max())
+            watermarks[project] = (entries['start_date'].min(), end_date)
+        else:
+            min_date, max_date = get_pypi_history_range(history_folder, [project])
+            if min_date is not None:
+                # The last day may be incomplete, so it is not considered as collected.
+                watermarks[project] = (min_date.normalize(), max_date.normalize())
+
+    return watermarks
+
+
+def _update_watermarks(watermarks, windows):
+    """Add the collected windows to the watermarks.
+
+    The most recent day of a window is not considered as collected, because its
+    downloads may still be arriving to BigQuery, so it is queried again on the next run.
+    """
+    watermarks = dict(watermarks)
+    for project, (start_date, end_date) in windows.items():
+        end_date = _get_complete_end(end_date)
+        if project not in watermarks:
+            watermarks[project] = (start_date, end_date)
+            continue
+
+        previous_start, previous_end = watermarks[project]
+        if start_date > previous_end or end_date < previous_start:
+            LOGGER.warning('Collected range of %s is not contiguous with the previous one', project)
+            if start_date > previous_end:
+                watermarks[project] = (start_date, end_date)
+        else:
+            watermarks[project] = (min(start_date, previous_start), max(end_date, previous_end))
+
+    return watermarks
+
+
+def _get_project_windows(projects, watermarks, start_date, end_date, max_days, force=False):
+    """Get the date range that is missing for each project.
+
+    Projects without a watermark are collected from ``start_date`` or from ``max_days``
+    before ``end_date``. Projects with a watermark are collected from their watermark
+    onwards, or backfilled up to it if a ``start_date`` before it is given.
+    If ``force`` is `True`, the watermarks are ignored.
+    """
+    end_date = pd.Timestamp(end_date or get_current_utc().date())
+    if start_date is None:
+        default_start = end_date - pd.Timedelta(days=max_days)
+    else:
+        default_start = pd.Timestamp(start_date).normalize()
+
+    windows = {}
+    for project in projects:
+        watermark = watermarks.get(project)
+        if watermark is None or force:
+            window = (default_start, end_date)
+        elif start_date is not None and default_start < watermark[0]:
+            window = (default_start, watermark[0])
+        else:
+            window = (watermark[1], end_date)
+
+        if window[0] < window[1]:
+            windows[project] = window
+        else:
+            LOGGER.info('Project %s is already up to date', project)
+
+    return windows
+
+
+def _get_shards(windows, shard_days):
+    """Split the windows of the projects in consecutive shards of ``shard_days`` days.
+
+    Returns:
+        list[dict]:
+            The windows of the projects within each shard, in chronological order.
+    """
+    min_date = min(start_date for start_date, _ in windows.values())
+    max_date = max(end_date for _, end_date in windows.values())
+    shards = []
+    shard_start = min_date
+    while shard_start < max_date:
+        shard_end = min(shard_start + pd.Timedelta(days=shard_days), max_date)
+        shard = {}
+        for project, (start_date, end_date) in windows.items():
+            start_date, end_date = max(start_date, shard_start), min(end_date, shard_end)
+            if start_date < end_date:
+                shard[project] = (start_date, end_date)
+
+        if shard:
+            shards.append(shard)
+
+        shard_start = shard_end
+
+    return shards
+
+
+def _is_backfill(windows, watermarks):
+    return all(
+        project in watermarks and end_date == watermarks[project][0]
+        for project, (_, end_date) in windows.items()
     )
 
 
+def _get_shard_series(windows, watermarks, shard_days):
+    """Split the windows in shards, in the order in which they must be collected.
+
+    The windows that backfill a project up to its watermark and the ones that move it
+    forward are sharded as separate series. The backfill shards go first, from the
+    newest one backwards, followed by the forward shards in chronological order, so
+    every shard of a project is adjacent to the range already collected for it.
+
+    Returns:
+        list[dict]:
+            The windows of the projects within each shard.
+    """
+    backfill = {
+        project: window
+        for project, window in windows.items()
+        if _is_backfill({project: window}, watermarks)
+    }
+    forward = {project: window for project, window in windows.items() if project not in backfill}
+    shards = []
+    if backfill:
+        shards.extend(reversed(_get_shards(backfill, shard_days)))
+
+    if forward:
+        shards.extend(_get_shards(forward, shard_days))
+
+    return shards
+
+
+def _iter_shard_downloads(
+    shards, aggregate, columns, parallel_queries, dry_run, credentials_file, cache, ledger
+):
+    """Run the query of each shard concurrently and yield the results in order.
+
+    At most ``parallel_queries`` queries are in flight at the same time, and the
+    results of a shard are only yielded after the ones of all the previous shards.
+    """
+
+    def run_shard(shard):
+        query = _get_windows_query(shard, aggregate=aggregate, columns=columns)
+        shard_cache = _get_query_cache(cache, max(end_date for _, end_date in shard.values()))
+        return run_query(query, dry_run, credentials_file, cache=shard_cache, ledger=ledger)
+
+    with ThreadPoolExecutor(max_workers=parallel_queries) as executor:
+        pending = collections.deque()
+        try:
+            for shard in shards:
+                pending.append((shard, executor.submit(run_shard, shard)))
+                if len(pending) >= parallel_queries:
+                    shard, future = pending.popleft()
+                    yield shard, future.result()
+
+            while pending:
+                shard, future = pending.popleft()
+                yield shard, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
 def _get_query_dates(start_date, min_date, max_date, max_days, force=False):
     end_date = get_current_utc().date()
     if start_date is None:
@@ -90,6 +434,270 @@ def _get_query_dates(start_date, min_date, max_date, max_days, force=False):
     return start_date, end_date
 
 
+def _get_query_cache(cache, end_date):
+    """Return the cache only if all the queried data is old enough to be complete."""
+    if cache is None:
+        return None
+
+    today = pd.Timestamp(get_current_utc().date())
+    if pd.Timestamp(end_date) > today - CACHE_MIN_AGE:
+        LOGGER.info('Not caching the query results because they include recent downloads')
+        return None
+
+    return cache
+
+
+def _normalize_downloads(downloads):
+    downloads['timestamp'] = downloads['timestamp'].dt.tz_convert(None)
+    return downloads.sort_values('timestamp')
+
+
+def _prepare_downloads(downloads, aggregate, columns):
+    if downloads is None:
+        columns = columns + ['downloads'] if aggregate else columns
+        return pd.DataFrame(columns=columns)
+
+    if not downloads.empty:
+        downloads = _normalize_downloads(downloads)
+
+    return downloads
+
+
+def _get_history_gaps(history_folder, projects):
+    """Get the day ranges missing in the middle of the stored history of each project."""
+    downloads = load_pypi_history(
+        history_folder, projects=projects, columns=['project', 'timestamp']
+    )
+    if downloads is None:
+        return {}
+
+    coverage = get_day_coverage(downloads, projects, load_pypi_manifest(history_folder))
+    return get_missing_ranges(coverage)
+
+
+def _cluster_gaps(gaps, max_distance=MAX_GAP_DISTANCE):
+    """Group the missing ranges of all the projects in clusters of nearby ranges.
+
+    A range starts a new cluster when it begins more than ``max_distance`` after the end
+    of all the previous ones, so a query per cluster never scans the partitions of the
+    long stretches of days between distant gaps.
+
+    Returns:
+        list[dict[str, list[tuple]]]:
+            The missing ranges of each project within each cluster, in chronological order.
+    """
+    ranges = sorted(
+        (start_date, end_date, project)
+        for project, project_ranges in gaps.items()
+        for start_date, end_date in project_ranges
+    )
+    clusters = []
+    cluster_end = None
+    for start_date, end_date, project in ranges:
+        if cluster_end is None or start_date - cluster_end > max_distance:
+            clusters.append({})
+            cluster_end = end_date
+
+        clusters[-1].setdefault(project, []).append((start_date, end_date))
+        cluster_end = max(cluster_end, end_date)
+
+    return clusters
+
+
+def _get_gap_rounds(gaps):
+    """Group the missing ranges in rounds of windows with at most one range per project."""
+    num_rounds = max(len(ranges) for ranges in gaps.values())
+    return [
+        {project: ranges[index] for project, ranges in gaps.items() if index < len(ranges)}
+        for index in range(num_rounds)
+    ]
+
+
+def _select_windows(downloads, windows):
+    selected = pd.Series(False, index=downloads.index)
+    for project, (start_date, end_date) in windows.items():
+        selected |= (
+            (downloads['project'] == project)
+            & (downloads['timestamp'] >= start_date)
+            & (downloads['timestamp'] < end_date)
+        )
+
+    return downloads[selected]
+
+
+def _fill_history_gaps(
+    history_folder, projects, aggregate, columns, dry_run, credentials_file, cache, ledger
+):
+    """Collect the days missing in the middle of the history with one query per cluster.
+
+    The missing ranges are detected from the days that have downloads and the windows
+    recorded in the manifest, so days collected without downloads are not queried again.
+    Nearby ranges are collected with a single query, and distant ones with separate
+    queries, so that no query scans the days between them.
+    """
+    gaps = _get_history_gaps(history_folder, projects)
+    if not gaps:
+        LOGGER.info('No missing days found in the history')
+        return
+
+    num_gaps = sum(len(ranges) for ranges in gaps.values())
+    clusters = _cluster_gaps(gaps)
+    LOGGER.info(
+        'Filling %s missing ranges of %s projects with %s queries',
+        num_gaps,
+        len(gaps),
+        len(clusters),
+    )
+    for cluster in clusters:
+        rounds = _get_gap_rounds(cluster)
+        query = _get_windows_query(rounds, aggregate=aggregate, columns=columns)
+        max_date = max(end_date for ranges in cluster.values() for _, end_date in ranges)
+        query_cache = _get_query_cache(cache, max_date)
+        downloads = run_query(query, dry_run, credentials_file, cache=query_cache, ledger=ledger)
+        downloads = _prepare_downloads(downloads, aggregate, columns)
+        LOGGER.info('Obtained %s missing downloads', len(downloads))
+        if not dry_run:
+            for windows in rounds:
+                gap_downloads = _select_windows(downloads, windows)
+                write_pypi_history(history_folder, gap_downloads, incremental=True, windows=windows)
+
+
+def _collect_shards(
+    history_folder,
+    windows,
+    watermarks,
+    shard_days,
+    parallel_queries,
+    aggregate,
+    columns,
+    dry_run,
+    credentials_file,
+    cache,
+    ledger,
+):
+    """Collect the windows in shards, checkpointing every shard once it is stored.
+
+    Shards are stored in order, each one as a new history segment followed by an update
+    of the watermarks, so an interrupted backfill resumes after the last stored shard.
+    Backfills that end at the current watermarks are collected from the newest shard
+    backwards, before the forward windows, so that the collected range of every
+    project is always contiguous.
+    """
+    shards = _get_shard_series(windows, watermarks, shard_days)
+
+    LOGGER.info('Splitting the query in %s shards of %s days', len(shards), shard_days)
+    shard_downloads = _iter_shard_downloads(
+        shards, aggregate, columns, parallel_queries, dry_run, credentials_file, cache, ledger
+    )
+    num_rows = 0
+    for shard, downloads in shard_downloads:
+        downloads = _prepare_downloads(downloads, aggregate, columns)
+        num_rows += len(downloads)
+        if not dry_run:
+            write_pypi_history(history_folder, downloads, incremental=True, windows=shard)
+            watermarks = _update_watermarks(watermarks, shard)
+            save_watermarks(history_folder, watermarks)
+
+    LOGGER.info('Obtained %s new downloads', num_rows)
+
+
+def _stream_pypi_downloads(
+    query, history_folder, windows, dry_run, credentials_file, cache, ledger
+):
+    batches = run_query_batches(query, dry_run, credentials_file, cache=cache, ledger=ledger)
+    if dry_run:
+        for _ in batches:
+            pass
+
+        return
+
+    with SegmentWriter(history_folder, windows=windows) as writer:
+        for batch in batches:
+            writer.write(_normalize_downloads(batch.to_pandas()))
+
+    LOGGER.info('Obtained %s new downloads', sum(writer.rows.values()))
+
+
+def _get_history_downloads(
+    projects,
+    history_folder,
+    start_date,
+    end_date,
+    max_days,
+    credentials_file,
+    dry_run,
+    force,
+    aggregate,
+    columns,
+    incremental,
+    stream,
+    cache,
+    shard_days,
+    parallel_queries,
+    ledger,
+    fill_gaps,
+):
+    if fill_gaps:
+        _fill_history_gaps(
+            history_folder,
+            projects,
+            aggregate=aggregate,
+            columns=columns,
+            dry_run=dry_run,
+            credentials_file=credentials_file,
+            cache=cache,
+            ledger=ledger,
+        )
+
+    watermarks = load_watermarks(history_folder)
+    missing = [project for project in projects if project not in watermarks]
+    if missing:
+        watermarks.update(_derive_watermarks(history_folder, missing))
+
+    windows = _get_project_windows(projects, watermarks, start_date, end_date, max_days, force)
+    if not windows:
+        LOGGER.info('All the projects are up to date')
+        return None
+
+    if shard_days is not None:
+        _collect_shards(
+            history_folder,
+            windows,
+            watermarks,
+            shard_days=shard_days,
+            parallel_queries=parallel_queries,
+            aggregate=aggregate,
+            columns=columns,
+            dry_run=dry_run,
+            credentials_file=credentials_file,
+            cache=cache,
+            ledger=ledger,
+        )
+        return None
+
+    query = _get_windows_query(windows, aggregate=aggregate, columns=columns)
+    cache = _get_query_cache(cache, max(end for _, end in windows.values()))
+    if stream:
+        _stream_pypi_downloads(
+            query, history_folder, windows, dry_run, credentials_file, cache, ledger
+        )
+        new_downloads = None
+    else:
+        new_downloads = run_query(query, dry_run, credentials_file, cache=cache, ledger=ledger)
+        new_downloads = _prepare_downloads(new_downloads, aggregate, columns)
+        if not dry_run:
+            write_pypi_history(
+                history_folder, new_downloads, incremental=incremental, windows=windows
+            )
+
+        LOGGER.info('Obtained %s new downloads', len(new_downloads))
+
+    if not dry_run:
+        save_watermarks(history_folder, _update_watermarks(watermarks, windows))
+
+    return new_downloads
+
+
 def get_pypi_downloads(
     projects,
     start_date=None,
@@ -99,6 +707,16 @@ def get_pypi_downloads(
     credentials_file=None,
     dry_run=False,
     force=False,
+    history_folder=None,
+    aggregate=False,
+    incremental=False,
+    stream=False,
+    cache=None,
+    shard_days=None,
+    parallel_queries=4,
+    ledger=None,
+    columns=None,
+    fill_gaps=False,
 ):
     """Get PyPI downloads data from the Big Query dataset.
 
@@ -123,32 +741,111 @@ def get_pypi_downloads(
         force (bool):
             Whether to force the query even if data already exists or the dates
             combination creates a gap. Defaults to False.
+        history_folder (str or None):
+            Folder of a partitioned Parquet history. If given, the date range already
+            collected for each project is read from the watermarks stored in it, a single
+            query covers only the range missing for each project, and the new downloads
+            are appended to it instead of being merged with ``previous``.
+        aggregate (bool):
+            Whether to aggregate the downloads in BigQuery by day and by the columns used
+            to compute the metrics. If `True`, each returned row has a ``downloads`` column
+            with the number of downloads that it represents. Defaults to `False`.
+        incremental (bool):
+            Whether to append the new downloads to the ``history_folder`` as a new segment,
+            without rewriting the previously stored partitions. Defaults to `False`.
+        stream (bool):
+            Whether to stream the results from BigQuery as Arrow record batches and append
+            each batch to the ``history_folder`` as it arrives, so that memory usage does
+            not depend on the size of the queried window. Implies ``incremental``.
+            Defaults to `False`.
+        cache (pymetrics.cache.LocalCache or None):
+            Local cache of query results. If given, and the queried window ends at
+            least one day before the current date, the results are read from it when
+            the same query has already been run, and stored in it otherwise.
+        shard_days (int or None):
+            If given, split the queried window in shards of this many days and run one
+            query per shard concurrently. With a ``history_folder``, every shard is stored
+            as soon as it and all the previous ones are done, so an interrupted backfill
+            resumes from the last stored shard. Defaults to `None`.
+        parallel_queries (int):
+            Maximum number of shard queries to run at the same time. Defaults to 4.
+        ledger (pymetrics.ledger.CostLedger or None):
+            Ledger in which the queries are recorded and which enforces the byte budgets.
+        columns (list[str] or None):
+            Columns to select and store, as returned by ``get_query_columns``. If `None`,
+            the default columns of the ``full`` or, if ``aggregate``, ``metrics`` profile.
+        fill_gaps (bool):
+            Whether to detect the days missing in the middle of the ``history_folder``,
+            for example because of a failed run, and collect them with a single query.
+            Defaults to `False`.
 
     Returns:
         pandas.DataFrame:
             Table with all the collected downloads, including any of the lines
-            listed in the ``previous`` table.
+            listed in the ``previous`` table. If ``history_folder`` is given,
+            only the new downloads are returned. If ``stream`` is `True`, ``shard_days``
+            is given, or all the projects are up to date, nothing is returned.
     """
+    if isinstance(projects, str):
+        projects = (projects,)
+
+    if columns is None:
+        columns = get_query_columns(aggregate=aggregate)
+
+    if stream and shard_days is not None:
+        raise ValueError('Streaming and sharding the downloads cannot be combined')
+
+    if history_folder is not None:
+        return _get_history_downloads(
+            projects,
+            history_folder,
+            start_date=start_date,
+            end_date=end_date,
+            max_days=max_days,
+            credentials_file=credentials_file,
+            dry_run=dry_run,
+            force=force,
+            aggregate=aggregate,
+            columns=columns,
+            incremental=incremental,
+            stream=stream,
+            cache=cache,
+            shard_days=shard_days,
+            parallel_queries=parallel_queries,
+            ledger=ledger,
+            fill_gaps=fill_gaps,
+        )
+
+    if stream or fill_gaps:
+        raise ValueError('Streaming and filling gaps require a history_folder')
+
     if previous is not None:
-        if isinstance(projects, str):
-            projects = (projects,)
         previous_projects = previous[previous['project'].isin(projects)]
         min_date = previous_projects['timestamp'].min().date()
         max_date = previous_projects['timestamp'].max().date()
     else:
-        previous = pd.DataFrame(columns=OUTPUT_COLUMNS)
+        previous = pd.DataFrame(columns=columns)
         min_date = None
         max_date = None
 
     start_date, end_date = _get_query_dates(start_date, min_date, max_date, max_days, force)
-    query = _get_query(projects, start_date, end_date)
+    if shard_days is not None:
+        windows = dict.fromkeys(projects, (pd.Timestamp(start_date), pd.Timestamp(end_date)))
+        shards = _get_shards(windows, shard_days)
+        shard_downloads = _iter_shard_downloads(
+            shards, aggregate, columns, parallel_queries, dry_run, credentials_file, cache, ledger
+        )
+        results = [downloads for _, downloads in shard_downloads if downloads is not None]
+        new_downloads = pd.concat(results, ignore_index=True) if results else None
+    else:
+        query = _get_query(projects, start_date, end_date, aggregate=aggregate, columns=columns)
+        cache = _get_query_cache(cache, end_date)
+        new_downloads = run_query(query, dry_run, credentials_file, cache=cache, ledger=ledger)
 
-    new_downloads = run_query(query, dry_run, credentials_file)
     if new_downloads is None or new_downloads.empty:
         all_downloads = previous
     else:
-        new_downloads['timestamp'] = new_downloads['timestamp'].dt.tz_convert(None)
-        new_downloads = new_downloads.sort_values('timestamp')
+        new_downloads = _normalize_downloads(new_downloads)
         if max_date is None:
             all_downloads = new_downloads
         else:
@@ -160,6 +857,7 @@ def get_pypi_downloads(
                 after = previous[previous.timestamp > new_downloads.timestamp.max()]
 
             all_downloads = pd.concat([before, after], ignore_index=True)
+            all_downloads = fill_download_counts(all_downloads)
 
     LOGGER.info('Obtained %s new downloads', len(all_downloads) - len(previous))
     return all_downloads
@@ -2,13 +2,23 @@
 
 import logging
 import os
+from collections import namedtuple
 
 import pandas as pd
-from packaging.version import Version, parse
 
+from pymetrics.history import load_pypi_history, load_pypi_manifest
 from pymetrics.output import append_row, create_spreadsheet, get_path, load_csv
-from pymetrics.time_utils import get_current_year, get_dt_now_spelled_out, get_min_max_dt_in_year
-
+from pymetrics.summary_state import load_summary_state, save_summary_state
+from pymetrics.time_utils import (
+    get_current_utc,
+    get_current_year,
+    get_dt_now_spelled_out,
+    get_first_datetime_in_year,
+    get_min_max_dt_in_year,
+)
+from pymetrics.versions import compare_versions, encode_versions, get_version_flags
+
+DOWNLOADS_COLUMN = 'downloads'
 TOTAL_COLUMN_NAME = 'Total Since Beginning'
 ECOSYSTEM_COLUMN_NAME = 'Ecosystem'
 BREAKDOWN_COLUMN_NAME = 'Library'
@@ -25,13 +35,103 @@ pre_bsl_versions = {
     'sdmetrics': None,
 }
 
+PYPI_DTYPES = {
+    'country_code': pd.CategoricalDtype(),
+    'project': pd.CategoricalDtype(),
+    'version': pd.CategoricalDtype(),
+    'type': pd.CategoricalDtype(),
+    'installer_name': pd.CategoricalDtype(),
+    'implementation_name': pd.CategoricalDtype(),
+    'implementation_version': pd.CategoricalDtype(),
+    'distro_name': pd.CategoricalDtype(),
+    'distro_version': pd.CategoricalDtype(),
+    'system_name': pd.CategoricalDtype(),
+    'system_release': pd.CategoricalDtype(),
+    'cpu': pd.CategoricalDtype(),
+    'ci': pd.BooleanDtype(),
+}
+
+SUMMARY_COLUMNS = ['timestamp', 'project', 'version', DOWNLOADS_COLUMN]
+# Downloads of the last days of a year may still be collected during the next one.
+CLOSED_YEAR_DELAY = pd.Timedelta(days=7)
+CountIndex = namedtuple('CountIndex', ['counts', 'versions'])
+
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _count_downloads(downloads):
+    """Count the downloads by project, year and version.
+
+    Rows are weighted by their ``downloads`` count, if any.
+
+    Args:
+        downloads (pd.DataFrame): PyPI Download data. It must contain the project, version,
+            and timestamp column.
+
+    Returns:
+        pd.DataFrame: Table with the ``project``, ``year``, ``version`` and ``downloads``
+            columns, with one row per combination of values. The projects and versions
+            are strings.
+    """
+    if DOWNLOADS_COLUMN in downloads:
+        weights = downloads[DOWNLOADS_COLUMN]
+    else:
+        weights = pd.Series(1, index=downloads.index)
+
+    keys = [
+        downloads['project'],
+        downloads['timestamp'].dt.year.rename('year'),
+        downloads['version'],
+    ]
+    counts = weights.groupby(keys, observed=True, dropna=False).sum()
+    counts = counts.rename(DOWNLOADS_COLUMN).reset_index()
+    counts['project'] = counts['project'].astype(object).astype(str)
+    counts['version'] = (
+        counts['version']
+        .astype(object)
+        .map(lambda version: None if pd.isna(version) else str(version))
+    )
+    return counts
+
+
+def _index_counts(counts):
+    """Build the count index of a table of counts, as returned by ``_count_downloads``."""
+    ranks, versions = encode_versions(counts['version'])
+    keys = [
+        counts['project'],
+        counts['year'].astype(int),
+        pd.Series(ranks, index=counts.index, name='version'),
+    ]
+    counts = counts[DOWNLOADS_COLUMN].groupby(keys).sum().reset_index()
+    is_prerelease = get_version_flags(counts['version'].to_numpy(), versions, 'is_prerelease')
+    counts.insert(3, 'is_prerelease', is_prerelease)
+    return CountIndex(counts, versions)
+
+
+def _get_count_index(downloads):
+    """Count the downloads by project, year, version and pre-release flag.
+
+    Every count that the summary needs is a sum over a few rows of the resulting table,
+    which has one row per combination of values, so the full downloads table is only
+    traversed once. Rows are weighted by their ``downloads`` count, if any. Versions
+    are encoded as integer ranks, so they are only parsed once per distinct value.
+
+    Args:
+        downloads (pd.DataFrame): PyPI Download data. It must contain the project, version,
+            and timestamp column.
+
+    Returns:
+        CountIndex: The ``counts`` table, with the ``project``, ``year``, ``version`` rank,
+            ``is_prerelease`` and ``downloads`` columns, and the sorted distinct
+            ``versions`` indexed by the ranks.
+    """
+    return _index_counts(_count_downloads(downloads))
+
+
 def _calculate_projects_count(
-    downloads,
+    count_index,
     projects,
     max_datetime=None,
     min_datetime=None,
@@ -42,18 +142,19 @@ def _calculate_projects_count(
     """Get number of PyPI downloads for specified project(s).
 
     Args:
-        downloads (pd.DataFrame): PyPI Download data. It must contain the project, version,
-            and timestamp column. The version column must be packaging Version objects.
+        count_index (CountIndex): Counts of the PyPI downloads, as returned by
+            ``_get_count_index``.
         projects (str, tuple(str), list[str]): The project name or list of project names to filter
             the download for.
         max_datetime (datetime): The maximum datetime to include downloads for (inclusive).
-            Downloads after this datetime will be excluded.
+            Downloads after the year of this datetime will be excluded.
         min_datetime (datetime): The minimum datetime to include downloads for (inclusive).
-            Downloads before this datetime will be excluded.
+            Downloads before the year of this datetime will be excluded.
         version (str): The version string to compare against when filtering by version.
             Must be used in conjunction with version_operator.
         version_operator (str): The comparison operator to use with version filtering.
             Supported operators: '<=', '>', '>=', '<'. Must be used in conjunction with version.
+            Missing and invalid versions never match.
         exclude_prereleases (bool): If True, excludes pre-release versions from the count.
             Defaults to False, which means to include downloads for pre-releases.
 
@@ -64,29 +165,24 @@ def _calculate_projects_count(
     if isinstance(projects, str):
         projects = (projects,)
 
-    project_downloads = downloads[downloads['project'].isin(set(projects))]
-    if version and version_operator and version_operator == '<=':
-        project_downloads = project_downloads[project_downloads['version'] <= Version(version)]
-    if version and version_operator and version_operator == '>':
-        project_downloads = project_downloads[project_downloads['version'] > Version(version)]
-    if version and version_operator and version_operator == '>=':
-        project_downloads = project_downloads[project_downloads['version'] >= Version(version)]
-    if version and version_operator and version_operator == '<':
-        project_downloads = project_downloads[project_downloads['version'] < Version(version)]
+    counts = count_index.counts
+    counts = counts[counts['project'].isin(set(projects))]
+    if version and version_operator:
+        ranks = counts['version'].to_numpy()
+        counts = counts[compare_versions(ranks, count_index.versions, version_operator, version)]
 
     if max_datetime:
-        project_downloads = project_downloads[project_downloads['timestamp'] <= max_datetime]
+        counts = counts[counts['year'] <= max_datetime.year]
     if min_datetime:
-        project_downloads = project_downloads[project_downloads['timestamp'] >= min_datetime]
+        counts = counts[counts['year'] >= min_datetime.year]
 
     if exclude_prereleases is True:
         LOGGER.info(f'Excluding pre-release downloads for {projects}')
-        project_downloads = project_downloads[
-            ~project_downloads['version'].apply(lambda v: v.is_prerelease)
-        ]
+        counts = counts[~counts['is_prerelease']]
     else:
         LOGGER.info(f'Including pre-release downloads for {projects}')
-    return len(project_downloads)
+
+    return int(counts[DOWNLOADS_COLUMN].sum())
 
 
 def _create_counts_list(
@@ -105,55 +201,109 @@ def _sum_counts(base_count, dep_to_count, parent_to_count):
     return base_count + sum(parent_to_count.values()) + sum(dep_to_count.values())
 
 
-def get_previous_pypi_downloads(output_folder, dry_run=False):
+def get_previous_pypi_downloads(
+    output_folder, storage='csv', columns=None, projects=None, start_date=None, end_date=None
+):
     """Read pypi.csv and return a DataFrame of the downloads.
 
+    The columns and the filters are pushed down to the reader, so only the requested
+    data is loaded.
+
     Args:
         output_folder (str): If input_file is None, this directory location must contain
             pypi.csv file to use.
 
-        dry_run (bool): If True, will reduce the number of rows read. Defaults to False,
-            which will read all rows.
+        storage (str): Format in which the downloads are stored, either ``csv`` for pypi.csv
+            or ``parquet`` for the partitioned history. Defaults to ``csv``.
+
+        columns (list[str] or None): Columns to load. Columns that have not been stored
+            are skipped. If `None`, load all of them.
+
+        projects (list[str] or None): Projects to load. If `None`, load all of them.
+
+        start_date (datetime or None): Load only downloads that happened on or after this date.
+
+        end_date (datetime or None): Load only downloads that happened before this date.
 
     Returns:
         pd.DataFrame: The DataFrame containing the PyPI download data.
 
     """
+    if storage == 'parquet':
+        return load_pypi_history(output_folder, projects, start_date, end_date, columns)
+
+    filters = []
+    if projects is not None:
+        filters.append(('project', 'in', list(projects)))
+    if start_date is not None:
+        filters.append(('timestamp', '>=', start_date))
+    if end_date is not None:
+        filters.append(('timestamp', '<', end_date))
+
     csv_path = get_path(output_folder, 'pypi.csv')
     read_csv_kwargs = {
         'parse_dates': ['timestamp'],
-        'dtype': {
-            'country_code': pd.CategoricalDtype(),
-            'project': pd.CategoricalDtype(),
-            'version': pd.CategoricalDtype(),
-            'type': pd.CategoricalDtype(),
-            'installer_name': pd.CategoricalDtype(),
-            'implementation_name': pd.CategoricalDtype(),
-            'implementation_version': pd.CategoricalDtype(),
-            'distro_name': pd.CategoricalDtype(),
-            'distro_version': pd.CategoricalDtype(),
-            'system_name': pd.CategoricalDtype(),
-            'system_release': pd.CategoricalDtype(),
-            'cpu': pd.CategoricalDtype(),
-            'ci': pd.BooleanDtype(),
-        },
+        'dtype': PYPI_DTYPES,
+    }
+    return load_csv(csv_path, read_csv_kwargs=read_csv_kwargs, columns=columns, filters=filters)
+
+
+def _get_summarized_projects(projects):
+    """Get the names of all the projects that the summary counts the downloads of."""
+    names = set()
+    for project_info in projects:
+        if project_info.get('base_project'):
+            names.add(project_info['base_project'])
+
+        for key in ['dependency_projects', 'parent_projects', 'projects']:
+            names.update(project_info.get(key) or [])
+
+    return sorted(names)
+
+
+def _load_counts(output_folder, storage, projects, incremental=False, dry_run=False):
+    """Count the downloads of the given projects by year and version.
+
+    If ``incremental``, the counts of the closed years are loaded from the summary state
+    when it is still valid, and only the downloads of the current year are read.
+    Otherwise, or if the state is not valid, all the downloads are read and, unless
+    ``dry_run``, the counts of the closed years are stored for the next runs.
+    """
+    load_kwargs = {
+        'output_folder': output_folder,
+        'storage': storage,
+        'columns': SUMMARY_COLUMNS,
+        'projects': projects,
     }
-    if dry_run:
-        read_csv_kwargs['nrows'] = 10_000
-    data = load_csv(csv_path, read_csv_kwargs=read_csv_kwargs)
-    LOGGER.info('Parsing version column to Version class objects')
-    data['version'] = data['version'].apply(parse)
-    return data
+    if not incremental:
+        return _count_downloads(get_previous_pypi_downloads(**load_kwargs))
+
+    current_year = get_current_year()
+    closed_until = get_first_datetime_in_year(current_year)
+    manifest = load_pypi_manifest(output_folder)
+    closed_counts = load_summary_state(output_folder, projects, closed_until, manifest)
+    if closed_counts is not None:
+        LOGGER.info('Reusing the summary counts of the years before %s', current_year)
+        downloads = get_previous_pypi_downloads(start_date=closed_until, **load_kwargs)
+        return pd.concat([closed_counts, _count_downloads(downloads)], ignore_index=True)
+
+    counts = _count_downloads(get_previous_pypi_downloads(**load_kwargs))
+    closed_for = get_current_utc().replace(tzinfo=None) - closed_until
+    if not dry_run and closed_for >= CLOSED_YEAR_DELAY:
+        closed_counts = counts[counts['year'] < current_year]
+        save_summary_state(output_folder, projects, closed_counts, closed_until, manifest)
+
+    return counts
 
 
-def _ecosystem_count_by_year(downloads, base_project, dependency_projects, parent_projects):
+def _ecosystem_count_by_year(count_index, base_project, dependency_projects, parent_projects):
     row_info = {ECOSYSTEM_COLUMN_NAME: [base_project]}
     breakdown_info = {}
 
     for year in range(2021, get_current_year() + 1):
         min_datetime, max_datetime = get_min_max_dt_in_year(year)
         base_count, dep_to_count, parent_to_count = _calculate_adjusted_count(
-            downloads,
+            count_index,
             base_project=base_project,
             dependency_projects=dependency_projects,
             parent_projects=parent_projects,
@@ -177,7 +327,7 @@ def _ecosystem_count_by_year(downloads, base_project, dependency_projects, paren
 
 
 def _version_count_by_year(
-    downloads,
+    count_index,
     base_project,
     dependency_projects,
     parent_projects,
@@ -187,7 +337,7 @@ def _version_count_by_year(
 ):
     row_info = {BSL_COLUMN_NAME: [type_]}
     base_count, dep_to_count, parent_to_count = _calculate_adjusted_count(
-        downloads,
+        count_index,
         base_project=base_project,
         dependency_projects=dependency_projects,
         parent_projects=parent_projects,
@@ -203,7 +353,7 @@ def _version_count_by_year(
     for year in range(2021, get_current_year() + 1):
         min_datetime, max_datetime = get_min_max_dt_in_year(year)
         base_count, dep_to_count, parent_to_count = _calculate_adjusted_count(
-            downloads,
+            count_index,
             base_project=base_project,
             dependency_projects=dependency_projects,
             parent_projects=parent_projects,
@@ -226,6 +376,8 @@ def summarize_downloads(
     output_folder,
     dry_run=False,
     verbose=False,
+    storage='csv',
+    incremental=False,
 ):
     """Summarize download data from pypi.csv.
 
@@ -257,8 +409,23 @@ def summarize_downloads(
             It can be passed as a local folder or as a Google Drive path in the format
             `gdrive://{folder_id}`.
 
+        storage (str):
+            Format in which the downloads are stored, either ``csv`` or ``parquet``.
+            Defaults to ``csv``.
+
+        incremental (bool):
+            Reuse the counts of the closed years stored in the output folder by previous
+            runs, and only read the downloads of the current year. Requires the ``parquet``
+            storage, whose manifest tells when the closed years have been rewritten.
+            Defaults to ``False``.
+
     """
-    downloads = get_previous_pypi_downloads(output_folder=output_folder)
+    if incremental and storage != 'parquet':
+        raise ValueError('Incremental summaries require the parquet storage')
+
+    summarized_projects = _get_summarized_projects(projects + vendors)
+    counts = _load_counts(output_folder, storage, summarized_projects, incremental, dry_run)
+    count_index = _index_counts(counts)
 
     vendor_df = pd.DataFrame.from_records(vendors)
     all_df = _create_all_df()
@@ -278,13 +445,13 @@ def summarize_downloads(
         row_info = {ECOSYSTEM_COLUMN_NAME: [ecosystem_name]}
         if base_project:
             row_info, breakdown_info = _ecosystem_count_by_year(
-                downloads=downloads,
+                count_index=count_index,
                 base_project=base_project,
                 dependency_projects=dependency_projects,
                 parent_projects=parent_projects,
             )
             base_count, dep_to_count, parent_to_count = _calculate_adjusted_count(
-                downloads,
+                count_index,
                 base_project=base_project,
                 dependency_projects=dependency_projects,
                 parent_projects=parent_projects,
@@ -307,18 +474,18 @@ def summarize_downloads(
             for year in range(2021, get_current_year() + 1):
                 min_datetime, max_datetime = get_min_max_dt_in_year(year)
                 row_info[year] = _calculate_projects_count(
-                    downloads,
+                    count_index,
                     projects=projects,
                     min_datetime=min_datetime,
                     max_datetime=max_datetime,
                 )
 
-            row_info[TOTAL_COLUMN_NAME] = _calculate_projects_count(downloads, projects=projects)
+            row_info[TOTAL_COLUMN_NAME] = _calculate_projects_count(count_index, projects=projects)
             all_df = append_row(all_df, row_info)
 
         if ecosystem_name.lower() == 'sdv':
             version_row = _version_count_by_year(
-                downloads=downloads,
+                count_index=count_index,
                 base_project=base_project,
                 dependency_projects=dependency_projects,
                 parent_projects=parent_projects,
@@ -328,7 +495,7 @@ def summarize_downloads(
             )
             bsl_vs_pre_bsl_df = append_row(bsl_vs_pre_bsl_df, version_row)
             version_row = _version_count_by_year(
-                downloads=downloads,
+                count_index=count_index,
                 base_project=base_project,
                 dependency_projects=dependency_projects,
                 parent_projects=parent_projects,
@@ -379,7 +546,7 @@ def _create_bsl_vs_prebsl_df():
 
 
 def _calculate_adjusted_count(
-    downloads,
+    count_index,
     base_project,
     dependency_projects,
     parent_projects,
@@ -395,7 +562,7 @@ def _calculate_adjusted_count(
 
     for parent_project in parent_projects:
         project_count = _calculate_projects_count(
-            downloads,
+            count_index,
             projects=[parent_project],
             max_datetime=max_datetime,
             min_datetime=min_datetime,
@@ -405,7 +572,7 @@ def _calculate_adjusted_count(
         parent_to_count[parent_project] = project_count
 
     base_count = _calculate_projects_count(
-        downloads,
+        count_index,
         projects=[base_project],
         max_datetime=max_datetime,
         min_datetime=min_datetime,
@@ -417,7 +584,7 @@ def _calculate_adjusted_count(
         if dependency_project == base_project:
             raise ValueError('Base project cannot be in dependency project.')
         dep_count = _calculate_projects_count(
-            downloads,
+            count_index,
             projects=[dependency_project],
             max_datetime=max_datetime,
             min_datetime=min_datetime,
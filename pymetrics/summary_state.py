@@ -0,0 +1,111 @@
+"""Functions to store the download counts of the closed years of the summary.
+
+The counts of every summarized project are stored, by year and version, in the
+``summary_state.parquet`` file inside the output folder, and the ``summary_state.csv``
+index records, for each project, the first year that is not in the state yet and the
+newest segment of the history that had been written when the state was stored. The
+versions are stored as strings, so the state does not depend on the summarize config
+or on the ``pre_bsl_versions``, which are applied again to the counts on every run.
+"""
+
+import logging
+
+import pandas as pd
+
+from pymetrics.metrics_state import is_stale
+from pymetrics.output import create_csv, create_parquet, get_path, load_csv, load_parquet
+
+LOGGER = logging.getLogger(__name__)
+
+STATE_FILENAME = 'summary_state.parquet'
+INDEX_FILENAME = 'summary_state.csv'
+INDEX_COLUMNS = ['project', 'closed_until', 'segment']
+
+
+def load_summary_index(output_folder):
+    """Load the index of the summary state stored in the output folder.
+
+    Returns:
+        pandas.DataFrame:
+            Table with the ``project``, ``closed_until`` and ``segment`` of every project
+            in the state. Empty if there is no index.
+    """
+    read_csv_kwargs = {
+        'parse_dates': ['closed_until'],
+        'dtype': {'project': str, 'segment': str},
+        'keep_default_na': False,
+    }
+    index = load_csv(get_path(output_folder, INDEX_FILENAME), read_csv_kwargs)
+    if index is None:
+        index = pd.DataFrame(columns=INDEX_COLUMNS)
+        index['closed_until'] = pd.to_datetime(index['closed_until'])
+
+    return index
+
+
+def load_summary_state(output_folder, projects, closed_until, manifest):
+    """Load the counts of the closed years of the given projects, if they are all valid.
+
+    Args:
+        output_folder (str):
+            Folder in which the state is stored.
+        projects (list[str]):
+            Projects that the state must cover.
+        closed_until (datetime):
+            First day of the year that is still open.
+        manifest (pandas.DataFrame):
+            Manifest of the history. Empty if the downloads are stored as a CSV.
+
+    Returns:
+        pandas.DataFrame or None:
+            The ``project``, ``year``, ``version`` and ``downloads`` counts of the
+            projects, or `None` if any of them is not in the state, has been stored
+            for a different year or has had its closed years rewritten since.
+    """
+    index = load_summary_index(output_folder).set_index('project')
+    for project in projects:
+        if project not in index.index:
+            LOGGER.info('The summary state does not cover %s', project)
+            return None
+
+        entry = index.loc[project]
+        if entry['closed_until'] != pd.Timestamp(closed_until):
+            LOGGER.info('The summary state of %s has been stored for another year', project)
+            return None
+
+        if is_stale(manifest, project, entry['closed_until'], entry['segment']):
+            LOGGER.info('Discarding the summary state of %s: the history has changed', project)
+            return None
+
+    filters = [('project', 'in', list(projects))]
+    state = load_parquet(get_path(output_folder, STATE_FILENAME), filters=filters)
+    if state is None:
+        return None
+
+    return state.to_pandas()
+
+
+def save_summary_state(output_folder, projects, counts, closed_until, manifest):
+    """Store the counts of the closed years of the given projects.
+
+    Args:
+        output_folder (str):
+            Folder in which the state is stored.
+        projects (list[str]):
+            Projects covered by the counts, including the ones without downloads.
+        counts (pandas.DataFrame):
+            The ``project``, ``year``, ``version`` and ``downloads`` counts of the
+            closed years.
+        closed_until (datetime):
+            First day of the year that is still open.
+        manifest (pandas.DataFrame):
+            Manifest of the history that the counts have been computed from.
+    """
+    segments = manifest.dropna(subset=['segment']).groupby('project')['segment'].max()
+    index = pd.DataFrame({
+        'project': projects,
+        'closed_until': pd.Timestamp(closed_until),
+        'segment': [segments.get(project, '') for project in projects],
+    })
+    create_parquet(get_path(output_folder, STATE_FILENAME), counts)
+    create_csv(get_path(output_folder, INDEX_FILENAME), index)
@@ -0,0 +1,92 @@
+"""Functions to encode versions as integers that sort like the versions themselves."""
+
+import bisect
+
+import numpy as np
+import pandas as pd
+from packaging.version import InvalidVersion, Version
+
+
+def parse_version(value):
+    """Parse a version, or return `None` if it is missing or invalid."""
+    if isinstance(value, Version):
+        return value
+
+    if pd.isna(value):
+        return None
+
+    try:
+        return Version(str(value))
+    except InvalidVersion:
+        return None
+
+
+def encode_versions(values):
+    """Encode a column of versions as integer ranks that sort like the versions.
+
+    Every distinct value is parsed only once. Equal versions written differently, like
+    ``1.0`` and ``1.0.0``, get the same rank, and missing or invalid versions get ``-1``.
+
+    Args:
+        values (pandas.Series):
+            Versions, as strings or ``packaging`` Version objects.
+
+    Returns:
+        tuple[numpy.ndarray, list[packaging.version.Version]]:
+            The rank of every value and the sorted distinct versions, which are indexed
+            by the ranks.
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype('category')
+
+    parsed = [parse_version(value) for value in values.cat.categories]
+    versions = sorted({version for version in parsed if version is not None})
+    ranks = {version: rank for rank, version in enumerate(versions)}
+    category_ranks = [-1 if version is None else ranks[version] for version in parsed]
+    # The missing values have code -1, which picks the last rank.
+    category_ranks = np.array(category_ranks + [-1], dtype=np.int64)
+    return category_ranks[values.cat.codes.to_numpy()], versions
+
+
+def get_version_flags(ranks, versions, attribute):
+    """Get a boolean flag, like ``is_prerelease``, of every encoded version.
+
+    Missing and invalid versions are flagged as `False`.
+    """
+    flags = [getattr(version, attribute) for version in versions]
+    return np.array(flags + [False], dtype=bool)[ranks]
+
+
+def compare_versions(ranks, versions, version_operator, version):
+    """Compare encoded versions with a version using only integer comparisons.
+
+    Args:
+        ranks (numpy.ndarray):
+            Ranks of the versions, as returned by ``encode_versions``.
+        versions (list[packaging.version.Version]):
+            Sorted distinct versions indexed by the ranks.
+        version_operator (str):
+            One of ``<=``, ``<``, ``>=`` or ``>``.
+        version (str):
+            Version to compare with.
+
+    Returns:
+        numpy.ndarray:
+            Boolean mask of the ranks that satisfy the comparison. Missing and invalid
+            versions never do.
+    """
+    version = Version(version)
+    lower = bisect.bisect_left(versions, version)
+    upper = bisect.bisect_right(versions, version)
+    if version_operator == '<=':
+        mask = ranks < upper
+    elif version_operator == '<':
+        mask = ranks < lower
+    elif version_operator == '>=':
+        mask = ranks >= lower
+    elif version_operator == '>':
+        mask = ranks >= upper
+    else:
+        raise ValueError(f'Unknown version operator {version_operator}')
+
+    return mask & (ranks >= 0)
@@ -0,0 +1,156 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fsspec.implementations.dirfs import DirFileSystem
+from fsspec.implementations.local import LocalFileSystem
+
+from pymetrics.anaconda import (
+    _anaconda_package_data_by_days,
+    _get_complete_months,
+    _get_previous_anaconda_downloads,
+    _read_anaconda_parquet,
+    _upsert_downloads,
+)
+from pymetrics.cache import LocalCache
+
+
+def test__read_anaconda_parquet_pushdown(tmp_path):
+    # Setup
+    path = str(tmp_path / '2025-01-01.parquet')
+    table = pa.table({
+        'time': ['2025-01-01', '2025-01-01', '2025-01-01', '2025-01-01'],
+        'pkg_name': ['numpy', 'numpy', 'sdv', 'rdt'],
+        'pkg_version': ['2.0.0', '2.1.0', '1.0.0', '1.0.0'],
+        'counts': [100, 200, 3, 4],
+    })
+    pq.write_table(table, path, row_group_size=2)
+
+    # Run
+    downloads = _read_anaconda_parquet(path, pkg_names=['sdv', 'rdt'], columns=['time', 'pkg_name'])
+    missing = _read_anaconda_parquet(str(tmp_path / 'missing.parquet'))
+
+    # Assert
+    assert list(downloads.columns) == ['time', 'pkg_name']
+    assert downloads['pkg_name'].tolist() == ['sdv', 'rdt']
+    assert downloads['time'].tolist() == [pd.Timestamp('2025-01-01')] * 2
+    assert missing.empty
+
+
+def test__read_anaconda_parquet_missing_columns(tmp_path):
+    # Setup
+    path = str(tmp_path / '2025-01-01.parquet')
+    pq.write_table(pa.table({'time': ['2025-01-01'], 'pkg_name': ['sdv'], 'counts': [1]}), path)
+    pd.DataFrame({
+        'time': ['2024-12-31'],
+        'pkg_name': ['sdv'],
+        'counts': [2],
+        'extra': ['x'],
+    }).to_csv(tmp_path / 'anaconda.csv', index=False)
+    previous = _get_previous_anaconda_downloads(str(tmp_path), 'anaconda.csv')
+
+    # Run
+    downloads = _read_anaconda_parquet(path, pkg_names=['sdv'], columns=list(previous.columns))
+
+    # Assert
+    assert list(downloads.columns) == ['time', 'pkg_name', 'counts']
+    assert downloads['counts'].tolist() == [1]
+
+
+def test__read_anaconda_parquet_cache(tmp_path):
+    # Setup
+    path = str(tmp_path / '2025-01-01.parquet')
+    cache = LocalCache(str(tmp_path / 'cache'))
+    table = pa.table({'time': ['2025-01-01', '2025-01-01'], 'pkg_name': ['sdv', 'numpy']})
+    pq.write_table(table, path)
+    os.utime(path, (1, 1))
+
+    # Run
+    first = _read_anaconda_parquet(path, pkg_names=['sdv'], cache=cache)
+    os.rename(path, path + '.moved')
+    pq.write_table(table.slice(1), path + '.other')
+    os.rename(path + '.other', path)
+    os.utime(path, (1, 1))
+    cached = _read_anaconda_parquet(path, pkg_names=['sdv'], cache=cache)
+    os.utime(path, (2, 2))
+    changed = _read_anaconda_parquet(path, pkg_names=['sdv'], cache=cache)
+
+    # Assert
+    assert first['pkg_name'].tolist() == ['sdv']
+    assert cached.equals(first)
+    assert changed.empty
+
+
+def test__get_complete_months():
+    # Setup
+    previous = pd.DataFrame({
+        'time': pd.to_datetime(['2025-01-01', '2025-01-31', '2025-02-01', '2025-03-01']),
+        'pkg_name': ['sdv', 'sdv', 'sdv', 'numpy'],
+        'counts': [1, 2, 3, 100],
+    })
+    monthly_downloads = [
+        (pd.Timestamp('2025-01-01'), pd.DataFrame({'pkg_name': ['sdv'], 'counts': [3]})),
+        (pd.Timestamp('2025-02-01'), pd.DataFrame({'pkg_name': ['sdv'], 'counts': [4]})),
+        (pd.Timestamp('2025-03-01'), pd.DataFrame({'pkg_name': ['sdv'], 'counts': [0]})),
+        (pd.Timestamp('2025-04-01'), pd.DataFrame()),
+    ]
+
+    # Run
+    complete = _get_complete_months(previous, monthly_downloads, pkg_names=['sdv'])
+
+    # Assert
+    assert complete == {pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-01')}
+
+
+def test__upsert_downloads():
+    # Setup
+    previous = pd.DataFrame({
+        'time': pd.to_datetime(['2025-01-01', '2025-01-02', '2025-01-02', '2025-01-02']),
+        'pkg_name': ['sdv', 'sdv', 'rdt', 'rdt'],
+        'counts': [1, 2, 3, 4],
+    })
+    new_downloads = pd.DataFrame({
+        'time': pd.to_datetime(['2025-01-02 10:00', '2025-01-03 00:00']),
+        'pkg_name': ['rdt', 'sdv'],
+        'counts': [10, 20],
+    })
+
+    # Run
+    downloads = _upsert_downloads(previous, new_downloads)
+
+    # Assert
+    assert downloads['pkg_name'].tolist() == ['sdv', 'sdv', 'rdt', 'sdv']
+    assert downloads['counts'].tolist() == [1, 2, 10, 20]
+
+
+def test__anaconda_package_data_by_days(tmp_path):
+    # Setup
+    dates = pd.date_range('2025-01-30', '2025-02-03')
+    for counts, date in enumerate(dates):
+        if date == pd.Timestamp('2025-02-01'):
+            continue
+
+        folder = tmp_path / 'anaconda-package-data' / 'conda' / 'hourly' / date.strftime('%Y/%m')
+        folder.mkdir(parents=True, exist_ok=True)
+        table = pa.table({
+            'time': [date.strftime('%Y-%m-%d')] * 2,
+            'pkg_name': ['sdv', 'numpy'],
+            'counts': [counts, 100],
+        })
+        pq.write_table(table, folder / f'{date:%Y-%m-%d}.parquet')
+
+    filesystem = DirFileSystem(str(tmp_path), fs=LocalFileSystem())
+
+    # Run
+    downloads = _anaconda_package_data_by_days(
+        dates, pkg_names=['sdv'], jobs=3, filesystem=filesystem
+    )
+
+    # Assert
+    assert [date for date, _ in downloads] == list(dates)
+    assert downloads[2][1].empty
+    for counts, (date, frame) in enumerate(downloads):
+        if date != pd.Timestamp('2025-02-01'):
+            assert frame['time'].tolist() == [date]
+            assert frame['counts'].tolist() == [counts]
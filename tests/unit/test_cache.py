@@ -0,0 +1,80 @@
+import time
+
+import pyarrow as pa
+
+from pymetrics.cache import LocalCache, get_cache_key
+
+
+def test_get_cache_key():
+    # Run
+    key = get_cache_key('SELECT 1', '2025-01-01')
+
+    # Assert
+    assert key == get_cache_key('SELECT 1', '2025-01-01')
+    assert key != get_cache_key('SELECT 1', '2025-01-02')
+
+
+def test_local_cache_put_get(tmp_path):
+    # Setup
+    cache = LocalCache(str(tmp_path))
+    table = pa.table({'project': ['sdv', 'rdt'], 'downloads': [1, 2]})
+
+    # Run
+    cache.put('key', table)
+
+    # Assert
+    assert cache.get('key').equals(table)
+    assert cache.get('missing') is None
+    assert LocalCache(str(tmp_path)).get('key').equals(table)
+
+
+def test_local_cache_evicts_least_recently_used(tmp_path):
+    # Setup
+    table = pa.table({'value': list(range(1000))})
+    cache = LocalCache(str(tmp_path))
+    cache.put('first', table)
+    size = (tmp_path / 'first').stat().st_size
+    cache.max_bytes = size * 2
+    cache.put('second', table)
+    cache.get('first')
+
+    # Run
+    cache.put('third', table)
+
+    # Assert
+    assert cache.get('second') is None
+    assert cache.get('first') is not None
+    assert cache.get('third') is not None
+
+
+def test_local_cache_ttl_and_validator(tmp_path):
+    # Setup
+    table = pa.table({'value': [1]})
+    cache = LocalCache(str(tmp_path), ttl=0.01)
+    cache.put('expired', table)
+    cache.put('validated', table, validator='etag-1')
+    time.sleep(0.02)
+
+    # Run and Assert
+    assert cache.get('expired') is None
+    cache.ttl = None
+    assert cache.get('validated', validator='etag-2') is None
+    assert not (tmp_path / 'validated').exists()
+
+
+def test_local_cache_writer_abort(tmp_path):
+    # Setup
+    cache = LocalCache(str(tmp_path))
+    batch = pa.record_batch({'value': [1, 2]})
+
+    # Run
+    try:
+        with cache.writer('key', batch.schema) as writer:
+            writer.write_batch(batch)
+            raise RuntimeError('Interrupted')
+    except RuntimeError:
+        pass
+
+    # Assert
+    assert cache.get('key') is None
+    assert [path.name for path in tmp_path.iterdir()] == []
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from pymetrics.fingerprints import FingerprintManifest
+from pymetrics.output import create_csv
+
+
+def test_fingerprint_manifest_skips_unchanged_files(tmp_path):
+    # Setup
+    output_folder = str(tmp_path)
+    data = pd.DataFrame({'pkg_name': ['sdv'], 'counts': [10]})
+    fingerprints = FingerprintManifest(output_folder)
+    create_csv(str(tmp_path / 'anaconda.csv'), data, fingerprints=fingerprints)
+    fingerprints.save()
+    (tmp_path / 'anaconda.csv').write_text('edited')
+
+    # Run
+    fingerprints = FingerprintManifest(output_folder)
+    create_csv(str(tmp_path / 'anaconda.csv'), data, fingerprints=fingerprints)
+    unchanged = (tmp_path / 'anaconda.csv').read_text()
+    create_csv(str(tmp_path / 'anaconda.csv'), data.assign(counts=11), fingerprints=fingerprints)
+
+    # Assert
+    assert unchanged == 'edited'
+    assert (tmp_path / 'anaconda.csv').read_text() == 'pkg_name,counts\nsdv,11\n'
+    assert not FingerprintManifest(output_folder).is_unchanged('anaconda.csv', b'pkg_name')
@@ -0,0 +1,44 @@
+import pandas as pd
+
+from pymetrics.gaps import get_day_coverage, get_missing_ranges
+
+
+def test_get_day_coverage():
+    # Setup
+    downloads = pd.DataFrame({
+        'project': ['sdv', 'sdv', 'rdt'],
+        'timestamp': pd.to_datetime(['2025-01-01 10:00', '2025-01-04 00:00', '2025-01-02 00:00']),
+    })
+    windows = pd.DataFrame({
+        'project': ['sdv'],
+        'start_date': pd.to_datetime(['2025-01-02']),
+        'end_date': pd.to_datetime(['2025-01-03']),
+    })
+
+    # Run
+    coverage = get_day_coverage(downloads, ['sdv', 'rdt'], windows)
+
+    # Assert
+    assert coverage.columns.tolist() == list(pd.date_range('2025-01-01', '2025-01-04'))
+    assert coverage.loc['sdv'].tolist() == [True, True, False, True]
+    assert coverage.loc['rdt'].tolist() == [False, True, False, False]
+
+
+def test_get_missing_ranges():
+    # Setup
+    coverage = pd.DataFrame(
+        [[True, False, True, False, False, True], [False, True, True, False, False, False]],
+        index=['sdv', 'rdt'],
+        columns=pd.date_range('2025-01-01', periods=6),
+    )
+
+    # Run
+    missing = get_missing_ranges(coverage)
+
+    # Assert
+    assert missing == {
+        'sdv': [
+            (pd.Timestamp('2025-01-02'), pd.Timestamp('2025-01-03')),
+            (pd.Timestamp('2025-01-04'), pd.Timestamp('2025-01-06')),
+        ]
+    }
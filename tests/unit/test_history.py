@@ -0,0 +1,188 @@
+import pandas as pd
+
+from pymetrics.history import (
+    SegmentWriter,
+    compact_pypi_history,
+    get_pypi_history_range,
+    list_pypi_partitions,
+    load_pypi_history,
+    load_pypi_manifest,
+    write_pypi_history,
+)
+
+
+def _get_downloads(project, timestamps):
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(timestamps),
+        'project': project,
+        'version': '1.0.0',
+        'country_code': 'US',
+        'ci': [False] * len(timestamps),
+    })
+
+
+def test_write_pypi_history(tmp_path):
+    # Setup
+    downloads = pd.concat([
+        _get_downloads('sdv', ['2024-12-30', '2025-01-02']),
+        _get_downloads('rdt', ['2025-01-03']),
+    ])
+
+    # Run
+    write_pypi_history(str(tmp_path), downloads)
+
+    # Assert
+    partitions = list_pypi_partitions(str(tmp_path))
+    assert partitions['project'].tolist() == ['rdt', 'sdv', 'sdv']
+    assert partitions['year_month'].tolist() == ['2025-01', '2024-12', '2025-01']
+    assert partitions['segment'].nunique() == 1
+    loaded = load_pypi_history(str(tmp_path))
+    assert len(loaded) == 3
+    assert isinstance(loaded['project'].dtype, pd.CategoricalDtype)
+
+
+def test_write_pypi_history_replaces_window(tmp_path):
+    # Setup
+    previous = _get_downloads('sdv', ['2025-01-01', '2025-01-02', '2025-01-03'])
+    write_pypi_history(str(tmp_path), previous)
+    new_downloads = _get_downloads('sdv', ['2025-01-02 10:00', '2025-01-02 11:00'])
+
+    # Run
+    write_pypi_history(str(tmp_path), new_downloads, '2025-01-02', '2025-01-03')
+
+    # Assert
+    loaded = load_pypi_history(str(tmp_path))
+    assert loaded['timestamp'].tolist() == [
+        pd.Timestamp('2025-01-01'),
+        pd.Timestamp('2025-01-02 10:00'),
+        pd.Timestamp('2025-01-02 11:00'),
+        pd.Timestamp('2025-01-03'),
+    ]
+
+
+def test_write_pypi_history_incremental(tmp_path):
+    # Setup
+    previous = _get_downloads('sdv', ['2025-01-01', '2025-01-02', '2025-01-03'])
+    write_pypi_history(str(tmp_path), previous)
+    new_downloads = _get_downloads('sdv', ['2025-01-02 10:00'])
+
+    # Run
+    write_pypi_history(
+        str(tmp_path),
+        new_downloads,
+        '2025-01-02',
+        '2025-01-03',
+        projects=['sdv', 'rdt'],
+        incremental=True,
+    )
+
+    # Assert
+    assert len(list_pypi_partitions(str(tmp_path))) == 2
+    manifest = load_pypi_manifest(str(tmp_path))
+    assert manifest['project'].tolist() == ['sdv', 'rdt']
+    assert manifest['rows'].tolist() == [1, 0]
+    expected = [
+        pd.Timestamp('2025-01-01'),
+        pd.Timestamp('2025-01-02 10:00'),
+        pd.Timestamp('2025-01-03'),
+    ]
+    assert load_pypi_history(str(tmp_path))['timestamp'].tolist() == expected
+
+
+def test_segment_writer(tmp_path):
+    # Setup
+    batches = [
+        _get_downloads('sdv', ['2025-01-01', '2025-01-02']),
+        _get_downloads('sdv', ['2025-01-03']),
+        _get_downloads('rdt', ['2025-01-03']),
+    ]
+
+    # Run
+    with SegmentWriter(str(tmp_path), '2025-01-01', '2025-01-04') as writer:
+        for batch in batches:
+            writer.write(batch)
+
+    # Assert
+    partitions = list_pypi_partitions(str(tmp_path))
+    assert partitions['project'].tolist() == ['rdt', 'sdv']
+    manifest = load_pypi_manifest(str(tmp_path))
+    assert dict(zip(manifest['project'], manifest['rows'])) == {'sdv': 3, 'rdt': 1}
+    loaded = load_pypi_history(str(tmp_path), projects=['sdv'])
+    assert len(loaded) == 3
+    assert isinstance(loaded['version'].dtype, pd.CategoricalDtype)
+
+
+def test_segment_writer_abort(tmp_path):
+    # Run
+    try:
+        with SegmentWriter(str(tmp_path), '2025-01-01', '2025-01-04') as writer:
+            writer.write(_get_downloads('sdv', ['2025-01-01']))
+            raise RuntimeError('Interrupted')
+    except RuntimeError:
+        pass
+
+    # Assert
+    assert list_pypi_partitions(str(tmp_path)).empty
+    assert load_pypi_manifest(str(tmp_path)).empty
+
+
+def test_compact_pypi_history(tmp_path):
+    # Setup
+    previous = _get_downloads('sdv', ['2025-01-01', '2025-01-02', '2025-02-03'])
+    write_pypi_history(str(tmp_path), previous)
+    new_downloads = _get_downloads('sdv', ['2025-01-02 10:00', '2025-02-03 10:00'])
+    write_pypi_history(str(tmp_path), new_downloads, '2025-01-02', '2025-02-04', incremental=True)
+
+    # Run
+    compact_pypi_history(str(tmp_path), before='2025-02-01')
+
+    # Assert
+    partitions = list_pypi_partitions(str(tmp_path))
+    assert partitions['year_month'].tolist() == ['2025-01', '2025-02', '2025-02']
+    expected = [
+        pd.Timestamp('2025-01-01'),
+        pd.Timestamp('2025-01-02 10:00'),
+        pd.Timestamp('2025-02-03 10:00'),
+    ]
+    assert load_pypi_history(str(tmp_path))['timestamp'].tolist() == expected
+
+
+def test_load_pypi_history_filters(tmp_path):
+    # Setup
+    downloads = pd.concat([
+        _get_downloads('sdv', ['2024-12-30', '2025-01-02', '2025-02-01']),
+        _get_downloads('rdt', ['2025-01-03']),
+    ])
+    write_pypi_history(str(tmp_path), downloads)
+
+    # Run
+    loaded = load_pypi_history(
+        str(tmp_path), projects=['sdv'], start_date='2025-01-01', end_date='2025-02-01'
+    )
+
+    # Assert
+    assert loaded['timestamp'].tolist() == [pd.Timestamp('2025-01-02')]
+    assert get_pypi_history_range(str(tmp_path), ['sdv']) == (
+        pd.Timestamp('2024-12-30'),
+        pd.Timestamp('2025-02-01'),
+    )
+
+
+def test_load_pypi_history_empty_selection(tmp_path):
+    # Setup
+    write_pypi_history(str(tmp_path), _get_downloads('sdv', ['2025-01-02']))
+
+    # Run
+    loaded = load_pypi_history(str(tmp_path), projects=['sdv'], start_date='2025-02-01')
+    missing = load_pypi_history(str(tmp_path), projects=['rdt'])
+
+    # Assert
+    assert loaded.empty
+    assert loaded['timestamp'].dtype == 'datetime64[ns]'
+    assert missing['timestamp'].dtype == 'datetime64[ns]'
+
+
+def test_load_pypi_history_empty(tmp_path):
+    # Run and Assert
+    assert load_pypi_history(str(tmp_path)) is None
+    assert get_pypi_history_range(str(tmp_path), ['sdv']) == (None, None)
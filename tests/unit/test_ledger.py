@@ -0,0 +1,68 @@
+import pytest
+
+from pymetrics.ledger import CostLedger, get_query_shape
+
+
+def test_get_query_shape():
+    # Setup
+    query = "SELECT * FROM t WHERE timestamp >= '2025-03-01' AND timestamp < '2025-03-10'"
+    next_query = "SELECT * FROM t WHERE timestamp >= '2025-03-02' AND timestamp < '2025-03-11'"
+
+    # Run
+    shape = get_query_shape(query)
+
+    # Assert
+    assert shape == 'SELECT * FROM t WHERE timestamp >= <day 0> AND timestamp < <day 9>'
+    assert get_query_shape(next_query) == shape
+
+
+def test_cost_ledger_estimate(tmp_path):
+    # Setup
+    ledger = CostLedger(str(tmp_path / 'ledger.db'))
+    ledger.record('shape', 100)
+    ledger.record('shape', 200, 150, latency=1.5, rows=10)
+
+    # Run
+    estimate = ledger.get_estimate('shape')
+
+    # Assert
+    assert estimate == 200
+    assert ledger.get_estimate('other') is None
+    assert ledger.get_estimate('shape', max_age=-1) is None
+
+
+def test_cost_ledger_remaining_budget(tmp_path):
+    # Setup
+    path = str(tmp_path / 'ledger.db')
+    CostLedger(path).record('shape', 500, 400)
+    ledger = CostLedger(path, run_budget=300, monthly_budget=1000)
+
+    # Run
+    ledger.record('shape', 100, 200)
+
+    # Assert
+    assert ledger.get_monthly_bytes_billed() == 600
+    assert ledger.get_remaining_budget() == 100
+    assert CostLedger(path).get_remaining_budget() is None
+
+
+def test_cost_ledger_concurrent_reservations(tmp_path):
+    # Setup
+    ledger = CostLedger(str(tmp_path / 'ledger.db'), run_budget=300)
+
+    # Run
+    first = ledger.reserve(200)
+    with pytest.raises(ValueError, match='exceeds the remaining budget'):
+        ledger.reserve(200)
+
+    second = ledger.reserve(50, max_bytes=150)
+    remaining = ledger.get_remaining_budget()
+    ledger.record('shape', 120, 120, reservation=first)
+    after_record = ledger.get_remaining_budget()
+    ledger.release(second)
+
+    # Assert
+    assert (first, second) == (200, 100)
+    assert remaining == 0
+    assert after_record == 80
+    assert ledger.get_remaining_budget() == 180
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from pymetrics.main import _create_metrics, _load_previous_csv
+from pymetrics.time_utils import get_current_utc
+
+
+def test__create_metrics_parallel(tmp_path):
+    # Setup
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01', '2025-01-02', '2025-02-01']),
+        'project': ['sdv', 'sdv', 'rdt'],
+        'version': ['1.0.0', '1.1.0', '1.0.0'],
+    })
+    project_downloads = [(project, group, None) for project, group in downloads.groupby('project')]
+
+    # Run
+    _create_metrics(project_downloads, str(tmp_path), jobs=2)
+
+    # Assert
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['rdt.xlsx', 'sdv.xlsx']
+    sheets = pd.read_excel(tmp_path / 'sdv.xlsx', sheet_name=None)
+    assert sheets['By Version']['downloads'].tolist() == [1, 1]
+
+
+def test__load_previous_csv_dry_run(tmp_path):
+    # Setup
+    today = pd.Timestamp(get_current_utc().date())
+    downloads = pd.DataFrame({
+        'timestamp': [today - pd.Timedelta(days=days) for days in (40, 2, 1)],
+        'project': ['sdv', 'sdv', 'rdt'],
+        'version': ['1.0.0', '1.1.0', '1.0.0'],
+    })
+    downloads.to_csv(tmp_path / 'pypi.csv', index=False)
+
+    # Run
+    previous = _load_previous_csv(str(tmp_path), ['sdv'], max_days=30)
+    dry_run_previous = _load_previous_csv(str(tmp_path), ['sdv'], max_days=30, dry_run=True)
+
+    # Assert
+    assert len(previous) == 3
+    assert dry_run_previous['timestamp'].tolist() == [today - pd.Timedelta(days=2)]
+    assert dry_run_previous['project'].tolist() == ['sdv']
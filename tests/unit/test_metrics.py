@@ -1,7 +1,17 @@
 import numpy as np
 import pandas as pd
 
-from pymetrics.metrics import _sort_by_version
+from pymetrics.metrics import (
+    _build_cube,
+    _by_month,
+    _groupby,
+    _historical_groupby,
+    _join_distinct,
+    _mangle_columns,
+    _sort_by_version,
+    compute_metrics,
+    update_metrics_state,
+)
 
 
 def test__sort_by_version():
@@ -52,3 +62,126 @@ def test__sort_by_version_with_mixed_version_formats():
     expected_versions = ['1.0.post0', '1.0', '1.0rc3', '1.0b2', '1.0a1']
     assert sorted_df['version'].tolist() == expected_versions
     assert sorted_df['name'].tolist() == ['post', 'stable', 'rc', 'beta', 'alpha']
+
+
+def test__groupby_weighted_by_downloads():
+    # Setup
+    raw = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01'] * 4),
+        'country_code': ['US', 'US', 'US', 'ES'],
+    })
+    aggregated = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01'] * 2),
+        'country_code': ['US', 'ES'],
+        'downloads': [3, 1],
+    })
+
+    # Run
+    raw_grouped = _groupby(_build_cube(raw, ['country_code']), 'country_code')
+    aggregated_grouped = _groupby(_build_cube(aggregated, ['country_code']), 'country_code')
+
+    # Assert
+    pd.testing.assert_frame_equal(raw_grouped, aggregated_grouped)
+    assert aggregated_grouped['downloads'].tolist() == [1, 3]
+    assert aggregated_grouped['percent'].tolist() == [25.0, 75.0]
+
+
+def test__historical_groupby():
+    # Setup
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01', '2025-01-02', '2025-03-01', '2025-03-02']),
+        'version': ['1.0.0', None, '1.0.0', '1.1.0'],
+    })
+    cube = _build_cube(downloads, ['version'])
+
+    # Run
+    historical = _historical_groupby(cube, 'version')
+    by_month = _by_month(cube)
+
+    # Assert
+    assert historical.columns.tolist() == ['index', 'total', '1.0.0', '1.1.0']
+    assert historical.to_numpy().tolist() == [[2, 4, 2, 1], [1, 2, 1, 1], [0, 2, 1, 0]]
+    assert by_month['year-month'].tolist() == ['2025-03', '2025-01']
+    assert by_month['downloads'].tolist() == [2, 2]
+
+
+def test_compute_metrics_summary_profile():
+    # Setup
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01', '2025-01-02', '2025-02-01']),
+        'project': 'sdv',
+        'version': ['1.0.0', '1.1.0rc1', '1.0.0'],
+    })
+
+    # Run
+    sheets = compute_metrics(downloads)
+
+    # Assert
+    assert list(sheets) == [
+        'By Month',
+        'By Version',
+        'By Is Prerelease',
+        'By Is Postrelease',
+        'By Is Devrelease',
+        'Month and By Version',
+    ]
+    assert sheets['By Version']['downloads'].tolist() == [1, 2]
+
+
+def test__join_distinct():
+    # Setup
+    names = pd.Series(['Ubuntu', 'Debian', 'Ubuntu', None], dtype='category')
+    versions = pd.Series(['22.04', '12', '22.04', '11'])
+
+    # Run
+    joined = _join_distinct([names, versions], ' ')
+
+    # Assert
+    assert joined.tolist()[:3] == ['Ubuntu 22.04', 'Debian 12', 'Ubuntu 22.04']
+    assert pd.isna(joined.iloc[3])
+    assert isinstance(joined.dtype, pd.CategoricalDtype)
+
+
+def test__mangle_columns():
+    # Setup
+    downloads = pd.DataFrame({
+        'project': 'sdv',
+        'version': ['1.0.0', '1.1.0rc1', 'invalid'],
+        'implementation_version': ['3.10.12', '3.9.0', None],
+    })
+
+    # Run
+    mangled = _mangle_columns(downloads)
+
+    # Assert
+    assert mangled['project_version'].tolist() == ['sdv-1.0.0', 'sdv-1.1.0rc1', 'sdv-invalid']
+    assert mangled['python_version'].tolist()[:2] == ['3.10', '3.9']
+    assert mangled['full_python_version'].tolist()[:2] == ['3.10.12', '3.9.0']
+    assert mangled['is_prerelease'].tolist()[:2] == [False, True]
+    assert pd.isna(mangled['is_prerelease'].iloc[2])
+
+
+def test_update_metrics_state():
+    # Setup
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01', '2025-01-02', '2025-02-01', '2025-03-01']),
+        'project': 'sdv',
+        'version': ['1.0.0', '1.1.0rc1', '1.0.0', '1.1.0'],
+    })
+    expected = compute_metrics(downloads)
+
+    # Run
+    state, open_downloads = update_metrics_state(downloads.iloc[:3], before='2025-02-15')
+    state, open_downloads = update_metrics_state(
+        pd.concat([open_downloads, downloads.iloc[3:]]), state, before='2025-03-10'
+    )
+    sheets = compute_metrics(open_downloads, state=state)
+
+    # Assert
+    assert open_downloads['timestamp'].tolist() == [pd.Timestamp('2025-03-01')]
+    assert set(state['year_month'].dropna()) == {'2025-01', '2025-02'}
+    assert list(sheets) == list(expected)
+    for name, sheet in sheets.items():
+        pd.testing.assert_frame_equal(
+            sheet.reset_index(drop=True), expected[name].reset_index(drop=True)
+        )
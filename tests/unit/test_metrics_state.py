@@ -0,0 +1,37 @@
+import pandas as pd
+
+from pymetrics.history import load_pypi_manifest, write_pypi_history
+from pymetrics.metrics import update_metrics_state
+from pymetrics.metrics_state import load_metrics_index, load_metrics_state, save_metrics_state
+
+
+def test_load_metrics_state(tmp_path):
+    # Setup
+    output_folder = str(tmp_path)
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01', '2025-01-02', '2025-02-01']),
+        'project': 'sdv',
+        'version': ['1.0.0', '1.1.0', '1.0.0'],
+    })
+    write_pypi_history(output_folder, downloads, '2025-01-01', '2025-02-02')
+    state, _ = update_metrics_state(downloads, before='2025-02-01')
+    save_metrics_state(
+        output_folder,
+        'sdv',
+        state,
+        pd.Timestamp('2025-02-01'),
+        load_metrics_index(output_folder),
+        load_pypi_manifest(output_folder),
+    )
+
+    # Run
+    loaded, closed_until = load_metrics_state(output_folder, 'sdv')
+    write_pypi_history(output_folder, downloads.iloc[1:], '2025-01-02', '2025-02-02')
+    stale, stale_closed_until = load_metrics_state(output_folder, 'sdv')
+
+    # Assert
+    assert closed_until == pd.Timestamp('2025-02-01')
+    assert loaded['downloads'].tolist() == state['downloads'].tolist()
+    assert load_metrics_state(output_folder, 'rdt') == (None, None)
+    assert stale is None
+    assert stale_closed_until is None
@@ -0,0 +1,91 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from pymetrics.output import _get_column_width, load_csv, render_spreadsheet
+
+
+def test__get_column_width():
+    # Setup
+    categorical = pd.Series(['a', 'bbbb', np.nan], dtype='category')
+    numbers = pd.Series([1, 100_000])
+
+    # Run
+    categorical_width = _get_column_width(categorical, 'x', na_rep='<NaN>')
+    numbers_width = _get_column_width(numbers, 'downloads')
+    long_width = _get_column_width(pd.Series(['x' * 500]), 'name')
+
+    # Assert
+    assert categorical_width == 7
+    assert numbers_width == 11
+    assert long_width == 102
+
+
+def test_render_spreadsheet_constant_memory():
+    # Setup
+    sheets = {
+        'By Version': pd.DataFrame({
+            'version': ['1.0.0', np.nan],
+            'downloads': [10, 5],
+            'percent': [66.667, 33.333],
+        }),
+        'By Ci': pd.DataFrame({'ci': [True, False], 'downloads': np.array([3, 4])}),
+    }
+
+    # Run
+    contents = render_spreadsheet(sheets, na_rep='<NaN>', constant_memory=True)
+    expected = render_spreadsheet(sheets, na_rep='<NaN>')
+
+    # Assert
+    loaded = pd.read_excel(io.BytesIO(contents), sheet_name=None)
+    expected = pd.read_excel(io.BytesIO(expected), sheet_name=None)
+    assert list(loaded) == ['By Version', 'By Ci']
+    for name, sheet in loaded.items():
+        pd.testing.assert_frame_equal(sheet, expected[name])
+
+
+def test_render_spreadsheet_is_reproducible():
+    # Setup
+    sheets = {'By Month': pd.DataFrame({'year-month': ['2025-01'], 'downloads': [10]})}
+
+    # Run
+    first = render_spreadsheet(sheets)
+    second = render_spreadsheet(sheets, constant_memory=True)
+
+    # Assert
+    assert render_spreadsheet(sheets) == first
+    assert render_spreadsheet(sheets, constant_memory=True) == second
+
+
+def test_load_csv_columns_and_filters(tmp_path):
+    # Setup
+    csv_path = str(tmp_path / 'pypi.csv')
+    pd.DataFrame({
+        'timestamp': [
+            '2024-12-31 10:00:00',
+            '2025-01-01 00:00:00',
+            '2025-02-01 00:00:00',
+            '2025-03-01 00:00:00',
+        ],
+        'project': ['sdv', 'sdv', 'rdt', 'sdv'],
+        'version': ['1.0.0', '1.1.0', '1.0.0', '1.2.0'],
+        'country_code': ['US', 'ES', 'US', 'FR'],
+    }).to_csv(csv_path, index=False)
+    read_csv_kwargs = {'parse_dates': ['timestamp'], 'dtype': {'project': pd.CategoricalDtype()}}
+    filters = [
+        ('project', 'in', ['sdv']),
+        ('timestamp', '>=', pd.Timestamp('2025-01-01')),
+        ('timestamp', '<', pd.Timestamp('2025-03-01')),
+    ]
+
+    # Run
+    data = load_csv(csv_path, read_csv_kwargs, columns=['project', 'timestamp', 'x'])
+    filtered = load_csv(csv_path, read_csv_kwargs, columns=['project', 'version'], filters=filters)
+
+    # Assert
+    assert list(data.columns) == ['timestamp', 'project']
+    assert len(data) == 4
+    assert list(filtered.columns) == ['project', 'version']
+    assert filtered['version'].tolist() == ['1.1.0']
+    assert isinstance(filtered['project'].dtype, pd.CategoricalDtype)
@@ -0,0 +1,276 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from pymetrics.history import write_pypi_history
+from pymetrics.pypi import (
+    _cluster_gaps,
+    _get_gap_rounds,
+    _get_history_gaps,
+    _get_project_windows,
+    _get_shard_series,
+    _get_shards,
+    _get_windows_query,
+    _is_backfill,
+    _update_watermarks,
+    get_query_columns,
+)
+from pymetrics.time_utils import get_current_utc
+
+
+def test__get_project_windows():
+    # Setup
+    watermarks = {
+        'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-09')),
+        'rdt': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-01')),
+        'ctgan': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-10')),
+    }
+
+    # Run
+    windows = _get_project_windows(
+        ['sdv', 'rdt', 'ctgan', 'copulas'],
+        watermarks,
+        start_date=None,
+        end_date=datetime(2025, 3, 10),
+        max_days=30,
+    )
+
+    # Assert
+    assert windows == {
+        'sdv': (pd.Timestamp('2025-03-09'), pd.Timestamp('2025-03-10')),
+        'rdt': (pd.Timestamp('2025-03-01'), pd.Timestamp('2025-03-10')),
+        'copulas': (pd.Timestamp('2025-02-08'), pd.Timestamp('2025-03-10')),
+    }
+
+
+def test__get_project_windows_backfill():
+    # Setup
+    watermarks = {'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-10'))}
+
+    # Run
+    windows = _get_project_windows(
+        ['sdv'], watermarks, datetime(2024, 12, 1), datetime(2025, 3, 10), max_days=30
+    )
+
+    # Assert
+    assert windows == {'sdv': (pd.Timestamp('2024-12-01'), pd.Timestamp('2025-01-01'))}
+
+
+def test__get_windows_query():
+    # Setup
+    windows = {
+        'sdv': (pd.Timestamp('2025-03-09'), pd.Timestamp('2025-03-10')),
+        'rdt': (pd.Timestamp('2025-03-01'), pd.Timestamp('2025-03-10')),
+        'ctgan': (pd.Timestamp('2025-03-09'), pd.Timestamp('2025-03-10')),
+    }
+
+    # Run
+    query = _get_windows_query(windows)
+
+    # Assert
+    assert "timestamp >= '2025-03-01'\n    AND timestamp < '2025-03-10'" in query
+    assert (
+        "(file.project in ('rdt') AND timestamp >= '2025-03-01' AND timestamp < '2025-03-10')"
+        in query
+    )
+    assert (
+        "OR (file.project in ('sdv', 'ctgan') AND timestamp >= '2025-03-09'"
+        " AND timestamp < '2025-03-10')" in query
+    )
+
+
+def test__update_watermarks():
+    # Setup
+    watermarks = {'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-01'))}
+    windows = {
+        'sdv': (pd.Timestamp('2025-03-01'), pd.Timestamp('2025-03-10')),
+        'rdt': (pd.Timestamp('2025-03-01'), pd.Timestamp('2025-03-10')),
+    }
+
+    # Run
+    updated = _update_watermarks(watermarks, windows)
+
+    # Assert
+    assert updated == {
+        'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-10')),
+        'rdt': (pd.Timestamp('2025-03-01'), pd.Timestamp('2025-03-10')),
+    }
+
+
+def test__update_watermarks_recollects_last_day():
+    # Setup
+    today = pd.Timestamp(get_current_utc().date())
+    yesterday = today - pd.Timedelta(days=1)
+    watermarks = {'sdv': (pd.Timestamp('2025-01-01'), today - pd.Timedelta(days=5))}
+    windows = {'sdv': (today - pd.Timedelta(days=5), today)}
+
+    # Run
+    updated = _update_watermarks(watermarks, windows)
+    next_windows = _get_project_windows(
+        ['sdv'], updated, start_date=None, end_date=today + pd.Timedelta(days=1), max_days=30
+    )
+
+    # Assert
+    assert updated == {'sdv': (pd.Timestamp('2025-01-01'), yesterday)}
+    assert next_windows == {'sdv': (yesterday, today + pd.Timedelta(days=1))}
+
+
+def test__get_shards():
+    # Setup
+    windows = {
+        'sdv': (pd.Timestamp('2025-03-01'), pd.Timestamp('2025-03-10')),
+        'rdt': (pd.Timestamp('2025-03-08'), pd.Timestamp('2025-03-10')),
+    }
+
+    # Run
+    shards = _get_shards(windows, shard_days=7)
+
+    # Assert
+    assert shards == [
+        {'sdv': (pd.Timestamp('2025-03-01'), pd.Timestamp('2025-03-08'))},
+        {
+            'sdv': (pd.Timestamp('2025-03-08'), pd.Timestamp('2025-03-10')),
+            'rdt': (pd.Timestamp('2025-03-08'), pd.Timestamp('2025-03-10')),
+        },
+    ]
+
+
+def test__is_backfill():
+    # Setup
+    watermarks = {'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-10'))}
+    backfill = {'sdv': (pd.Timestamp('2024-12-01'), pd.Timestamp('2025-01-01'))}
+    forward = {'sdv': (pd.Timestamp('2025-03-10'), pd.Timestamp('2025-03-11'))}
+
+    # Run and Assert
+    assert _is_backfill(backfill, watermarks)
+    assert not _is_backfill(forward, watermarks)
+
+
+def test__get_shard_series_backfill_and_forward():
+    # Setup
+    watermarks = {
+        'sdv': (pd.Timestamp('2025-01-15'), pd.Timestamp('2025-03-01')),
+        'rdt': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-02-20')),
+    }
+    windows = {
+        'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-01-15')),
+        'rdt': (pd.Timestamp('2025-02-20'), pd.Timestamp('2025-03-01')),
+    }
+
+    # Run
+    shards = _get_shard_series(windows, watermarks, shard_days=7)
+    checkpoints = [watermarks]
+    for shard in shards:
+        checkpoints.append(_update_watermarks(checkpoints[-1], shard))
+
+    # Assert
+    assert shards == [
+        {'sdv': (pd.Timestamp('2025-01-08'), pd.Timestamp('2025-01-15'))},
+        {'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-01-08'))},
+        {'rdt': (pd.Timestamp('2025-02-20'), pd.Timestamp('2025-02-27'))},
+        {'rdt': (pd.Timestamp('2025-02-27'), pd.Timestamp('2025-03-01'))},
+    ]
+    assert [checkpoint['sdv'][0] for checkpoint in checkpoints[1:]] == [
+        pd.Timestamp('2025-01-08'),
+        pd.Timestamp('2025-01-01'),
+        pd.Timestamp('2025-01-01'),
+        pd.Timestamp('2025-01-01'),
+    ]
+    assert checkpoints[-1] == {
+        'sdv': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-01')),
+        'rdt': (pd.Timestamp('2025-01-01'), pd.Timestamp('2025-03-01')),
+    }
+
+
+def test_get_query_columns():
+    # Run
+    summary = get_query_columns('summary')
+    custom = get_query_columns('custom', profiles={'custom': ['version', 'timestamp']})
+    default_aggregate = get_query_columns(aggregate=True)
+
+    # Assert
+    assert summary == ['timestamp', 'project', 'version']
+    assert custom == ['timestamp', 'project', 'version']
+    assert 'type' not in default_aggregate
+    with pytest.raises(ValueError, match='Unknown query profile'):
+        get_query_columns('missing')
+
+
+def test__get_windows_query_summary_profile():
+    # Setup
+    windows = {'sdv': (pd.Timestamp('2025-03-09'), pd.Timestamp('2025-03-10'))}
+
+    # Run
+    query = _get_windows_query(windows, aggregate=True, columns=get_query_columns('summary'))
+
+    # Assert
+    assert 'details.' not in query
+    assert 'TIMESTAMP_TRUNC(timestamp, DAY) as timestamp' in query
+    assert 'GROUP BY 1, 2, 3' in query
+
+
+def test__get_history_gaps(tmp_path):
+    # Setup
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-01-01', '2025-01-03', '2025-01-06']),
+        'project': 'sdv',
+        'version': '1.0.0',
+    })
+    write_pypi_history(str(tmp_path), downloads, '2025-01-01', '2025-01-02')
+    write_pypi_history(str(tmp_path), downloads.iloc[1:], '2025-01-03', '2025-01-07')
+
+    # Run
+    gaps = _get_history_gaps(str(tmp_path), ['sdv', 'rdt'])
+
+    # Assert
+    assert gaps == {'sdv': [(pd.Timestamp('2025-01-02'), pd.Timestamp('2025-01-03'))]}
+
+
+def test__get_gap_rounds():
+    # Setup
+    gaps = {
+        'sdv': [
+            (pd.Timestamp('2025-01-02'), pd.Timestamp('2025-01-03')),
+            (pd.Timestamp('2025-01-05'), pd.Timestamp('2025-01-06')),
+        ],
+        'rdt': [(pd.Timestamp('2025-01-02'), pd.Timestamp('2025-01-04'))],
+    }
+
+    # Run
+    rounds = _get_gap_rounds(gaps)
+
+    # Assert
+    assert rounds == [
+        {
+            'sdv': (pd.Timestamp('2025-01-02'), pd.Timestamp('2025-01-03')),
+            'rdt': (pd.Timestamp('2025-01-02'), pd.Timestamp('2025-01-04')),
+        },
+        {'sdv': (pd.Timestamp('2025-01-05'), pd.Timestamp('2025-01-06'))},
+    ]
+
+
+def test__cluster_gaps():
+    # Setup
+    gaps = {
+        'sdv': [
+            (pd.Timestamp('2024-01-10'), pd.Timestamp('2024-01-11')),
+            (pd.Timestamp('2025-01-10'), pd.Timestamp('2025-01-11')),
+        ],
+        'rdt': [(pd.Timestamp('2024-01-14'), pd.Timestamp('2024-01-15'))],
+    }
+
+    # Run
+    clusters = _cluster_gaps(gaps)
+    queries = [_get_windows_query(_get_gap_rounds(cluster)) for cluster in clusters]
+
+    # Assert
+    assert clusters == [
+        {
+            'sdv': [(pd.Timestamp('2024-01-10'), pd.Timestamp('2024-01-11'))],
+            'rdt': [(pd.Timestamp('2024-01-14'), pd.Timestamp('2024-01-15'))],
+        },
+        {'sdv': [(pd.Timestamp('2025-01-10'), pd.Timestamp('2025-01-11'))]},
+    ]
+    assert "timestamp >= '2024-01-10'\n    AND timestamp < '2024-01-15'" in queries[0]
+    assert "timestamp >= '2025-01-10'\n    AND timestamp < '2025-01-11'" in queries[1]
@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from packaging.version import Version
+
+from pymetrics.history import write_pypi_history
+from pymetrics.summarize import (
+    _calculate_projects_count,
+    _get_count_index,
+    _load_counts,
+    summarize_downloads,
+)
+from pymetrics.time_utils import get_current_year
+
+
+def test__calculate_projects_count_weighted_by_downloads():
+    # Setup
+    downloads = pd.DataFrame({
+        'project': ['sdv', 'sdv', 'sdv', 'rdt'],
+        'version': ['1.0.0', '1.1.0', '1.2.0rc1', '1.0.0'],
+        'timestamp': pd.to_datetime(['2024-05-01', '2025-01-01', '2025-02-01', '2025-01-01']),
+        'downloads': [10, 5, 2, 7],
+    })
+    count_index = _get_count_index(downloads)
+
+    # Run
+    total = _calculate_projects_count(count_index, projects='sdv')
+    before = _calculate_projects_count(
+        count_index, projects='sdv', version='1.0.0', version_operator='<='
+    )
+    in_2025 = _calculate_projects_count(
+        count_index,
+        projects=['sdv'],
+        min_datetime=datetime(2025, 1, 1),
+        exclude_prereleases=True,
+    )
+
+    # Assert
+    assert total == 17
+    assert before == 10
+    assert in_2025 == 5
+
+
+def test__get_count_index():
+    # Setup
+    downloads = pd.DataFrame({
+        'project': ['sdv', 'sdv', 'sdv', 'rdt'],
+        'version': ['1.0', '1.0.0', '1.2.0rc1', '1.0.0'],
+        'timestamp': pd.to_datetime(['2025-01-01', '2025-03-01', '2025-02-01', '2024-01-01']),
+    })
+
+    # Run
+    count_index = _get_count_index(downloads)
+
+    # Assert
+    assert count_index.versions == [Version('1.0.0'), Version('1.2.0rc1')]
+    assert count_index.counts.to_dict('list') == {
+        'project': ['rdt', 'sdv', 'sdv'],
+        'year': [2024, 2025, 2025],
+        'version': [0, 0, 1],
+        'is_prerelease': [False, False, True],
+        'downloads': [1, 2, 1],
+    }
+
+
+def test__load_counts_incremental(tmp_path):
+    # Setup
+    output_folder = str(tmp_path)
+    current_year = get_current_year()
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2024-05-01', '2024-06-01', f'{current_year}-01-01']),
+        'project': ['sdv', 'sdv', 'sdv'],
+        'version': ['1.0', '1.0.0', '1.1.0'],
+    })
+    write_pypi_history(output_folder, downloads, '2024-05-01', f'{current_year}-01-02')
+
+    # Run
+    expected = _load_counts(output_folder, 'parquet', ['sdv', 'rdt'])
+    first = _load_counts(output_folder, 'parquet', ['sdv', 'rdt'], incremental=True)
+    second = _load_counts(output_folder, 'parquet', ['sdv', 'rdt'], incremental=True)
+
+    # Assert
+    assert expected.to_dict('list') == {
+        'project': ['sdv', 'sdv', 'sdv'],
+        'year': [2024, 2024, current_year],
+        'version': ['1.0', '1.0.0', '1.1.0'],
+        'downloads': [1, 1, 1],
+    }
+    assert first.to_dict('list') == expected.to_dict('list')
+    assert second.to_dict('list') == expected.to_dict('list')
+
+
+def test_summarize_downloads_incremental_csv(tmp_path):
+    # Run and Assert
+    with pytest.raises(ValueError, match='require the parquet storage'):
+        summarize_downloads([], [], str(tmp_path), storage='csv', incremental=True)
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from pymetrics.history import load_pypi_manifest, write_pypi_history
+from pymetrics.summary_state import load_summary_state, save_summary_state
+
+
+def test_load_summary_state(tmp_path):
+    # Setup
+    output_folder = str(tmp_path)
+    downloads = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2024-05-01', '2024-06-01', '2025-02-01']),
+        'project': ['sdv', 'sdv', 'rdt'],
+        'version': ['1.0.0', '1.1.0', '1.0.0'],
+    })
+    counts = pd.DataFrame({
+        'project': ['sdv', 'sdv'],
+        'year': [2024, 2024],
+        'version': ['1.0.0', '1.1.0'],
+        'downloads': [1, 1],
+    })
+    closed_until = pd.Timestamp('2025-01-01')
+    write_pypi_history(output_folder, downloads, '2024-05-01', '2025-02-02')
+    manifest = load_pypi_manifest(output_folder)
+    save_summary_state(output_folder, ['rdt', 'sdv'], counts, closed_until, manifest)
+
+    # Run
+    loaded = load_summary_state(output_folder, ['rdt', 'sdv'], closed_until, manifest)
+    other_year = load_summary_state(output_folder, ['sdv'], '2026-01-01', manifest)
+    missing = load_summary_state(output_folder, ['sdv', 'ctgan'], closed_until, manifest)
+    write_pypi_history(output_folder, downloads.iloc[1:], '2024-06-01', '2025-02-02')
+    stale = load_summary_state(
+        output_folder, ['sdv'], closed_until, load_pypi_manifest(output_folder)
+    )
+
+    # Assert
+    assert loaded.to_dict('list') == counts.to_dict('list')
+    assert other_year is None
+    assert missing is None
+    assert stale is None
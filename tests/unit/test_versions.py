@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from packaging.version import Version
+
+from pymetrics.versions import compare_versions, encode_versions, get_version_flags
+
+
+def test_encode_versions():
+    # Setup
+    values = pd.Series(['1.10.0', '1.9.0', 'invalid', np.nan, '1.9', '2.0.0rc1'])
+
+    # Run
+    ranks, versions = encode_versions(values)
+
+    # Assert
+    assert ranks.tolist() == [1, 0, -1, -1, 0, 2]
+    assert versions == [Version('1.9.0'), Version('1.10.0'), Version('2.0.0rc1')]
+    assert get_version_flags(ranks, versions, 'is_prerelease').tolist() == [
+        False,
+        False,
+        False,
+        False,
+        False,
+        True,
+    ]
+
+
+def test_compare_versions():
+    # Setup
+    ranks, versions = encode_versions(pd.Series(['0.17.1', '0.17.2', '0.18.0', 'invalid']))
+
+    # Run
+    before = compare_versions(ranks, versions, '<=', '0.17.2')
+    strictly_before = compare_versions(ranks, versions, '<', '0.17.2')
+    after = compare_versions(ranks, versions, '>', '0.17.1.post1')
+
+    # Assert
+    assert before.tolist() == [True, True, False, False]
+    assert strictly_before.tolist() == [True, False, False, False]
+    assert after.tolist() == [False, True, True, False]
+    with pytest.raises(ValueError, match='Unknown version operator'):
+        compare_versions(ranks, versions, '==', '0.17.2')